@@ -0,0 +1 @@
+"""Benchmarks of the ingestion, filtering, epoching and classification hot paths on synthetic or BNCI Horizon data"""
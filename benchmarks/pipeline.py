@@ -0,0 +1,218 @@
+import time
+import tracemalloc
+from typing import Optional
+
+import numpy as np
+
+from benchmarks.synthetic import SyntheticSession
+from bstadlbauer.p300analyzer.analysis_thread import AnalysisThread
+from bstadlbauer.p300analyzer.custom_filter import CustomBPFilter
+from bstadlbauer.p300analyzer.data import RecordedData
+from bstadlbauer.p300analyzer.replay import Replayer
+from bstadlbauer.p300analyzer.shared_buffers import SharedState
+
+LATENCY_PERCENTILES = (50, 90, 99)
+
+
+class Timer(object):
+    """Collects the durations of the calls (ticks) of one hot path, optionally with the peak traced memory"""
+
+    def __init__(self, trace_memory: bool = False):
+        self.trace_memory = trace_memory
+        self.durations = []
+        self.amount = 0
+        self.peak_memory = None
+        self.start = None
+
+    def __enter__(self):
+        if self.trace_memory:
+            tracemalloc.start()
+        return self
+
+    def __exit__(self, *args):
+        if self.trace_memory:
+            self.peak_memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+    def tick_start(self):
+        self.start = time.perf_counter()
+
+    def tick_stop(self, amount: int = 1):
+        """Ends a tick that processed amount units (e.g. samples or trials)"""
+        self.durations.append(time.perf_counter() - self.start)
+        self.amount += amount
+
+    def summary(self, unit: str):
+        durations = np.array(self.durations)
+        total = float(np.sum(durations))
+        result = {
+            "ticks": len(durations),
+            unit: self.amount,
+            "seconds": total,
+            "{} per second".format(unit): self.amount / total if total > 0 else None,
+            "latency ms": {"p{}".format(p): float(np.percentile(durations, p)) * 1000 for p in LATENCY_PERCENTILES},
+        }
+        result["latency ms"]["max"] = float(np.max(durations)) * 1000
+        if self.peak_memory is not None:
+            result["peak memory bytes"] = self.peak_memory
+        return result
+
+
+def create_data(session: SyntheticSession, filter_bool: bool, retention_seconds: Optional[float]):
+    data = RecordedData(filter_bool, retention_seconds)
+    data.set_samplerate(session.samplerate)
+    data.set_num_channel(session.num_channels)
+    return data
+
+
+def create_analysis(data: RecordedData):
+    settings = dict(Replayer.default_settings)
+    settings["samplerate"] = data.samplerate
+    shared_state = SharedState()
+    shared_state.update({"channel select": 0, "squared": 0})
+    return AnalysisThread(data, settings, None, None, None, shared_state)
+
+
+def bench_append_eeg_sample(session: SyntheticSession, filter_bool: bool, seconds: float):
+    """RecordedData.append_eeg_sample() and append_eeg_ts(), one tick per sample as in the sample-wise receiver"""
+    data = create_data(session, filter_bool, None)
+    timer = Timer()
+    for eeg, eeg_ts, _, _ in session.blocks(1024, int(seconds * session.samplerate)):
+        for sample, timestamp in zip(eeg, eeg_ts):
+            timer.tick_start()
+            data.append_eeg_sample(sample)
+            data.append_eeg_ts(timestamp)
+            timer.tick_stop()
+    return timer.summary("samples")
+
+
+def bench_filter(session: SyntheticSession, block_size: int):
+    """CustomBPFilter.filter() on blocks of block_size samples over the whole session"""
+    bandpass = CustomBPFilter(session.samplerate, session.num_channels, 4, 1, 30)
+    timer = Timer()
+    for eeg, _, _, _ in session.blocks(block_size):
+        timer.tick_start()
+        bandpass.filter(eeg)
+        timer.tick_stop(len(eeg))
+    return timer.summary("samples")
+
+
+def bench_session(
+    session: SyntheticSession,
+    block_size: int,
+    update_seconds: float,
+    retention_seconds: Optional[float],
+    trace_memory: bool,
+):
+    """Whole pipeline: filtered block ingestion (RecordedData.append_eeg_block()) with an analysis update
+    (AnalysisThread.analyze()) every update_seconds of EEG. Returns (results, data, analysis).
+
+    If the session knows its targets, the share of updates with a classification and the accuracy of these
+    classifications are added to the results.
+
+    Tracing memory slows down every allocation, so timings of a run with trace_memory are not representative.
+
+    """
+    data = create_data(session, True, retention_seconds)
+    analysis = create_analysis(data)
+    update_size = int(update_seconds * session.samplerate)
+
+    ingestion = Timer()
+    updates = Timer()
+    num_classified = 0
+    num_correct = 0
+    with Timer(trace_memory) as total:
+        next_update = update_size
+        for eeg, eeg_ts, markers, marker_ts in session.blocks(block_size):
+            ingestion.tick_start()
+            data.append_eeg_block(eeg, eeg_ts)
+            if len(markers) > 0:
+                data.append_marker_block(markers, marker_ts)
+            ingestion.tick_stop(len(eeg))
+
+            if data.get_num_eeg_samples() >= next_update:
+                updates.tick_start()
+                _, classification = analysis.analyze()
+                updates.tick_stop()
+                next_update += update_size
+
+                if classification is not None:
+                    num_classified += 1
+                    num_correct += classification == session.get_target(data.get_num_eeg_samples() - 1)
+
+    results = {"ingestion": ingestion.summary("samples"), "analysis": updates.summary("updates")}
+    seconds = results["ingestion"]["seconds"] + results["analysis"]["seconds"]
+    results["samples per second"] = session.num_samples / seconds
+    results["realtime factor"] = session.num_samples / session.samplerate / seconds
+    if session.get_target(0) is not None and len(updates.durations) > 0:
+        results["classified"] = num_classified / len(updates.durations)
+        results["accuracy"] = num_correct / num_classified if num_classified > 0 else None
+    if total.peak_memory is not None:
+        results["peak memory bytes"] = total.peak_memory
+    return results, data, analysis
+
+
+def bench_split_up_trials(data: RecordedData, analysis: AnalysisThread, repeats: int):
+    """AnalysisThread.split_up_trials() on all retained EEG and markers"""
+    num_samples = data.get_num_eeg_samples()
+    eeg = data.get_eeg_range(0, num_samples)
+    first_index = num_samples - len(eeg)
+    mapped = analysis.alignment.mapped.view()
+    mapped = mapped[mapped[:, 1] >= first_index]
+
+    timer = Timer()
+    for _ in range(repeats):
+        timer.tick_start()
+        trials, markers = analysis.split_up_trials(eeg, mapped[:, 0], mapped[:, 1] - first_index)
+        timer.tick_stop(len(trials))
+    return timer.summary("trials"), trials, markers
+
+
+def bench_classify_trials(analysis: AnalysisThread, trials, markers, repeats: int):
+    """AnalysisThread.classify_trials() on the trials cut out in bench_split_up_trials()"""
+    timer = Timer()
+    for _ in range(repeats):
+        timer.tick_start()
+        analysis.classify_trials(markers, trials)
+        timer.tick_stop()
+    return timer.summary("classifications")
+
+
+def run_configuration(
+    num_channels: int,
+    samplerate: float,
+    minutes: float,
+    block_size: int = 32,
+    update_seconds: float = 1.0,
+    retention_seconds: Optional[float] = 60,
+    sample_seconds: float = 10,
+    repeats: int = 20,
+    bnci_subject: Optional[int] = None,
+    trace_memory: bool = True,
+    snr: Optional[float] = None,
+):
+    """Runs all benchmarks for one configuration, returns a dict that can be dumped to JSON
+
+    If trace_memory is True, the session is run a second time to measure the peak memory (traced with tracemalloc).
+
+    """
+    session = SyntheticSession(num_channels, samplerate, minutes, bnci_subject=bnci_subject, snr=snr)
+    results = {
+        "num channels": session.num_channels,
+        "samplerate": session.samplerate,
+        "minutes": minutes,
+        "block size": block_size,
+        "retention seconds": retention_seconds,
+        "snr": snr,
+    }
+    results["append_eeg_sample"] = bench_append_eeg_sample(session, True, sample_seconds)
+    results["filter"] = bench_filter(session, block_size)
+    results["session"], data, analysis = bench_session(session, block_size, update_seconds, retention_seconds, False)
+    results["split_up_trials"], trials, markers = bench_split_up_trials(data, analysis, repeats)
+    results["classify_trials"] = bench_classify_trials(analysis, trials, markers, repeats)
+
+    if trace_memory:
+        # Separate run, as tracing memory distorts the timings
+        memory_results, _, _ = bench_session(session, block_size, update_seconds, retention_seconds, True)
+        results["session"]["peak memory bytes"] = memory_results["peak memory bytes"]
+    return results
@@ -0,0 +1,114 @@
+from typing import Optional
+
+import numpy as np
+
+
+class SyntheticSession(object):
+    """Synthetic P300 session streamed in blocks, as it would arrive from LSL
+
+    EEG is white noise (in volts, like the amplifier streams) with a P300-like bump 300 ms after every flash of the
+    target class. Flashes cycle through num_classes classes every flash_interval seconds. A noise block of ten seconds
+    is generated once and repeated, so sessions of any length cost no memory.
+
+    With an snr, the session is generated by testserver.synthetic.SyntheticData instead (colored noise, changing
+    targets, num_classes single symbol flashes). Instead of noise, the EEG and markers of a BNCI Horizon recording
+    (testserver.bcnidata.BCNIData) can be repeated, num_channels and samplerate are taken from the recording then.
+
+    Args:
+        num_channels: Number of EEG channels
+        samplerate: Samplerate in Hz
+        minutes: Length of the session in minutes
+        num_classes: Number of classes (rows and columns of the speller) flashed. Optional, defaults to 12
+        flash_interval: Seconds between two flashes. Optional, defaults to 0.125
+        bnci_subject: If given, the recording of this BNCI Horizon subject is used. Optional, defaults to None
+        snr: If given, the session is generated by testserver.synthetic.SyntheticData with this SNR. Optional,
+            defaults to None
+        seed: Seed of the random noise. Optional, defaults to 0
+
+    """
+
+    def __init__(
+        self,
+        num_channels: int,
+        samplerate: float,
+        minutes: float,
+        num_classes: int = 12,
+        flash_interval: float = 0.125,
+        bnci_subject: Optional[int] = None,
+        seed: int = 0,
+        snr: Optional[float] = None,
+    ):
+        self.num_classes = num_classes
+        self.target = 1
+        # Target marker of every sample of self.eeg, None if unknown
+        self.targets = None
+
+        if bnci_subject is None and snr is None:
+            self.num_channels = num_channels
+            self.samplerate = samplerate
+            self.eeg, self.markers = self.create_noise(flash_interval, np.random.RandomState(seed))
+            self.targets = np.full(len(self.eeg), self.target)
+        elif bnci_subject is None:
+            from testserver.synthetic import SyntheticData
+
+            synthetic_data = SyntheticData(
+                num_channels,
+                samplerate,
+                snr=snr,
+                num_rows=1,
+                num_cols=num_classes,
+                flash_interval=flash_interval,
+                seed=seed,
+            )
+            self.num_channels = num_channels
+            self.samplerate = samplerate
+            self.eeg = np.ascontiguousarray(synthetic_data.eeg_data.T, dtype=float)
+            self.markers = synthetic_data.markers
+            self.targets = synthetic_data.targets[:, 0]
+        else:
+            from testserver.bcnidata import BCNIData
+
+            bnci_data = BCNIData(bnci_subject)
+            self.num_channels = bnci_data.num_channels
+            self.samplerate = bnci_data.samplerate
+            self.eeg = np.ascontiguousarray(bnci_data.eeg_data.T, dtype=float)
+            self.markers = np.asarray(bnci_data.markers)
+
+        self.num_samples = int(minutes * 60 * self.samplerate)
+
+    def create_noise(self, flash_interval, random_state):
+        num_samples = int(10 * self.samplerate)
+        eeg = random_state.normal(0, 10e-6, (num_samples, self.num_channels))
+        markers = np.zeros(num_samples, dtype=int)
+
+        onsets = np.arange(0, num_samples, int(flash_interval * self.samplerate))
+        markers[onsets] = np.arange(len(onsets)) % self.num_classes + 1
+
+        bump_times = np.arange(int(self.samplerate)) / self.samplerate
+        bump = 5e-6 * np.exp(-((bump_times - 0.3) ** 2) / 0.005)
+        for onset in onsets[markers[onsets] == self.target]:
+            length = min(len(bump), num_samples - onset)
+            eeg[onset : onset + length] += bump[:length, np.newaxis]
+        return eeg, markers
+
+    def get_target(self, sample_index: int):
+        """Returns the target marker at sample_index of the session or None if unknown"""
+        if self.targets is None:
+            return None
+        return int(self.targets[sample_index % len(self.targets)])
+
+    def blocks(self, block_size: int, num_samples: Optional[int] = None):
+        """Yields blocks (eeg, eeg_ts, markers, marker_ts) of block_size samples over the session (or num_samples)
+
+        markers has shape (num_markers, 1) and holds only the non zero markers within the block.
+
+        """
+        if num_samples is None:
+            num_samples = self.num_samples
+        for start in range(0, num_samples, block_size):
+            indices = np.arange(start, min(start + block_size, num_samples))
+            eeg_ts = indices / self.samplerate
+            eeg = self.eeg[indices % len(self.eeg)]
+            markers = self.markers[indices % len(self.markers)]
+            flashed = markers != 0
+            yield eeg, eeg_ts, markers[flashed, np.newaxis], eeg_ts[flashed]
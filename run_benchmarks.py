@@ -0,0 +1,65 @@
+import argparse
+import itertools
+import json
+import platform
+import sys
+import time
+
+import numpy as np
+
+from benchmarks.pipeline import run_configuration
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the analyzer hot paths, results are written as JSON")
+    parser.add_argument("--channels", type=int, nargs="+", default=[8, 64, 256], help="Channel counts")
+    parser.add_argument("--samplerates", type=float, nargs="+", default=[256, 2048], help="Samplerates in Hz")
+    parser.add_argument("--minutes", type=float, nargs="+", default=[1], help="Session lengths in minutes")
+    parser.add_argument("--full", action="store_true", help="8 to 256 channels, 256 to 2048 Hz, 1 to 120 minutes")
+    parser.add_argument("--bnci-subject", type=int, help="Repeat this BNCI Horizon recording instead of noise")
+    parser.add_argument("--snr", type=float, help="Generate sessions with changing targets at this P300 SNR")
+    parser.add_argument("--block-size", type=int, default=32, help="Samples per received chunk")
+    parser.add_argument("--retention-seconds", type=float, default=60, help="Seconds of EEG kept in memory")
+    parser.add_argument("--no-memory", action="store_true", help="Skip the second session run measuring memory")
+    parser.add_argument("--output", help="File to write the JSON results to, stdout if unset")
+    args = parser.parse_args()
+
+    if args.full:
+        args.channels = [8, 32, 64, 128, 256]
+        args.samplerates = [256, 512, 1024, 2048]
+        args.minutes = [1, 10, 60, 120]
+    if args.bnci_subject is not None:
+        # Channels and samplerate are given by the recording
+        args.channels, args.samplerates = args.channels[:1], args.samplerates[:1]
+
+    results = {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "configurations": [],
+    }
+    for num_channels, samplerate, minutes in itertools.product(args.channels, args.samplerates, args.minutes):
+        print("Running {} channels, {} Hz, {} minutes".format(num_channels, samplerate, minutes), file=sys.stderr)
+        results["configurations"].append(
+            run_configuration(
+                num_channels,
+                samplerate,
+                minutes,
+                block_size=args.block_size,
+                retention_seconds=args.retention_seconds,
+                bnci_subject=args.bnci_subject,
+                trace_memory=not args.no_memory,
+                snr=args.snr,
+            )
+        )
+
+    if args.output is None:
+        print(json.dumps(results, indent=2))
+    else:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
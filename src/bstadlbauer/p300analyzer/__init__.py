@@ -8,14 +8,17 @@ After pressing 'Start Recording' and 'Start Analysis' an instance of analyzer.an
 be started, which does all the heavy lifting in averaging and classifying the EEG samples.
 
 The current setup is tested with an eego sports by ANT neuro, which has an internal reference subtraction. If this
-is not given, one can subtract a channel changing analyzer.data.RecordedData.append_eeg_sample. Examples lines of how
-to do this are in there but commented.
+is not given, one can subtract a channel (or the common average) by passing the reference argument to
+analyzer.data.RecordedData (set via "reference" in the connector dict of analyzer.connect.ConnectorProc).
+
+Without a display (e.g. on servers), the analyzer can run headless (start-analyzer --headless, see
+analyzer.main.main()). matplotlib and Tkinter are then never imported, both are only loaded once the GUI is started.
+
+Several participants can be monitored by one analyzer: every stream pair becomes an analyzer.sessions.Session with
+isolated data and state, all sessions are analyzed by one analyzer.sessions.AnalysisPool and plotted into one figure.
 
 """
 
 from multiprocessing import freeze_support
 
-import matplotlib
-
-matplotlib.use("Qt5Agg")  # MUST BE CALLED BEFORE IMPORTING matplotlib.pyplot
 freeze_support()
@@ -0,0 +1,159 @@
+from collections import deque
+
+import numpy as np
+
+import bstadlbauer.p300analyzer.data
+from bstadlbauer.p300analyzer.ring_buffer import RingBuffer
+
+
+class AlignmentIndex(object):
+    """Maps marker timestamps to EEG sample indices, every marker exactly once
+
+    New markers are mapped as soon as an EEG sample at or after their timestamp was recorded. By default a marker is
+    mapped to the sample with the closest timestamp, found with a binary search (numpy.searchsorted) over the
+    monotone EEG timestamps. With drift_correction, the EEG timestamps are instead smoothed by a line fitted with
+    exponentially decaying weights (time constant drift_window seconds), which removes timestamp jitter and follows
+    slow drifts between the clocks. Markers are mapped with this line then.
+
+    Mapped markers are stored in self.mapped (columns: marker, absolute sample index), markers that were sent before
+    the first retained EEG sample are dropped.
+
+    Args:
+        data: Recorded data the EEG timestamps and markers are taken from
+        drift_correction: If True, markers are mapped using the smoothed EEG clock. Optional, defaults to False
+        drift_window: Time constant in seconds of the exponential weighting in drift correction. Optional, defaults
+            to 60
+
+    """
+
+    def __init__(
+        self,
+        data: "bstadlbauer.p300analyzer.data.RecordedData",
+        drift_correction: bool = False,
+        drift_window: float = 60,
+    ):
+        self.data = data
+        self.drift_correction = drift_correction
+        self.clock = SmoothedClock(drift_window * data.samplerate) if drift_correction else None
+
+        self.num_eeg_samples = 0
+        self.num_received_markers = 0
+        self.pending_markers = deque()
+        self.mapped = RingBuffer(2, dtype=np.int64, initial_capacity=256)
+
+    def update(self):
+        """Maps all markers whose timestamp is covered by the EEG recorded so far, returns the number mapped"""
+        num_samples = self.data.get_num_eeg_samples()
+        if num_samples > self.num_eeg_samples:
+            if self.clock is not None:
+                new_eeg_ts = self.data.get_eeg_ts_range(self.num_eeg_samples, num_samples)
+                self.clock.update(new_eeg_ts, num_samples - len(new_eeg_ts))
+            self.num_eeg_samples = num_samples
+
+        num_markers = self.data.get_num_markers()
+        if num_markers > self.num_received_markers:
+            new_markers, new_marker_ts = self.data.get_marker_range(self.num_received_markers, num_markers)
+            self.pending_markers.extend(zip(new_markers[:, 0], new_marker_ts))
+            self.num_received_markers = num_markers
+
+        if not self.pending_markers or num_samples == 0:
+            return 0
+
+        eeg_ts = self.data.get_eeg_ts_range(0, num_samples)
+        first_index = num_samples - len(eeg_ts)
+        pending_markers = np.array(self.pending_markers)
+        # Markers arrive in order, only those up to the newest EEG sample can be mapped
+        num_ready = int(np.searchsorted(pending_markers[:, 1], eeg_ts[-1], "right"))
+        if num_ready == 0:
+            return 0
+        for _ in range(num_ready):
+            self.pending_markers.popleft()
+
+        markers = pending_markers[:num_ready, 0].astype(np.int64)
+        marker_ts = pending_markers[:num_ready, 1]
+        if self.clock is not None and self.clock.is_ready:
+            marker_ind = self.clock.predict(marker_ts)
+        else:
+            marker_ind = nearest_indices(eeg_ts, marker_ts) + first_index
+
+        retained = marker_ind >= first_index
+        if len(eeg_ts) > 1:
+            # Allow for rounding to the first sample, but not for markers sent long before it
+            retained &= marker_ts >= eeg_ts[0] - (eeg_ts[1] - eeg_ts[0])
+        self.mapped.extend(np.column_stack([markers[retained], marker_ind[retained]]))
+        return int(np.sum(retained))
+
+
+def nearest_indices(timestamps, values):
+    """Returns the indices of the closest entries in the sorted array timestamps for every value in values"""
+    right = np.clip(np.searchsorted(timestamps, values), 1, len(timestamps) - 1)
+    if len(timestamps) == 1:
+        return np.zeros(len(right), dtype=int)
+    left = right - 1
+    closer_left = np.abs(values - timestamps[left]) <= np.abs(timestamps[right] - values)
+    return np.where(closer_left, left, right)
+
+
+class SmoothedClock(object):
+    """Line through EEG timestamps over sample indices, fitted by exponentially weighted least squares
+
+    Weighted sums are decayed by one factor per sample and kept relative to the newest sample, so updates cost
+    O(number of new samples) and stay numerically stable in long sessions.
+
+    Args:
+        time_constant: Number of samples after which the weight of a sample dropped to 1/e
+
+    """
+
+    def __init__(self, time_constant: float):
+        self.decay = np.exp(-1.0 / time_constant)
+
+        self.ref_index = None
+        self.ref_ts = None
+        # Weighted sums of 1, i, i^2, t and i*t with i and t relative to ref_index and ref_ts
+        self.sums = np.zeros(5)
+
+    def update(self, timestamps, first_index: int):
+        """Adds timestamps of consecutive samples, the first of which has the absolute sample index first_index"""
+        count = len(timestamps)
+        if count == 0:
+            return
+        if self.ref_index is None:
+            self.ref_index = first_index
+            self.ref_ts = float(timestamps[0])
+
+        # Move reference to the newest sample
+        shift = first_index + count - 1 - self.ref_index
+        sum_1, sum_i, sum_ii, sum_t, sum_it = self.sums
+        sum_ii = sum_ii - 2 * shift * sum_i + shift ** 2 * sum_1
+        sum_it = sum_it - shift * sum_t
+        sum_i = sum_i - shift * sum_1
+        self.ref_index += shift
+
+        indices = np.arange(-count + 1, 1, dtype=float)
+        values = np.asarray(timestamps, dtype=float) - self.ref_ts
+        weights = self.decay ** -indices
+        decay = self.decay ** count
+        self.sums = np.array(
+            [
+                sum_1 * decay + np.sum(weights),
+                sum_i * decay + np.sum(weights * indices),
+                sum_ii * decay + np.sum(weights * indices ** 2),
+                sum_t * decay + np.sum(weights * values),
+                sum_it * decay + np.sum(weights * indices * values),
+            ]
+        )
+
+    @property
+    def is_ready(self):
+        """True as soon as timestamps of two different samples were added"""
+        sum_1, sum_i, sum_ii, _, _ = self.sums
+        return sum_1 * sum_ii - sum_i ** 2 > 0
+
+    def predict(self, timestamps):
+        """Returns the (rounded) absolute sample indices for timestamps"""
+        sum_1, sum_i, sum_ii, sum_t, sum_it = self.sums
+        slope = (sum_1 * sum_it - sum_i * sum_t) / (sum_1 * sum_ii - sum_i ** 2)
+        intercept = (sum_t - slope * sum_i) / sum_1
+        indices = (np.asarray(timestamps, dtype=float) - self.ref_ts - intercept) / slope
+        return np.rint(indices).astype(int) + self.ref_index
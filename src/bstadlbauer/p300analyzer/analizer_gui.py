@@ -3,6 +3,8 @@ from typing import Dict
 
 from pylsl import resolve_byprop
 
+from bstadlbauer.p300analyzer.shared_buffers import SharedState
+
 
 class MainWindow(mp.Process):
     """Defines the main control window and all its control logic.
@@ -12,6 +14,8 @@ class MainWindow(mp.Process):
 
     Args:
         connector_dict: Dictionary create by calling multiprocessing.Manger().dict()
+        shared_state: Shared state (analyzer.shared_buffers.SharedState) for settings and counters that are read in
+            hot loops
         message_q: Queue that will be polled every few seconds. Elements in queue will be plotted to the internal
             text field.
         start_analysis_e: Event signaling if analysis can be started
@@ -24,6 +28,7 @@ class MainWindow(mp.Process):
     def __init__(
         self,
         connector_dict: Dict,
+        shared_state: SharedState,
         message_q: mp.Queue,
         start_recording_e: mp.Event,
         start_analysis_e: mp.Event,
@@ -33,6 +38,7 @@ class MainWindow(mp.Process):
     ):
         super().__init__()
         self.connector_dict = connector_dict
+        self.shared_state = shared_state
         self.message_q = message_q
         self.start_recording_e = start_recording_e
         self.start_analysis_e = start_analysis_e
@@ -266,8 +272,8 @@ class MainWindow(mp.Process):
         self.start_analysis_btn.configure(state="normal")
 
     def update_recording_time(self):
-        num_samples = self.connector_dict["sample count"]
-        samplerate = self.connector_dict["samplerate"]
+        num_samples = self.shared_state["sample count"]
+        samplerate = self.connector_dict["stream samplerate"]
         number_of_seconds = int(num_samples / samplerate)
 
         minutes = number_of_seconds // 60
@@ -331,14 +337,18 @@ class MainWindow(mp.Process):
 
     # noinspection PyUnusedLocal
     def update_connector_dict(self, event=None):
-        self.connector_dict["update interval"] = self.update_interval.get()
-        self.connector_dict["channel select"] = self.channel_select.get()
+        self.shared_state.update(
+            {
+                "update interval": self.update_interval.get(),
+                "channel select": self.channel_select.get(),
+                "y lim": [self.y_min.get(), self.y_max.get()],
+                "squared": self.squared_check.get(),
+            }
+        )
         self.connector_dict["eeg streamname"] = self.eeg_stream.get()
         self.connector_dict["marker streamname"] = self.marker_stream.get()
-        self.connector_dict["y lim"] = [self.y_min.get(), self.y_max.get()]
         self.connector_dict["savefile"] = self.save_filename.get()
         self.connector_dict["filter"] = self.filter_check.get()
-        self.connector_dict["squared"] = self.squared_check.get()
 
     def connect_streams(self):
         self.eeg_stream_combobox.configure(state="disabled")
@@ -0,0 +1,98 @@
+import multiprocessing as mp
+import signal
+import time
+from threading import Thread
+from typing import Dict, Optional
+
+from bstadlbauer.p300analyzer.analysis_thread import AnalysisThread
+from bstadlbauer.p300analyzer.data import RecordedData
+from bstadlbauer.p300analyzer.results import ResultWriter
+from bstadlbauer.p300analyzer.shared_buffers import (
+    LatestValueBuffer,
+    SharedRingBuffer,
+    SharedState,
+)
+
+
+class AnalysisProcess(mp.Process):
+    """Runs the analysis of analyzer.analysis_thread.AnalysisThread in its own process (and thereby on its own core)
+
+    The receiving process publishes the preprocessed EEG and the markers in shared memory (see
+    analyzer.data.RecordedData.share()). A thread in this process copies new rows into a local
+    analyzer.data.RecordedData, which only retains retention_seconds of data, and the AnalysisThread logic runs on it.
+    Results come back the same way as from an AnalysisThread (plot_buffer, axis_queue, message_q, result writer).
+    Latency probes of the analysis are not available across processes, the timestamps in plot_buffer are.
+
+    Args:
+        shared_eeg: Shared EEG samples with the timestamp in the last column
+        shared_markers: Shared markers with the timestamp in the last column
+        connect_dict: Same as for AnalysisThread
+        message_q: Same as for AnalysisThread
+        plot_buffer: Same as for AnalysisThread
+        axis_queue: Same as for AnalysisThread
+        shared_state: Same as for AnalysisThread
+        output: If given, results are written to this target (see analyzer.results.ResultWriter). Optional, defaults
+            to None
+        retention_seconds: Seconds of data kept in this process. Optional, defaults to self.default_retention_seconds
+        poll_interval: Seconds between two checks for new rows in the shared buffers. Optional, defaults to 0.005
+
+    """
+
+    default_retention_seconds = 60
+
+    def __init__(
+        self,
+        shared_eeg: SharedRingBuffer,
+        shared_markers: SharedRingBuffer,
+        connect_dict: Dict,
+        message_q: mp.Queue,
+        plot_buffer: LatestValueBuffer,
+        axis_queue: mp.Queue,
+        shared_state: SharedState,
+        output: Optional[str] = None,
+        retention_seconds: float = default_retention_seconds,
+        poll_interval: float = 0.005,
+    ):
+        mp.Process.__init__(self)
+        self.shared_eeg = shared_eeg
+        self.shared_markers = shared_markers
+        self.connect_dict = connect_dict
+        self.message_q = message_q
+        self.plot_buffer = plot_buffer
+        self.axis_queue = axis_queue
+        self.shared_state = shared_state
+        self.output = output
+        self.retention_seconds = retention_seconds
+        self.poll_interval = poll_interval
+
+    def run(self):
+        # Interrupts are handled by the parent process, which terminates this (daemon) process
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+        data = RecordedData(False, self.retention_seconds)
+        data.set_samplerate(self.connect_dict["samplerate"])
+        data.set_num_channel(self.shared_eeg.num_columns - 1)
+
+        Thread(target=self.copy_shared_data, args=(data,), daemon=True).start()
+
+        result_writer = None if self.output is None else ResultWriter(self.output)
+        analysis = AnalysisThread(
+            data, self.connect_dict, self.message_q, self.plot_buffer, self.axis_queue, self.shared_state, result_writer
+        )
+        analysis.run()
+
+    def copy_shared_data(self, data: RecordedData):
+        """Appends new rows of the shared buffers to data"""
+        num_eeg_read = 0
+        num_markers_read = 0
+        while True:
+            eeg, num_eeg_read = self.shared_eeg.read(num_eeg_read)
+            if len(eeg) > 0:
+                data.append_eeg_block(eeg[:, :-1], eeg[:, -1], preprocessed=True)
+
+            markers, num_markers_read = self.shared_markers.read(num_markers_read)
+            if len(markers) > 0:
+                data.append_marker_block(markers[:, :-1].astype(int), markers[:, -1])
+
+            if len(eeg) == 0 and len(markers) == 0:
+                time.sleep(self.poll_interval)
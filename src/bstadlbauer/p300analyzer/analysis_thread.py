@@ -1,28 +1,65 @@
 import multiprocessing as mp
 import time
 from threading import Thread
-from typing import Dict
+from typing import Dict, Optional
 
 import numpy as np
 
 import bstadlbauer.p300analyzer.data
+from bstadlbauer.p300analyzer.alignment import AlignmentIndex
+from bstadlbauer.p300analyzer.averaging import RunningAverager
+from bstadlbauer.p300analyzer.epoching import extract_epochs, get_epoch_samples
+from bstadlbauer.p300analyzer.evidence import EvidenceAccumulator
+from bstadlbauer.p300analyzer.latency import LatencyProbes
+from bstadlbauer.p300analyzer.results import ResultWriter
+from bstadlbauer.p300analyzer.shared_buffers import LatestValueBuffer, SharedState
+from bstadlbauer.p300analyzer.spatial_filter import SpatialFilter, decimate
+
+# Minimum number of trials per class needed for (and used in) a classification
+EPOCHS_FOR_CLASSIFICATION = 6
+# Seconds between two checks for changed settings while waiting for new trials
+SETTINGS_POLL_INTERVAL = 0.2
 
 
 class AnalysisThread(Thread):
     """Thread doing all the heavy lifting in the averaging and classification
 
-    Data is taken from an analyzer.data.RecordData object (AnalysisThread performs read only operations).
-    Averaged data is pushed into self.plotting_queue, if y-axis limits are changed in GUI this is registered here
+    Data is taken from an analyzer.data.RecordData object (AnalysisThread performs read only operations). Every
+    new marker is mapped to its EEG sample once (analyzer.alignment.AlignmentIndex). Every update only epochs the
+    trials completed since the last update and adds them to per-class running averages
+    (analyzer.averaging.RunningAverager), so the cost of an update does not grow with the length of the session.
+    Averaged data is written into self.plot_buffer, if y-axis limits are changed in GUI this is registered here
     and new limits are pushed into self.axis_queue
 
+    By default, classes are scored on the channel selected in the GUI. With connect_dict["classifier"] set to
+    "spatial", all channels are combined by spatial filters (analyzer.spatial_filter.SpatialFilter) learned from the
+    streaming trials, and classes are scored on the decimated, spatially filtered features.
+
+    With a confidence threshold in connect_dict["dynamic stopping"], classifications are not made on a fixed number
+    of trials. Instead, the evidence for every class is updated with every trial (analyzer.evidence.EvidenceAccumulator)
+    and a class is selected as soon as its posterior reaches the threshold, after which a new selection starts.
+
+    Updates are event driven: the thread sleeps until the data store signals that enough samples for the next trial
+    were recorded (or settings changed). Updates are at least "update interval" seconds apart, trials completed in
+    between are handled together in the next update. Instead of starting the thread, self.poll() can be called
+    repeatedly to update without blocking, e.g. by the workers of an analyzer.sessions.AnalysisPool.
+
     Args:
         connect_dict: Instance of multiprocessing.Manager().dict(). Holds all the configuration and variables from
-            the GUI
+            the GUI that rarely change
         message_q: One can push elements that should be printed in the GUI here
-        plotting_queue: This thread will push new y-values that should be plotted into this queue. Elements pushed are
-            of type numpy.array and have shape (num_classes, samplerate) as one second (= samplerate samples) are
-            plotted.
+        plot_buffer: This thread will write new y-values that should be plotted into this buffer. Values written are
+            of type numpy.array and have shape (num_classes, num_samples) where num_samples is the number of samples
+            from connect_dict["epoch start"] to connect_dict["epoch end"] (one second by default). Only the latest
+            value is kept, so a slow plotter never falls behind.
         axis_queue: This thread will push new y-axis limits into this queue. The format should be Tuple[min_y, max_y]
+        shared_state: Shared state holding the settings read in every update ("channel select", "y lim",
+            "update interval" (minimal seconds between two updates) and "squared")
+        result_writer: If given, averages, classification and channel ranking of every update are also written to
+            it (e.g. in headless mode). Optional, defaults to None
+        latency_probes: If given, the age of the newest sample analyzed is probed after every update ("analysis").
+            Its timestamp is passed on with the averages in plot_buffer. Optional, defaults to None
+        message_prefix: Prepended to all messages, e.g. to tell sessions apart. Optional, defaults to ""
 
     """
 
@@ -31,56 +68,75 @@ class AnalysisThread(Thread):
         data: bstadlbauer.p300analyzer.data.RecordedData,
         connect_dict: Dict,
         message_q: mp.Queue,
-        plotting_queue: mp.Queue,
+        plot_buffer: LatestValueBuffer,
         axis_queue: mp.Queue,
+        shared_state: SharedState,
+        result_writer: Optional[ResultWriter] = None,
+        latency_probes: Optional[LatencyProbes] = None,
+        message_prefix: str = "",
     ):
         Thread.__init__(self)
 
         self.data = data
         self.connect_dict = connect_dict
         self.samplerate = connect_dict["samplerate"]
+        self.num_pre, self.num_post = get_epoch_samples(
+            self.samplerate, connect_dict["epoch start"], connect_dict["epoch end"]
+        )
+        self.baseline = None
+        if connect_dict["baseline"] is not None:
+            self.baseline = tuple(int(round(second * self.samplerate)) for second in connect_dict["baseline"])
         self.message_q = message_q
-        self.plotting_queue = plotting_queue
+        self.plot_buffer = plot_buffer
         self.axis_queue = axis_queue
+        self.shared_state = shared_state
+        self.result_writer = result_writer
+        self.latency_probes = latency_probes
+        self.message_prefix = message_prefix
 
         self.figure = None
         self.axes = None
         self.lines = []
 
-    @staticmethod
-    def create_mapped_markers(marker, marker_ts, eeg_ts):
-        y_axis = range(len(eeg_ts))
-        coeff = np.polyfit(eeg_ts, y_axis, 1)
-
-        marker_ind = np.rint(np.polyval(coeff, marker_ts)).astype(int)
-
-        # Hack to prevent last element from being rounded up and being out of bounds
-        out_of_bounds = marker_ind - len(eeg_ts)
-        out_of_bounds_ind = out_of_bounds >= 0
-
-        marker_ind[out_of_bounds_ind] = len(eeg_ts) - 1
-        if marker_ind[-1] == len(eeg_ts):
-            marker_ind[-1] -= 1
-
-        mapped_markers = np.zeros([len(eeg_ts), 1])
-        mapped_markers[marker_ind] = marker
-
-        return mapped_markers.astype(int), marker_ind
-
-    def split_up_trials(self, eeg, marker, marker_indices):
-        trials_temp = []
-        markers_temp = []
-
-        for ind in marker_indices:
-            trial = eeg[ind : ind + int(self.samplerate), :]
-
-            # Check to get only complete 1 Second (samplerate samples)  trial
-            if len(trial) == int(self.samplerate):
-                trials_temp.append(eeg[ind : ind + int(self.samplerate), :])
-                markers_temp.append(marker[ind])
-
-        trials = np.array(trials_temp)
-        markers_short = np.array(markers_temp)
+        self.averager = RunningAverager(30, EPOCHS_FOR_CLASSIFICATION)
+        # Channels sorted from the best to the worst separation of the classes in the last classification, reported
+        # with every update
+        self.channel_ranking = None
+        self.alignment = AlignmentIndex(data, connect_dict["drift correction"], connect_dict["drift window"])
+        self.num_epoched_markers = 0
+
+        # Samples of the epochs used as features in the classification
+        self.features = slice(
+            int(connect_dict["feature window"][0] * self.samplerate) + self.num_pre,
+            int(connect_dict["feature window"][1] * self.samplerate) + self.num_pre,
+        )
+        self.decimation = connect_dict["feature decimation"]
+        self.spatial_filter = None
+        if connect_dict["classifier"] == "spatial":
+            self.spatial_filter = SpatialFilter(data.num_chan, connect_dict["spatial filters"])
+        self.evidence = None
+        if connect_dict["dynamic stopping"] is not None:
+            self.evidence = EvidenceAccumulator(
+                connect_dict["num rows"] * connect_dict["num cols"],
+                connect_dict["dynamic stopping"],
+                max_trials=connect_dict["max trials"],
+            )
+        # Selections made by dynamic stopping since the last update
+        self.selections = []
+        # Spatial filters (fitted at the first trial of a selection) and channel the evidence of the current selection
+        # is accumulated on, features of different filters or channels must not be mixed in one selection
+        self.evidence_filters = None
+        self.evidence_channel = None
+
+        self.current_ylim = shared_state["y lim"]
+        self.settings_version = shared_state.version
+        self.all_markers_sent = False
+        self.last_update = 0.0
+
+    def split_up_trials(self, eeg, markers, marker_indices):
+        """Cuts out the trials after marker_indices, markers holds the marker sent at each of marker_indices"""
+        trials, kept = extract_epochs(eeg, marker_indices, self.num_post, self.num_pre, self.baseline)
+        markers_short = np.asarray(markers)[kept]
 
         return trials, markers_short
 
@@ -93,92 +149,233 @@ class AnalysisThread(Thread):
             trial_ind_true = np.where(markers == marker)
             trial_ind = trial_ind_true[0][-30:]
 
-            if self.connect_dict["squared"] == 1:
+            if self.shared_state["squared"] == 1:
                 avg_trials.append(np.mean(trials[trial_ind], 0) ** 2)
             else:
                 avg_trials.append(np.mean(trials[trial_ind], 0))
         return np.array(avg_trials)
 
+    def update_trials(self):
+        """Epochs all trials whose window was fully recorded since the last call and averages them"""
+        self.alignment.update()
+        num_samples = self.data.get_num_eeg_samples()
+
+        new_markers = self.alignment.mapped.view(self.num_epoched_markers)
+        # Markers arrive in order, so only a leading part of the new trials can be complete
+        num_complete = int(np.searchsorted(new_markers[:, 1] + self.num_post > num_samples, True))
+        if num_complete == 0:
+            return
+        new_markers = new_markers[:num_complete]
+        self.num_epoched_markers += num_complete
+
+        # Trials starting before the first retained sample cannot be completed and are dropped in extract_epochs
+        first_ind = max(int(new_markers[0, 1]) - self.num_pre, 0)
+        eeg = self.data.get_eeg_range(first_ind, num_samples)
+        first_ind = num_samples - len(eeg)
+        trials, kept = extract_epochs(
+            eeg, new_markers[:, 1] - first_ind, self.num_post, self.num_pre, self.baseline, lazy=True
+        )
+        for marker, trial in zip(new_markers[kept, 0], trials):
+            self.averager.add_trial(int(marker), trial)
+            if self.spatial_filter is not None:
+                self.spatial_filter.add_trial(decimate(trial[self.features], self.decimation))
+
+        if self.evidence is not None:
+            self.accumulate_evidence(new_markers[kept, 0], trials)
+
+    def accumulate_evidence(self, markers, trials):
+        """Adds the decimated features of the selected channel (or of the spatial filters) of new trials to the
+        evidence one trial at a time, selections made are appended to self.selections
+
+        The spatial filters are fitted at the first trial of every selection and kept until the selection is made, as
+        the sign and scale of refitted filters are arbitrary. If the selected channel changes, the evidence collected
+        on the previous channel is discarded.
+
+        """
+        features = decimate(np.asarray(trials)[:, self.features], self.decimation)
+        channel = self.shared_state["channel select"]
+        if self.spatial_filter is None and channel != self.evidence_channel:
+            self.evidence.reset()
+            self.evidence_channel = channel
+
+        for marker, trial_features in zip(markers, features):
+            if self.spatial_filter is not None:
+                if self.evidence_filters is None:
+                    self.evidence_filters = self.spatial_filter.fit(
+                        decimate(self.averager.get_averages()[:, self.features], self.decimation)
+                    )
+                trial_features = trial_features @ self.evidence_filters
+            else:
+                trial_features = trial_features[:, channel]
+
+            self.evidence.add_trial(int(marker), trial_features)
+            selection = self.evidence.decide()
+            if selection is not None:
+                self.selections.append(selection)
+                self.evidence_filters = None
+
     def classify_trials(self, markers, trials):
-        trials = np.swapaxes(trials, 0, 2)
+        """Classifies the last EPOCHS_FOR_CLASSIFICATION trials of every class (trials in recording order)"""
         markers = np.squeeze(markers)
-        marker_set = list(set(list(markers)))
-        marker_set.sort()
+        marker_set = np.unique(markers)
 
-        epochs_for_classification = 6
+        last_trials = [trials[markers == marker][-EPOCHS_FOR_CLASSIFICATION:] for marker in marker_set]
+        counts = np.array([len(trials_one_marker) for trials_one_marker in last_trials])
+        sums = np.array([np.sum(trials_one_marker, axis=0) for trials_one_marker in last_trials])
+        squares = np.array([np.sum(trials_one_marker ** 2, axis=0) for trials_one_marker in last_trials])
 
-        # Make sure that a minimum amount of trials per class are available
-        for marker in marker_set:
-            if np.sum(markers == marker) < epochs_for_classification:
-                return None
+        return self.classify_statistics(counts, sums, squares)
 
-        channel_to_use = self.connect_dict["channel select"]
+    def classify_statistics(self, counts, sums, squares):
+        """Classifies using per-class counts, sums and sums of squares of the trials (see
+        analyzer.averaging.RunningAverager.get_statistics()), scoring all channels at once"""
+        # Make sure that a minimum amount of trials per class are available
+        if len(counts) == 0 or np.min(counts) < EPOCHS_FOR_CLASSIFICATION:
+            return None
 
-        start_feature_second = 0.2
-        end_feature_second = 0.5
-        start_feature = int(start_feature_second * self.samplerate)
-        end_feature = int(end_feature_second * self.samplerate)
+        scores = fisher_scores(counts, sums[:, self.features], squares[:, self.features])
+        self.channel_ranking = rank_channels(scores)
 
-        fields = []
-        for marker in marker_set:
-            trials_one_marker = trials[:, :, markers == marker]
-            fields.append(trials_one_marker[channel_to_use, start_feature:end_feature, -epochs_for_classification:])
-        fields = np.array(fields)
-
-        scores = []
-        for field_nr, field in enumerate(fields):
-            target_data = fields[field_nr, :, :]
-            non_target_list = list(range(len(fields)))
-            non_target_list.remove(field_nr)
-            non_target_data = np.hstack(fields[non_target_list, :, :])
-            scores.append(fisher_criterion(target_data, non_target_data))
-
-        classification_result = classify(scores)
+        if self.spatial_filter is not None:
+            return classify(self.score_spatially_filtered())
+        classification_result = classify(scores[:, self.shared_state["channel select"]])
         return classification_result
 
-    def print_to_console(self, message):
-        self.message_q.put(message)
+    def score_spatially_filtered(self):
+        """Returns the scores of all classes on the spatially filtered features of the last trials, summed over the
+        filters"""
+        averages = decimate(self.averager.get_averages()[:, self.features], self.decimation)
+        filters = self.spatial_filter.fit(averages)
+
+        markers, trials = self.averager.get_window_trials(EPOCHS_FOR_CLASSIFICATION)
+        filtered = decimate(trials[:, self.features], self.decimation) @ filters
+        marker_set = np.unique(markers)
+        counts = np.array([np.sum(markers == marker) for marker in marker_set])
+        sums = np.array([np.sum(filtered[markers == marker], axis=0) for marker in marker_set])
+        squares = np.array([np.sum(filtered[markers == marker] ** 2, axis=0) for marker in marker_set])
+        return np.sum(fisher_scores(counts, sums, squares), axis=1)
+
+    def analyze(self):
+        """Epochs and averages all newly completed trials and classifies them
+
+        Returns:
+            Tuple (avg_trials, classification) of the averages of all classes with shape (num_classes, num_samples,
+            num_channels) and the classified class (counting from one) or None if no class stands out
+
+        """
+        self.update_trials()
+
+        settings = self.shared_state.get_settings()
+        avg_trials = self.averager.get_averages(settings["squared"] == 1)
+
+        if self.evidence is not None:
+            # Only the last selection of this update is reported
+            selections, self.selections = self.selections, []
+            classification = None
+            if len(selections) > 0:
+                classification = self.averager.get_markers().index(selections[-1])
+        else:
+            classification = self.classify_statistics(*self.averager.get_statistics())
+        if type(classification) == int:
+            classification = classification + 1
+        return avg_trials, classification
+
+    def get_next_completion(self):
+        """Returns the number of recorded samples at which the next trial will be complete at the earliest or None if
+        no marker is waiting for its trial"""
+        if self.alignment.mapped.total > self.num_epoched_markers:
+            next_marker = self.alignment.mapped.view(self.num_epoched_markers, self.num_epoched_markers + 1)
+            return int(next_marker[0, 1]) + self.num_post
+        if self.alignment.pending_markers:
+            # Markers are only pending while they are newer than the newest sample
+            return self.alignment.num_eeg_samples + self.num_post
+        return None
 
-    def run(self):
-        num_rows = self.connect_dict["num rows"]
-        num_cols = self.connect_dict["num cols"]
-        current_ylim = self.connect_dict["y lim"]
+    def wait_for_trial(self, settings_version: int):
+        """Blocks until a new trial was completely recorded or the settings differ from settings_version"""
+        while self.shared_state.version == settings_version:
+            self.alignment.update()
+            next_completion = self.get_next_completion()
+            if next_completion is None:
+                self.data.wait_for_data(
+                    num_markers=self.alignment.num_received_markers + 1, timeout=SETTINGS_POLL_INTERVAL
+                )
+            elif self.data.get_num_eeg_samples() >= next_completion:
+                return
+            else:
+                self.data.wait_for_data(num_samples=next_completion, timeout=SETTINGS_POLL_INTERVAL)
 
-        min_diff_markers = num_rows * num_cols
+    def print_to_console(self, message):
+        self.message_q.put(self.message_prefix + message)
+
+    def check_markers(self):
+        """Returns True once every class was flashed"""
+        if not self.all_markers_sent:
+            min_diff_markers = self.connect_dict["num rows"] * self.connect_dict["num cols"]
+            # Do not count last 20 markers because they might not be fully recorded
+            self.all_markers_sent = len(set(self.data.get_marker_numpy()[:-20, 0])) >= min_diff_markers
+        return self.all_markers_sent
+
+    def is_trial_ready(self):
+        """Returns True if a new trial was completely recorded or the settings changed since the last update"""
+        if self.shared_state.version != self.settings_version:
+            return True
+        self.alignment.update()
+        next_completion = self.get_next_completion()
+        return next_completion is not None and self.data.get_num_eeg_samples() >= next_completion
+
+    def poll(self):
+        """Non-blocking counterpart of self.run(): updates if all classes were flashed, a trial is ready and the last
+        update is at least "update interval" seconds ago. Returns True if an update was made"""
+        if not self.check_markers() or not self.is_trial_ready():
+            return False
+        if time.monotonic() < self.last_update + self.shared_state["update interval"]:
+            return False
+        self.update()
+        return True
+
+    def update(self):
+        """Analyzes the new trials and publishes the averages of the selected channel and the classification"""
+        self.last_update = time.monotonic()
+
+        newest_timestamp = self.data.get_newest_eeg_ts()
+        avg_trials, classification = self.analyze()
+        settings = self.shared_state.get_settings()
+
+        # Settings only have to be compared if they were updated at all
+        if self.shared_state.version != self.settings_version:
+            self.settings_version = self.shared_state.version
+            if self.current_ylim != settings["y lim"]:
+                self.current_ylim = settings["y lim"]
+                self.axis_queue.put(self.current_ylim)
+        # The settings changed before the first trial was complete, there is nothing to publish yet
+        if not self.averager.get_markers():
+            return
+
+        if self.latency_probes is not None and newest_timestamp is not None:
+            self.latency_probes.add("analysis", newest_timestamp)
+        message = "Current classification: {}".format(classification)
+        if self.channel_ranking is not None:
+            message += ", best channels: {}".format(", ".join(str(channel) for channel in self.channel_ranking[:3]))
+        self.print_to_console(message)
+
+        current_channel = settings["channel select"]
+        avg_trials = np.squeeze(avg_trials[:, :, current_channel])
+        self.plot_buffer.write(avg_trials, newest_timestamp)
+        if self.result_writer is not None:
+            self.result_writer.write(avg_trials, classification, self.channel_ranking)
 
-        # Do not count last 20 markers because they might not be fully recorded
-        while len(set(self.data.get_marker_numpy()[:-20, 0])) < min_diff_markers:
-            self.print_to_console("Not all markers were sent yet, waiting two seconds and then retrying")
-            time.sleep(2)
+    def run(self):
+        if not self.check_markers():
+            self.print_to_console("Not all markers were sent yet, waiting for them")
+        while not self.check_markers():
+            self.data.wait_for_data(num_markers=self.data.get_num_markers() + 1)
 
         while True:
-            marker = self.data.get_marker_numpy()
-            marker_ts = self.data.get_marker_ts_numpy()
-            eeg = self.data.get_eeg_numpy()
-            eeg_ts = self.data.get_eeg_ts_numpy()
-
-            mapped_markers, marker_ind = self.create_mapped_markers(marker, marker_ts, eeg_ts)
-            trials, marker_short = self.split_up_trials(eeg, mapped_markers, marker_ind)
-
-            avg_trials = self.avg_trials_by_marker(marker_short, trials)
-
-            classification = self.classify_trials(marker_short, trials)
-            if type(classification) == int:
-                classification = classification + 1
-            self.print_to_console("Current classification: {}".format(classification))
-
-            temp_ylim = self.connect_dict["y lim"]
-            current_channel = self.connect_dict["channel select"]
-            avg_trials = np.squeeze(avg_trials[:, :, current_channel])
-
-            if current_ylim == temp_ylim:
-                self.plotting_queue.put(avg_trials)
-            else:
-                current_ylim = temp_ylim
-                self.axis_queue.put(current_ylim)
-                self.plotting_queue.put(avg_trials)
-
-            time.sleep(self.connect_dict["update interval"])
+            self.wait_for_trial(self.settings_version)
+            # Rate limit, trials completed while waiting are coalesced into this update
+            time.sleep(max(self.last_update + self.shared_state["update interval"] - time.monotonic(), 0))
+            self.update()
 
 
 def fisher_criterion(targets, non_targets):
@@ -190,6 +387,45 @@ def fisher_criterion(targets, non_targets):
     return (mean_target - mean_non_target) ** 2 / (variance_target + variance_non_target)
 
 
+def fisher_scores(counts, sums, squares):
+    """Fisher criterion of every class against all other classes for every channel in one vectorized pass
+
+    Gives the same scores as fisher_criterion(targets, non_targets) for every class and channel, but computed from
+    sufficient statistics instead of the trials.
+
+    Args:
+        counts: Number of trials per class, shape (num_classes,)
+        sums: Sums over the trials of each class, shape (num_classes, num_samples, num_channels)
+        squares: Sums of squares over the trials of each class, same shape as sums
+
+    Returns:
+        Scores of shape (num_classes, num_channels)
+
+    """
+    counts = np.asarray(counts, dtype=float)[:, np.newaxis, np.newaxis]
+    non_target_counts = np.sum(counts) - counts
+    non_target_sums = np.sum(sums, axis=0) - sums
+    non_target_squares = np.sum(squares, axis=0) - squares
+
+    mean_target = sums / counts
+    mean_non_target = non_target_sums / non_target_counts
+    variance_target = squares / counts - mean_target ** 2
+    variance_non_target = non_target_squares / non_target_counts - mean_non_target ** 2
+
+    mean_difference = np.sum(np.abs(mean_target), axis=1) - np.sum(np.abs(mean_non_target), axis=1)
+    variance_sum = np.sum(np.abs(variance_target), axis=1) + np.sum(np.abs(variance_non_target), axis=1)
+    return mean_difference ** 2 / variance_sum
+
+
+def rank_channels(scores):
+    """Returns channel indices sorted by how clearly the best class stands out (ratio of best to second best score)"""
+    if len(scores) < 2:
+        return np.arange(scores.shape[1])
+    sorted_scores = np.sort(scores, axis=0)
+    margin = sorted_scores[-1] / np.maximum(sorted_scores[-2], np.finfo(float).tiny)
+    return np.argsort(-margin)
+
+
 def classify(scores):
     scores = np.array(scores)
     results = []
@@ -0,0 +1,118 @@
+from collections import deque
+from typing import Optional
+
+import numpy as np
+
+
+class RunningAverager(object):
+    """Per-class sliding window averages of trials, updated one trial at a time
+
+    For every marker (class) the last window_size trials and their sum are kept. Adding a trial adds it to the sum and
+    subtracts the trial falling out of the window, so getting the averages costs the same no matter how long the
+    session has been running. To keep rounding errors from adding up, the sum of a class is recomputed from its window
+    every window_size removals.
+
+    In the same way, sums and sums of squares over the last stats_window_size trials per class are kept as sufficient
+    statistics for classification (see self.get_statistics()).
+
+    Args:
+        window_size: Number of most recent trials per class that are averaged. Optional, defaults to 30
+        stats_window_size: Number of most recent trials per class the statistics are computed over. Has to be at
+            most window_size. Optional, defaults to 6
+
+    """
+
+    def __init__(self, window_size: int = 30, stats_window_size: int = 6):
+        self.window_size = window_size
+        self.stats_window_size = stats_window_size
+
+        self.trials = {}
+        self.sums = {}
+        self.num_removed = {}
+
+        self.stats_sums = {}
+        self.stats_squares = {}
+        self.num_stats_removed = {}
+
+    def add_trial(self, marker: int, trial):
+        """Adds a trial of shape (num_samples, num_channels) recorded after marker"""
+        trial = np.array(trial, dtype=float)
+        if marker not in self.trials:
+            self.trials[marker] = deque()
+            self.sums[marker] = np.zeros_like(trial)
+            self.num_removed[marker] = 0
+            self.stats_sums[marker] = np.zeros_like(trial)
+            self.stats_squares[marker] = np.zeros_like(trial)
+            self.num_stats_removed[marker] = 0
+
+        window = self.trials[marker]
+        window.append(trial)
+        self.sums[marker] += trial
+        self.update_statistics(marker, trial)
+
+        if len(window) > self.window_size:
+            self.sums[marker] -= window.popleft()
+            self.num_removed[marker] += 1
+            if self.num_removed[marker] % self.window_size == 0:
+                self.sums[marker] = np.sum(window, axis=0)
+
+    def update_statistics(self, marker, trial):
+        window = self.trials[marker]
+        self.stats_sums[marker] += trial
+        self.stats_squares[marker] += trial ** 2
+
+        if len(window) > self.stats_window_size:
+            removed = window[-self.stats_window_size - 1]
+            self.stats_sums[marker] -= removed
+            self.stats_squares[marker] -= removed ** 2
+            self.num_stats_removed[marker] += 1
+            if self.num_stats_removed[marker] % self.stats_window_size == 0:
+                last_trials = np.array(list(window)[-self.stats_window_size :])
+                self.stats_sums[marker] = np.sum(last_trials, axis=0)
+                self.stats_squares[marker] = np.sum(last_trials ** 2, axis=0)
+
+    def get_markers(self):
+        """Returns a sorted list of all markers (classes) a trial was added for"""
+        return sorted(self.trials)
+
+    def get_averages(self, squared: bool = False):
+        """Returns the averaged trials as array of shape (num_classes, num_samples, num_channels)
+
+        Classes are sorted by their marker. If squared is True, the averages are squared.
+
+        """
+        averages = np.array([self.sums[marker] / len(self.trials[marker]) for marker in self.get_markers()])
+        if squared:
+            return averages ** 2
+        return averages
+
+    def get_statistics(self):
+        """Returns (counts, sums, squares) over the last stats_window_size trials per class
+
+        counts has shape (num_classes,), sums and squares (sums of squares) have shape (num_classes, num_samples,
+        num_channels). Classes are sorted by their marker.
+
+        """
+        markers = self.get_markers()
+        counts = np.array([min(len(self.trials[marker]), self.stats_window_size) for marker in markers])
+        sums = np.array([self.stats_sums[marker] for marker in markers])
+        squares = np.array([self.stats_squares[marker] for marker in markers])
+        return counts, sums, squares
+
+    def get_window_trials(self, num_trials: Optional[int] = None):
+        """Returns (markers, trials) of the trials in the windows, grouped by class in recording order
+
+        Args:
+            num_trials: Only the last num_trials trials per class are returned. If None, all trials in the windows are
+                returned. Optional, defaults to None
+
+        """
+        markers = []
+        trials = []
+        for marker in self.get_markers():
+            window = list(self.trials[marker])
+            if num_trials is not None:
+                window = window[-num_trials:]
+            markers.extend([marker] * len(window))
+            trials.extend(window)
+        return np.array(markers), np.array(trials)
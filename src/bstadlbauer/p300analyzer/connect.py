@@ -1,15 +1,12 @@
 import multiprocessing as mp
+import os
+import queue
 import time
-from typing import Tuple
+from typing import Dict, Optional
 
-import matplotlib.pyplot as plt
-import numpy as np
-from pylsl import StreamInlet, resolve_stream
-
-from bstadlbauer.p300analyzer.analizer_gui import MainWindow
-from bstadlbauer.p300analyzer.analysis_thread import AnalysisThread
-from bstadlbauer.p300analyzer.data import RecordedData
-from bstadlbauer.p300analyzer.lsl_receiver_thread import LSLReceiverThread
+from bstadlbauer.p300analyzer.latency import LatencyProbes
+from bstadlbauer.p300analyzer.sessions import AnalysisPool, Session
+from bstadlbauer.p300analyzer.shared_buffers import SharedState
 
 
 class ConnectorProc(object):
@@ -18,46 +15,119 @@ class ConnectorProc(object):
     Main functionality happens in the self.run() method, which spawns all processes and threads as well as connects
     them.
 
-    Also plotting is done here as matplotlib only allows plotting in the main process. Therefor two queues to the
+    Also plotting is done here as matplotlib only allows plotting in the main process. Therefor a shared
+    analyzer.shared_buffers.LatestValueBuffer (averaged data) and a queue (y-axis limits) to the
     analyzer.analysis_thread.AnalysisThread are created and periodically polled for new data.
 
-    """
+    In headless mode, neither the GUI nor matplotlib are loaded. Streams are resolved by the names given in config,
+    recording and analysis start right away and results are written to config["output"] (see
+    analyzer.results.ResultWriter). Messages are printed to stdout, on KeyboardInterrupt the recording is saved as
+    config["savefile"] (if given).
 
-    def __init__(self):
-        self.eeg_inlet = None
-        self.marker_inlet = None
+    With a list of sessions in config["sessions"], several participants are analyzed at once: every entry holds the
+    "eeg streamname" and "marker streamname" of one participant and optionally a "name", an "output" and entries
+    overriding the connector dict and the settings for this participant. Every session (analyzer.sessions.Session)
+    gets its own copy of the configuration, its own shared state, recorded data and analysis, while the analyses share
+    one analyzer.sessions.AnalysisPool of "analysis workers" threads and, unless headless, one figure
+    (analyzer.plotter.SessionPlotter). The GUI is not started, messages are printed to stdout and on KeyboardInterrupt
+    every session is saved as "<savefile>_<name>" (if a savefile is given).
 
-        self.lsl_rec_threads = []
-        self.analysis_thread = []
+    Args:
+        headless: If True, run without GUI and plots. Optional, defaults to False
+        config: Entries overriding the defaults of the connector dict and the shared state (e.g. "eeg streamname",
+            "marker streamname", "filter", "channel select") and "output". Optional, defaults to none
+
+    """
 
-        self.recorded_data = None
+    # Seconds between two plotting and latency statistics printed to the console
+    stats_interval = 30
+
+    def __init__(self, headless: bool = False, config: Optional[Dict] = None):
+        self.headless = headless
+        self.session = None
+        self.sessions = []
 
         manager = mp.Manager()
         self.connector_dict = manager.dict()
-        self.connector_dict["update interval"] = None
-        self.connector_dict["channel select"] = None
         self.connector_dict["number of channels"] = None
         self.connector_dict["samplerate"] = None
+        self.connector_dict["stream samplerate"] = None
         self.connector_dict["eeg stramname"] = None
         self.connector_dict["marker streamname"] = None
-        self.connector_dict["sample count"] = 0
         self.connector_dict["num rows"] = 0
         self.connector_dict["num cols"] = 0
         self.connector_dict["flash mode"] = 0
-        self.connector_dict["y lim"] = [0, 100]
         self.connector_dict["savefile"] = ["1"]
         self.connector_dict["filter"] = 0
-        self.connector_dict["squared"] = 0
+        self.connector_dict["retention seconds"] = None
+        self.connector_dict["max chunk size"] = 1024
+        self.connector_dict["notch freqs"] = []
+        self.connector_dict["reference"] = None
+        self.connector_dict["chunk timeout"] = 0.05
+        self.connector_dict["single axes"] = False
+        # Epochs (and plots) go from "epoch start" to "epoch end" seconds around a marker, "baseline" is None or a
+        # (start, stop) interval in seconds around the marker that is subtracted from every epoch
+        self.connector_dict["epoch start"] = 0.0
+        self.connector_dict["epoch end"] = 1.0
+        self.connector_dict["baseline"] = None
+        # Map markers with a smoothed EEG clock (jitter and drift correction) instead of the raw timestamps
+        self.connector_dict["drift correction"] = False
+        self.connector_dict["drift window"] = 60
+        # Stream the recording to disk while recording (see analyzer.recording_writer), "Save" then only finalizes it
+        self.connector_dict["stream to disk"] = True
+        self.connector_dict["sync interval"] = 5.0
+        # If set, the latency histograms of all stages are exported to this JSON file with every statistics message
+        self.connector_dict["latency export"] = None
+        # "thread" runs the analysis in this process, "process" in its own process (analyzer.analysis_process)
+        self.connector_dict["analysis backend"] = "thread"
+        # "channel" scores the classes on the selected channel, "spatial" on "spatial filters" spatially filtered
+        # virtual channels learned from all channels. Features are the samples from "feature window" seconds after the
+        # marker, averaged over blocks of "feature decimation" samples in spatial classification
+        self.connector_dict["classifier"] = "channel"
+        self.connector_dict["spatial filters"] = 1
+        self.connector_dict["feature window"] = (0.2, 0.5)
+        self.connector_dict["feature decimation"] = 4
+        # If set (e.g. 0.99), a class is selected as soon as its posterior reaches this confidence instead of after a
+        # fixed number of trials, "max trials" (None or trials per class) forces a selection
+        self.connector_dict["dynamic stopping"] = None
+        self.connector_dict["max trials"] = None
+        # EEG is decimated by this factor after filtering, "samplerate" is then the decimated samplerate and "stream
+        # samplerate" the one of the EEG stream. With "archive raw", the received EEG is also streamed to disk as is
+        self.connector_dict["decimation"] = 1
+        self.connector_dict["archive raw"] = False
+        # List of dicts with the streams and settings of every participant (see above), None for a single session
+        # with the streams selected in the GUI. "analysis workers" threads (by default one per CPU, at most one per
+        # session) analyze all sessions
+        self.connector_dict["sessions"] = None
+        self.connector_dict["analysis workers"] = None
         self.start_recording_e = mp.Event()
         self.start_analysis_e = mp.Event()
         self.ready_for_connection_e = mp.Event()
         self.connected_e = mp.Event()
+
+        # Hot counters and settings read in every update, the manager dict is only used for rare configuration
+        self.shared_state = SharedState()
+        self.shared_state.update({"channel select": 0, "y lim": [0, 100], "update interval": 0, "squared": 0})
         self.save_e = mp.Event()
 
         self.message_q = mp.Queue()
+        self.output = None
+        self.latency_probes = LatencyProbes()
+
+        if config is not None:
+            self.apply_config(config)
+
+        if headless or self.connector_dict["sessions"] is not None:
+            self.ready_for_connection_e.set()
+            self.start_recording_e.set()
+            self.start_analysis_e.set()
+            return
+
+        from bstadlbauer.p300analyzer.analizer_gui import MainWindow
 
         self.analyzer_gui = MainWindow(
             self.connector_dict,
+            self.shared_state,
             self.message_q,
             self.start_recording_e,
             self.start_analysis_e,
@@ -67,160 +137,177 @@ class ConnectorProc(object):
         )
         self.analyzer_gui.start()
 
-    def create_inlets(self):
-        self.eeg_inlet = self.create_inlet(self.connector_dict["eeg streamname"])
-        self.marker_inlet = self.create_inlet(self.connector_dict["marker streamname"])
-
-    def create_inlet(self, name):
-        streams = resolve_stream("name", str(name))
-        inlet = StreamInlet(streams[0])
-
-        if len(streams) != 1:
-            self.print_to_console("ATTENTION: More streams with name: '" + name + "' found, using the first one")
-
-        return inlet
-
-    def update_lsl_metadata(self):
-        info_eeg = self.eeg_inlet.info()
-        self.connector_dict["number of channels"] = info_eeg.channel_count()
-        self.connector_dict["samplerate"] = info_eeg.nominal_srate()
-
-        info_marker = self.marker_inlet.info()
-        self.connector_dict["num rows"] = int(info_marker.desc().child_value("num_rows"))
-        self.connector_dict["num cols"] = int(info_marker.desc().child_value("num_cols"))
-        self.connector_dict["flash mode"] = info_marker.desc().child_value("flash_mode")
+    def apply_config(self, config: Dict):
+        settings = {key: value for key, value in config.items() if key in SharedState.fields}
+        if settings:
+            self.shared_state.update(settings)
+        self.output = config.get("output")
+        for key, value in config.items():
+            if key not in settings and key != "output":
+                self.connector_dict[key] = value
 
     def print_to_console(self, message):
         self.message_q.put(message)
 
     def run(self):
         self.ready_for_connection_e.wait()
-        self.create_inlets()
-        self.update_lsl_metadata()
-
-        samplerate = self.connector_dict["samplerate"]
-        number_of_channels = self.connector_dict["number of channels"]
-        self.print_to_console(
-            "Connected! There are {} channels with a samplerate of {}Hz".format(number_of_channels, samplerate)
-        )
+        if self.connector_dict["sessions"] is not None:
+            self.run_sessions()
+            return
 
-        self.recorded_data = RecordedData(self.connector_dict["filter"])
-        self.recorded_data.set_samplerate(samplerate)
-        self.recorded_data.set_num_channel(number_of_channels)
-
-        eeg_thread = LSLReceiverThread(
-            self.eeg_inlet, self.recorded_data.append_eeg_sample, self.recorded_data.append_eeg_ts, self.connector_dict
-        )
-        marker_thread = LSLReceiverThread(
-            self.marker_inlet, self.recorded_data.append_marker_sample, self.recorded_data.append_marker_ts
-        )
-
-        self.lsl_rec_threads.append(eeg_thread)
-        self.lsl_rec_threads.append(marker_thread)
-
-        data_to_plotter_queue = mp.Queue()
-        axis_to_plotter_queue = mp.Queue()
-        self.analysis_thread = AnalysisThread(
-            self.recorded_data, self.connector_dict, self.message_q, data_to_plotter_queue, axis_to_plotter_queue
-        )
+        self.session = Session(self.connector_dict, self.shared_state, self.message_q, self.output, self.latency_probes)
+        self.session.connect()
 
         self.connected_e.set()
 
         self.start_recording_e.wait()
-
-        for thread in self.lsl_rec_threads:
-            thread.start()
+        # Without GUI, the process ends on KeyboardInterrupt and must not wait for the receivers
+        self.session.start_recording(daemon=self.headless)
 
         self.start_analysis_e.wait()
+        if self.headless:
+            self.run_headless()
+            return
+
+        from bstadlbauer.p300analyzer.plotter import Plotter
+
         samplerate = self.connector_dict["samplerate"]
-        start_ylim = self.connector_dict["y lim"]
+        start_ylim = self.shared_state["y lim"]
         num_rows = self.connector_dict["num rows"]
         num_cols = self.connector_dict["num cols"]
-        plotter = Plotter(samplerate, start_ylim, num_rows, num_cols, data_to_plotter_queue, axis_to_plotter_queue)
+        plotter = Plotter(
+            samplerate,
+            start_ylim,
+            num_rows,
+            num_cols,
+            self.session.plot_buffer,
+            self.session.axis_queue,
+            single_axes=self.connector_dict["single axes"],
+            epoch_start=self.connector_dict["epoch start"],
+            epoch_end=self.connector_dict["epoch end"],
+            latency_probes=self.latency_probes,
+        )
 
-        self.analysis_thread.start()
+        self.session.analysis.start()
 
+        last_stats = time.monotonic()
         while True:
             plotter.udpate_axis_if_possible()
             plotter.update_data_if_possible()
 
+            if time.monotonic() - last_stats >= self.stats_interval:
+                self.print_to_console(plotter.get_frame_stats())
+                self.report_latency()
+                last_stats = time.monotonic()
+
             if self.save_e.is_set():
-                self.recorded_data.save(self.connector_dict["savefile"])
+                self.session.save()
                 self.save_e.clear()
             time.sleep(0.1)
 
-
-class Plotter(object):
-    """Main class for potting the averaged result
-
-    Args:
-        samplerate: Samplerate of the data
-        start_ylim: Limits of the y-axis to create the plot with
-        num_rows: Number of rows in the speller
-        num_cols: Number of columns in the speller
-        data_queue: Queue that will be periodically polled for new y-axis data
-        axis_queue: Queue that will be periodically polled for new y-axis limits
-
-    """
-
-    def __init__(
-        self,
-        samplerate: int,
-        start_ylim: Tuple[int, int],
-        num_rows: int,
-        num_cols: int,
-        data_queue: mp.Queue,
-        axis_queue: mp.Queue,
-    ):
-        self.samplerate = samplerate
-        self.num_rows = num_rows
-        self.num_cols = num_cols
-
-        self.data_queue = data_queue
-        self.axis_queue = axis_queue
-
-        self.figure = None
-        self.axes = None
-        self.lines = None
-
-        self.create_figure(start_ylim)
-
-    def update_plot(self, avg_trials):
-        for i, line in enumerate(self.lines):
-            line.set_ydata(avg_trials[i, :])
-
-        self.figure.canvas.draw()
-        self.figure.canvas.flush_events()
-
-    def create_figure(self, ylim):
-        # Turn on interactive plotting
-        plt.ion()
-        self.figure, self.axes = plt.subplots(self.num_rows, self.num_cols, sharex="col", sharey="row")
-
-        x_axis = np.arange(int(self.samplerate)) / self.samplerate * 1000  # Show one second
-        y = np.zeros(int(self.samplerate))
-
-        self.lines = []
-        for row in self.axes:
-            for col in row:
-                (line,) = col.plot(x_axis, y)
-                self.lines.append(line)
-                col.set_ylim(ylim)
-
-        fig_manager = plt.get_current_fig_manager()
-        fig_manager.window.showMaximized()
-        self.figure.canvas.draw()
-        self.figure.canvas.flush_events()
-
-    def update_axes(self, ylim):
-        for row in self.axes:
-            for col in row:
-                col.set_ylim(ylim)
-
-    def update_data_if_possible(self):
-        if not self.data_queue.empty():
-            self.update_plot(self.data_queue.get())
-
-    def udpate_axis_if_possible(self):
-        if not self.axis_queue.empty():
-            self.update_axes(self.axis_queue.get())
+    def create_sessions(self):
+        """Creates an analyzer.sessions.Session with its own configuration and shared state for every entry of
+        "sessions" in the connector dict"""
+        connector_dict = dict(self.connector_dict)
+        settings = self.shared_state.get_settings()
+
+        sessions = []
+        for index, session_config in enumerate(connector_dict["sessions"]):
+            session_config = dict(session_config)
+            name = session_config.pop("name", session_config["eeg streamname"])
+            output = session_config.pop("output", self.output)
+            if output is not None and not output.startswith("tcp://"):
+                # One file per session, results sent to a socket are told apart by their "session"
+                root, extension = os.path.splitext(output)
+                output = "{}_{}{}".format(root, name, extension)
+
+            connect_dict = dict(connector_dict)
+            connect_dict["sessions"] = None
+            # All sessions are analyzed by the shared pool
+            connect_dict["analysis backend"] = "thread"
+            if isinstance(connect_dict["savefile"], str):
+                connect_dict["savefile"] = "{}_{}".format(connect_dict["savefile"], name)
+            session_settings = dict(settings)
+            for key, value in session_config.items():
+                if key in SharedState.fields:
+                    session_settings[key] = value
+                else:
+                    connect_dict[key] = value
+
+            shared_state = SharedState()
+            shared_state.update(session_settings)
+            # Every session is received and analyzed in its own threads, so it is probed separately
+            sessions.append(Session(connect_dict, shared_state, self.message_q, output, LatencyProbes(), name))
+        return sessions
+
+    def run_sessions(self):
+        self.sessions = self.create_sessions()
+        for session in self.sessions:
+            session.connect()
+        self.connected_e.set()
+        for session in self.sessions:
+            # The process ends on KeyboardInterrupt and must not wait for the receivers
+            session.start_recording(daemon=True)
+
+        pool = AnalysisPool([session.analysis for session in self.sessions], self.connector_dict["analysis workers"])
+        pool.start()
+        print("Analyzing {} sessions with {} workers".format(len(self.sessions), pool.num_workers))
+
+        plotter = None
+        if not self.headless:
+            from bstadlbauer.p300analyzer.plotter import SessionPlotter
+
+            plotter = SessionPlotter(self.sessions, latency_probes=self.latency_probes)
+
+        last_stats = time.monotonic()
+        try:
+            while True:
+                if plotter is None:
+                    try:
+                        print(self.message_q.get(timeout=self.stats_interval))
+                    except queue.Empty:
+                        pass
+                else:
+                    plotter.update_if_possible()
+                    while not self.message_q.empty():
+                        print(self.message_q.get())
+                    time.sleep(0.1)
+
+                if time.monotonic() - last_stats >= self.stats_interval:
+                    if plotter is not None:
+                        print(plotter.get_frame_stats())
+                    self.report_latency()
+                    last_stats = time.monotonic()
+        except KeyboardInterrupt:
+            for session in self.sessions:
+                session.stop()
+
+    def get_latency_probes(self):
+        """Returns the latencies probed here (e.g. by the plotter) merged with those of all sessions"""
+        if not self.sessions:
+            return self.latency_probes
+        return LatencyProbes.merge([self.latency_probes] + [session.latency_probes for session in self.sessions])
+
+    def report_latency(self):
+        latency_probes = self.get_latency_probes()
+        self.print_to_console(latency_probes.get_summary())
+        if self.connector_dict["latency export"] is not None:
+            latency_probes.export(self.connector_dict["latency export"])
+
+    def run_headless(self):
+        self.session.analysis.daemon = True
+        self.session.analysis.start()
+
+        last_stats = time.monotonic()
+        try:
+            while True:
+                try:
+                    print(self.message_q.get(timeout=self.stats_interval))
+                except queue.Empty:
+                    pass
+
+                if time.monotonic() - last_stats >= self.stats_interval:
+                    self.report_latency()
+                    last_stats = time.monotonic()
+        except KeyboardInterrupt:
+            self.session.stop()
@@ -1,9 +1,15 @@
+from typing import Optional, Sequence, Union
+
 import numpy as np
 from scipy import signal
 
 
 class CustomBPFilter(object):
-    """Wrapper for a scipy.signal.lfilter using cofficients from scipy.signal.butter
+    """Butterworth bandpass filter (optionally with notch filters and re-referencing) working on blocks of samples
+
+    The filter is implemented as a cascade of second-order sections (scipy.signal.sosfilt), which stays numerically
+    stable for higher orders and narrow bands. The filter state is kept between calls of self.filter(), so the output
+    is the same no matter if samples are passed one at a time or in blocks of arbitrary size.
 
     Args:
         samplerate: Samplerate of the data
@@ -11,15 +17,36 @@ class CustomBPFilter(object):
         order: Filter order
         cutoff_low: Low cutoff frequency in Hz
         cutoff_high: High cutoff frequency in Hz
+        notch_freqs: Frequencies in Hz (e.g. 50 and/or 60 for power line noise) that are removed with a notch filter.
+            Frequencies at or above the Nyquist frequency are ignored. Optional, defaults to no notch filter.
+        reference: Channel index that is subtracted from all channels or "average" for a common average reference.
+            If None, data is not re-referenced. Optional, defaults to None
+        init_from_first_sample: If True, the filter state is initialized to the steady state for the first sample
+            (scipy.signal.sosfilt_zi), which avoids a long transient for signals with a DC offset. Optional, defaults
+            to False
 
     """
 
-    def __init__(self, samplerate: int, num_chan: int, order: int, cutoff_low: int, cutoff_high: int):
+    notch_quality = 30.0
+
+    def __init__(
+        self,
+        samplerate: int,
+        num_chan: int,
+        order: int,
+        cutoff_low: int,
+        cutoff_high: int,
+        notch_freqs: Sequence[float] = (),
+        reference: Optional[Union[int, str]] = None,
+        init_from_first_sample: bool = False,
+    ):
         self.samplerate = samplerate
         self.num_chan = num_chan
+        self.notch_freqs = list(notch_freqs)
+        self.reference = reference
+        self.init_from_first_sample = init_from_first_sample
 
-        self.b = None
-        self.a = None
+        self.sos = None
         self.update_filter_coefficients(order, cutoff_low, cutoff_high)
 
         self.filter_delay = None
@@ -27,12 +54,103 @@ class CustomBPFilter(object):
 
     def update_filter_coefficients(self, order, cutoff_low, cutoff_high):
         cutoff_freq_norm = np.array([cutoff_low, cutoff_high]) / (self.samplerate / 2.0)
-        [self.b, self.a] = signal.butter(order, cutoff_freq_norm, "bandpass")
+        sections = [signal.butter(order, cutoff_freq_norm, "bandpass", output="sos")]
+
+        for notch_freq in self.notch_freqs:
+            if notch_freq >= self.samplerate / 2.0:
+                continue
+            [b, a] = signal.iirnotch(notch_freq / (self.samplerate / 2.0), self.notch_quality)
+            sections.append(signal.tf2sos(b, a))
+
+        self.sos = np.vstack(sections)
 
     def init_filter_delay(self):
-        length = max(len(self.a), len(self.b)) - 1
-        self.filter_delay = np.zeros([length, self.num_chan])
+        if self.init_from_first_sample:
+            # Set from the first sample in self.filter()
+            self.filter_delay = None
+        else:
+            self.filter_delay = np.zeros([self.sos.shape[0], 2, self.num_chan])
 
     def filter(self, x):
-        y, self.filter_delay = signal.lfilter(self.b, self.a, x, 0, self.filter_delay)
+        """Filters x of shape (num_samples, num_chan) and returns the filtered samples in the same shape"""
+        x = rereference(np.asarray(x, dtype=float), self.reference)
+        if len(x) == 0:
+            return x
+        if self.filter_delay is None:
+            self.filter_delay = signal.sosfilt_zi(self.sos)[:, :, np.newaxis] * x[0]
+
+        y, self.filter_delay = signal.sosfilt(self.sos, x, 0, self.filter_delay)
         return y
+
+
+class PolyphaseDecimator(object):
+    """Anti-aliasing lowpass and downsampling by an integer factor working on blocks of samples
+
+    A linear-phase FIR lowpass (cutoff at the new Nyquist frequency) is only evaluated at the kept samples (polyphase
+    decimation), so the cost per input sample does not grow with the factor. The last num_taps - 1 samples are kept
+    between calls of self.decimate(), so the output is the same no matter how the input is split into blocks. Every
+    output sample is centered on an input sample whose index is a multiple of factor and gets its timestamp, which
+    compensates the delay of the filter.
+
+    Args:
+        num_chan: Number of channels
+        factor: Decimation factor
+        num_taps: Number of FIR filter taps, has to be odd. Optional, defaults to 8 * factor + 1
+
+    """
+
+    def __init__(self, num_chan: int, factor: int, num_taps: Optional[int] = None):
+        if num_taps is None:
+            num_taps = 8 * factor + 1
+        self.num_chan = num_chan
+        self.factor = factor
+        self.taps = signal.firwin(num_taps, 1.0 / factor)
+        self.delay = (num_taps - 1) // 2
+
+        # Set from the first sample in self.decimate()
+        self.history = None
+        self.ts_history = np.full(num_taps - 1, np.nan)
+        self.num_inputs = 0
+        self.next_center = 0
+
+    def decimate(self, x, timestamps):
+        """Filters and downsamples x of shape (num_samples, num_chan) with timestamps of shape (num_samples,), returns
+        (samples, timestamps) of all output samples whose filter window is complete"""
+        x = np.asarray(x, dtype=float)
+        if self.history is None:
+            if len(x) == 0:
+                return np.zeros([0, self.num_chan]), np.zeros([0])
+            # Samples before the first one are assumed to equal it, which avoids a transient for DC offsets
+            self.history = np.repeat(x[:1], len(self.taps) - 1, axis=0)
+
+        extended = np.concatenate([self.history, x])
+        extended_ts = np.concatenate([self.ts_history, timestamps])
+        # Absolute input index of extended[0]
+        offset = self.num_inputs - len(self.history)
+        self.num_inputs += len(x)
+
+        # Output samples are centered on next_center, next_center + factor, ... and need delay samples after it
+        num_outputs = max((self.num_inputs - 1 - self.delay - self.next_center) // self.factor + 1, 0)
+        windows = np.lib.stride_tricks.as_strided(
+            extended[self.next_center - self.delay - offset :],
+            shape=(num_outputs, len(self.taps), self.num_chan),
+            strides=(self.factor * extended.strides[0],) + extended.strides,
+            writeable=False,
+        )
+        y = np.tensordot(windows, self.taps, axes=([1], [0]))
+        y_ts = extended_ts[self.next_center - offset :: self.factor][:num_outputs]
+
+        self.next_center += num_outputs * self.factor
+        self.history = extended[len(x) :]
+        self.ts_history = extended_ts[len(x) :]
+        return y, y_ts
+
+
+def rereference(x, reference):
+    """Subtracts channel reference (or the channel mean if reference is "average") from x of shape (num_samples,
+    num_chan). If reference is None, x is returned unchanged."""
+    if reference is None:
+        return x
+    if reference == "average":
+        return x - np.mean(x, axis=1, keepdims=True)
+    return x - x[:, reference : reference + 1]
@@ -1,23 +1,78 @@
+import os
+import time
+from threading import Condition, Lock
+from typing import Callable, Dict, Optional, Sequence, Union
+
 import numpy as np
 
-from bstadlbauer.p300analyzer.custom_filter import CustomBPFilter
+from bstadlbauer.p300analyzer.custom_filter import (
+    CustomBPFilter,
+    PolyphaseDecimator,
+    rereference,
+)
+from bstadlbauer.p300analyzer.epoching import extract_epochs
+from bstadlbauer.p300analyzer.recording_writer import RecordingWriter
+from bstadlbauer.p300analyzer.ring_buffer import RingBuffer
+from bstadlbauer.p300analyzer.shared_buffers import SharedRingBuffer
+
+SAVE_DIRECTORY = "saved_data/"
+# Rows of small blocks (e.g. single samples) that are collected before they are queued for the writer together
+DISK_BLOCK_ROWS = 256
 
 
 class RecordedData(object):
     """Container that holds all data shared between threads and logic for processing samples.
 
+    Samples are stored in preallocated analyzer.ring_buffer.RingBuffer instances, all get_*_numpy() methods return
+    read-only views into them without copying.
+
+    If self.start_writer() was called, all appended data is additionally streamed to disk by an
+    analyzer.recording_writer.RecordingWriter and self.save() only copies the files written so far. Small blocks (e.g.
+    single samples) are collected and queued for the writer in blocks of DISK_BLOCK_ROWS rows, samples always together
+    with their timestamps.
+
+    If self.share() was called, all preprocessed EEG samples and markers (first marker channel) are also published
+    with their timestamps in the last column to analyzer.shared_buffers.SharedRingBuffer instances, e.g. for an
+    analyzer.analysis_process.AnalysisProcess.
+
+    With a decimation factor, EEG is lowpass filtered and downsampled (analyzer.custom_filter.PolyphaseDecimator)
+    after preprocessing, and only the decimated samples are stored, shared and streamed to disk. self.samplerate is
+    then the decimated samplerate, self.stream_samplerate the one of the received stream.
+
     Args:
         filter_bool: Boolean that determines if data should be filtered or not
+        retention_seconds: Number of seconds of EEG (and markers within this time) that are kept in memory. If None,
+            the whole session is kept. Optional, defaults to None
+        notch_freqs: Power line frequencies in Hz that are removed with a notch filter if filtering is enabled.
+            Optional, defaults to no notch filter
+        reference: Channel index that is subtracted from all channels or "average" for a common average reference.
+            If None, data is not re-referenced. Optional, defaults to None
+        decimation: Factor the EEG is decimated by before it is stored. Optional, defaults to 1 (no decimation)
+        archive_raw: If True, the received EEG is additionally streamed to disk as it is, before preprocessing and
+            decimation (streams "raw_eeg" and "raw_eeg_ts"). Only used while streaming to disk. Optional, defaults to
+            False
 
     """
 
-    def __init__(self, filter_bool: bool):
-        self.eeg_data = []
-        self.eeg_ts = []
-        self.marker_data = []
-        self.marker_ts = []
+    def __init__(
+        self,
+        filter_bool: bool,
+        retention_seconds: Optional[float] = None,
+        notch_freqs: Sequence[float] = (),
+        reference: Optional[Union[int, str]] = None,
+        decimation: int = 1,
+        archive_raw: bool = False,
+    ):
+        self.eeg_data = None
+        self.eeg_ts = None
+        self.marker_data = None
+        self.marker_ts = None
         self.samplerate = None
+        self.stream_samplerate = None
         self.num_chan = None
+        self.retention_seconds = retention_seconds
+        self.notch_freqs = notch_freqs
+        self.reference = reference
 
         self.filter_bool = filter_bool
 
@@ -28,78 +83,323 @@ class RecordedData(object):
         self.markers_short = []
 
         self.bandpass = None
+        self.decimation = decimation
+        self.archive_raw = archive_raw
+        self.decimator = None
+        # Received sample waiting for its timestamp when samples are appended one at a time (decimation or archive_raw)
+        self.pending_eeg_sample = None
+
+        self.writer = None
+        self.writer_lock = Lock()
+        # Blocks (dicts of stream to rows) waiting to be queued for the writer, see self.write_to_disk()
+        self.pending_disk_blocks = []
+        self.num_pending_disk_rows = 0
+
+        # Notified (and the listeners called) whenever complete EEG samples or markers were appended
+        self.new_data = Condition()
+        self.listeners = []
+
+        self.shared_eeg = None
+        self.shared_markers = None
+        self.num_writers = 0
+        self.writer_name = "recording"
 
     def set_samplerate(self, samplerate):
-        self.samplerate = samplerate
+        """Sets the samplerate of the received EEG stream"""
+        self.stream_samplerate = samplerate
+        self.samplerate = samplerate / self.decimation
 
     def set_num_channel(self, num_chan):
         self.num_chan = num_chan
 
+    def get_max_length(self):
+        if self.retention_seconds is None:
+            return None
+        return int(self.retention_seconds * self.samplerate)
+
+    def create_eeg_buffers(self):
+        max_length = self.get_max_length()
+        self.eeg_data = RingBuffer(self.num_chan, max_length=max_length)
+        self.eeg_ts = RingBuffer(max_length=max_length)
+
+    def create_marker_buffers(self, num_marker_chan):
+        # There can't be more markers than EEG samples, so the same retention length is an upper bound
+        max_length = self.get_max_length()
+        self.marker_data = RingBuffer(num_marker_chan, dtype=int, initial_capacity=256, max_length=max_length)
+        self.marker_ts = RingBuffer(initial_capacity=256, max_length=max_length)
+
     def append_eeg_sample(self, sample):
-        if self.filter_bool == 1:
-            if self.bandpass is None:
-                self.bandpass = CustomBPFilter(self.samplerate, self.num_chan, 4, 1, 30)
-            numpy_sample = np.array(sample)
-            numpy_sample = numpy_sample[np.newaxis, :]
-            filtered_sample = self.bandpass.filter(numpy_sample) * 1e6
-            # filtered_sample = filtered_sample - filtered_sample[0, 31]  # Uncomment this to set reference channel
-            self.eeg_data.append(filtered_sample)
-        else:
-            sample = np.array(sample) * 1e6
-            # sample = sample - sample[31]  # Uncomment this to set reference channel
-            self.eeg_data.append(sample)
+        if self.decimation > 1:
+            # Decimated samples are only complete with their timestamp, see self.append_eeg_ts()
+            self.pending_eeg_sample = np.array(sample)
+            return
+        if self.eeg_data is None:
+            self.create_eeg_buffers()
+
+        numpy_sample = np.array(sample, dtype=float)
+        if self.archive_raw:
+            # Archived together with the timestamp in self.append_eeg_ts()
+            self.pending_eeg_sample = numpy_sample
+        numpy_sample = self.preprocess_eeg(numpy_sample[np.newaxis, :])
+        self.eeg_data.append(numpy_sample[0])
 
     def append_eeg_ts(self, timestamp):
+        if self.decimation > 1:
+            self.append_eeg_block(self.pending_eeg_sample[np.newaxis], [timestamp])
+            return
+        if self.eeg_ts is None:
+            self.create_eeg_buffers()
         self.eeg_ts.append(timestamp)
+        self.notify_new_data()
+        if self.shared_eeg is not None:
+            self.shared_eeg.extend(np.append(self.eeg_data.last(1)[0], timestamp)[np.newaxis])
+        if self.archive_raw:
+            self.write_to_disk(
+                {
+                    "eeg": self.eeg_data.last(1),
+                    "eeg_ts": [timestamp],
+                    "raw_eeg": self.pending_eeg_sample[np.newaxis],
+                    "raw_eeg_ts": [timestamp],
+                }
+            )
+        else:
+            self.write_to_disk({"eeg": self.eeg_data.last(1), "eeg_ts": [timestamp]})
+
+    def append_eeg_block(self, samples, timestamps, preprocessed: bool = False):
+        """Appends a block of EEG samples of shape (num_samples, num_chan) together with their timestamps
+
+        If preprocessed is True, samples are stored as they are (e.g. when replaying saved data, which is already
+        filtered, in microvolts and decimated).
+
+        """
+        if self.eeg_data is None:
+            self.create_eeg_buffers()
+
+        if not preprocessed:
+            if self.archive_raw:
+                self.write_to_disk({"raw_eeg": samples, "raw_eeg_ts": timestamps})
+            samples = self.preprocess_eeg(np.asarray(samples, dtype=float))
+            if self.decimation > 1:
+                samples, timestamps = self.decimate(samples, timestamps)
+                if len(samples) == 0:
+                    return
+        samples = np.asarray(samples, dtype=float)
+        self.eeg_data.extend(samples)
+        self.eeg_ts.extend(timestamps)
+        self.notify_new_data()
+        if self.shared_eeg is not None:
+            self.shared_eeg.extend(np.column_stack([samples, timestamps]))
+        self.write_to_disk({"eeg": samples, "eeg_ts": timestamps})
+
+    def preprocess_eeg(self, samples):
+        """Re-references, filters (if enabled) and scales samples of shape (num_samples, num_chan) to microvolts"""
+        if self.filter_bool == 1:
+            if self.bandpass is None:
+                self.bandpass = CustomBPFilter(
+                    self.stream_samplerate,
+                    self.num_chan,
+                    4,
+                    1,
+                    30,
+                    notch_freqs=self.notch_freqs,
+                    reference=self.reference,
+                )
+            return self.bandpass.filter(samples) * 1e6
+
+        return rereference(samples, self.reference) * 1e6
+
+    def decimate(self, samples, timestamps):
+        """Returns the (samples, timestamps) decimated by self.decimation that are complete so far"""
+        if self.decimator is None:
+            self.decimator = PolyphaseDecimator(self.num_chan, self.decimation)
+        return self.decimator.decimate(samples, timestamps)
 
     def append_marker_sample(self, sample):
+        if self.marker_data is None:
+            self.create_marker_buffers(len(sample))
         self.marker_data.append(sample)
 
     def append_marker_ts(self, timestamp):
+        if self.marker_ts is None:
+            self.create_marker_buffers(1)
         self.marker_ts.append(timestamp)
+        self.notify_new_data()
+        if self.shared_markers is not None:
+            self.shared_markers.extend([[self.marker_data.last(1)[0, 0], timestamp]])
+        self.write_to_disk({"marker": self.marker_data.last(1), "marker_ts": [timestamp]})
+
+    def append_marker_block(self, samples, timestamps):
+        """Appends a block of markers of shape (num_markers, num_marker_chan) together with their timestamps"""
+        if self.marker_data is None:
+            self.create_marker_buffers(np.shape(samples)[1])
+        self.marker_data.extend(samples)
+        self.marker_ts.extend(timestamps)
+        self.notify_new_data()
+        if self.shared_markers is not None:
+            self.shared_markers.extend(np.column_stack([np.asarray(samples)[:, 0], timestamps]))
+        self.write_to_disk({"marker": np.asarray(samples, dtype=int), "marker_ts": timestamps})
+
+    def share(self, shared_eeg: SharedRingBuffer, shared_markers: SharedRingBuffer):
+        """Publishes all data appended from now on to shared_eeg (num_chan + 1 columns) and shared_markers (2
+        columns)"""
+        self.shared_eeg = shared_eeg
+        self.shared_markers = shared_markers
+
+    def add_listener(self, listener: Callable):
+        """Calls listener (without arguments) whenever complete EEG samples or markers were appended, e.g. to wake up
+        a thread that waits for several instances at once"""
+        self.listeners.append(listener)
+
+    def notify_new_data(self):
+        with self.new_data:
+            self.new_data.notify_all()
+        for listener in self.listeners:
+            listener()
 
-    def get_eeg_list(self):
-        return self.eeg_data
+    def wait_for_data(
+        self, num_samples: Optional[int] = None, num_markers: Optional[int] = None, timeout: Optional[float] = None
+    ):
+        """Blocks until at least num_samples EEG samples or num_markers markers were appended in total
 
-    def get_eeg_ts_list(self):
-        return self.eeg_ts
+        Returns False if timeout (in seconds) passed before, True otherwise.
 
-    def get_marker_list(self):
-        return self.marker_data
+        """
 
-    def get_marker_ts_list(self):
-        return self.marker_ts
+        def enough_data():
+            return (num_samples is not None and self.get_num_eeg_samples() >= num_samples) or (
+                num_markers is not None and self.get_num_markers() >= num_markers
+            )
+
+        with self.new_data:
+            return self.new_data.wait_for(enough_data, timeout)
 
     def get_eeg_numpy(self):
-        return np.squeeze(np.array(self.eeg_data))
+        if self.eeg_data is None:
+            return np.zeros([0, self.num_chan])
+        return self.eeg_data.view()
 
     def get_eeg_ts_numpy(self):
-        return np.array(self.eeg_ts)
+        if self.eeg_ts is None:
+            return np.zeros([0])
+        return self.eeg_ts.view()
 
     def get_marker_numpy(self):
-        if not self.marker_data:
+        if self.marker_data is None or len(self.marker_data) == 0:
             return np.zeros([1, 2])
-        return np.array(self.marker_data)
+        return self.marker_data.view()
 
     def get_marker_ts_numpy(self):
-        return np.array(self.marker_ts)
+        if self.marker_ts is None:
+            return np.zeros([0])
+        return self.marker_ts.view()
+
+    def get_num_eeg_samples(self):
+        """Returns the number of EEG samples (and timestamps) appended so far"""
+        if self.eeg_data is None or self.eeg_ts is None:
+            return 0
+        return min(self.eeg_data.total, self.eeg_ts.total)
+
+    def get_eeg_range(self, start: int, stop: int):
+        """Returns a read-only view of the EEG samples with absolute sample indices in [start, stop)"""
+        return self.eeg_data.view(start, stop)
+
+    def get_eeg_ts_range(self, start: int, stop: int):
+        """Returns a read-only view of the EEG timestamps with absolute sample indices in [start, stop)"""
+        return self.eeg_ts.view(start, stop)
+
+    def get_newest_eeg_ts(self):
+        """Returns the timestamp of the newest EEG sample or None if there is none yet"""
+        num_samples = self.get_num_eeg_samples()
+        if num_samples == 0:
+            return None
+        return float(self.eeg_ts.view(num_samples - 1, num_samples)[0])
+
+    def get_num_markers(self):
+        """Returns the number of markers (and timestamps) appended so far"""
+        if self.marker_data is None or self.marker_ts is None:
+            return 0
+        return min(self.marker_data.total, self.marker_ts.total)
+
+    def get_marker_range(self, start: int, stop: int):
+        """Returns read-only views (markers, marker_ts) of the markers with absolute indices in [start, stop)"""
+        return self.marker_data.view(start, stop), self.marker_ts.view(start, stop)
+
+    def get_eeg_time_range(self, start_time: float, stop_time: float):
+        """Returns read-only views (eeg, eeg_ts) of all retained samples with start_time <= timestamp < stop_time"""
+        start, stop = self.eeg_ts.searchsorted([start_time, stop_time])
+        return self.eeg_data.view(start, stop), self.eeg_ts.view(start, stop)
 
     def split_into_trials(self):
-        eeg_np = np.array(self.eeg_data)
-        marker_indices = np.where(np.array(self.marker_data) != 0)[0]
-        trials_temp = []
-        markers_temp = []
+        marker_np = self.get_marker_numpy()
+        marker_indices = np.where(marker_np[:, 0] != 0)[0]
+
+        self.trials, kept = extract_epochs(self.get_eeg_numpy(), marker_indices, int(self.samplerate))
+        marker_indices = marker_indices[kept]
+        self.markers_short = np.column_stack([marker_np[marker_indices, 0], np.asarray(self.target)[marker_indices]])
+
+    def start_writer(self, max_queued_blocks: int = 1024, sync_interval: float = 5.0, name: Optional[str] = None):
+        """Starts streaming all data appended from now on to a new recording in SAVE_DIRECTORY, a running recording is
+        finalized
+
+        The files are named after name (which is kept for later recordings, "recording" by default), the start time
+        and a counter, so recordings of several instances started at the same time need different names.
+
+        """
+        if name is not None:
+            self.writer_name = name
+        os.makedirs(SAVE_DIRECTORY, exist_ok=True)
+        path_prefix = SAVE_DIRECTORY + "{}_{}_{}".format(
+            self.writer_name, time.strftime("%Y%m%d_%H%M%S"), self.num_writers
+        )
+        self.num_writers += 1
+        writer = RecordingWriter(path_prefix, max_queued_blocks, sync_interval)
+        writer.start()
 
-        for ind in marker_indices:
-            trials_temp.append(eeg_np[ind : ind + self.samplerate, :])
-            markers_temp.append([self.marker_data[ind], self.target[ind]])
+        with self.writer_lock:
+            self.queue_pending_blocks()
+            previous_writer, self.writer = self.writer, writer
+        if previous_writer is not None:
+            previous_writer.finalize()
 
-        self.trials = np.array(trials_temp)
-        self.markers_short = np.array(markers_temp)
+    def stop_writer(self):
+        """Stops streaming to disk, the files of the current recording are finalized and keep their name"""
+        with self.writer_lock:
+            self.queue_pending_blocks()
+            writer, self.writer = self.writer, None
+        if writer is not None:
+            writer.finalize()
+
+    def write_to_disk(self, blocks: Dict):
+        """Collects the rows of several streams (dict of stream to rows, which are copied) for the writer, they are
+        queued once DISK_BLOCK_ROWS rows are pending"""
+        with self.writer_lock:
+            if self.writer is None:
+                return
+            self.pending_disk_blocks.append({stream: np.array(rows) for stream, rows in blocks.items()})
+            self.num_pending_disk_rows += max(len(rows) for rows in blocks.values())
+            if self.num_pending_disk_rows >= DISK_BLOCK_ROWS:
+                self.queue_pending_blocks()
+
+    def queue_pending_blocks(self):
+        """Queues all pending rows for the writer as one item, self.writer_lock has to be held"""
+        if self.writer is not None and self.pending_disk_blocks:
+            streams = {}
+            for block in self.pending_disk_blocks:
+                for stream, rows in block.items():
+                    streams.setdefault(stream, []).append(rows)
+            self.writer.write_blocks(
+                {stream: rows[0] if len(rows) == 1 else np.concatenate(rows) for stream, rows in streams.items()}
+            )
+        self.pending_disk_blocks = []
+        self.num_pending_disk_rows = 0
 
     def save(self, filename):
         print("save")
-        prefix = "saved_data/"
+        if self.writer is not None:
+            self.save_streamed(filename)
+            return
+
+        prefix = SAVE_DIRECTORY
         path_eeg = prefix + filename + "_eeg"
         path_eeg_ts = prefix + filename + "_eeg_ts"
         path_marker = prefix + filename + "_marker"
@@ -109,3 +409,17 @@ class RecordedData(object):
         np.save(path_eeg_ts, self.get_eeg_ts_numpy())
         np.save(path_marker, self.get_marker_numpy())
         np.save(path_marker_ts, self.get_marker_ts_numpy())
+
+    def save_streamed(self, filename):
+        """Makes the streamed recording with everything appended so far available under filename, streaming goes on
+
+        Every save contains everything since the writer was started. Only the data queued but not yet written has to
+        be written, the files are finalized in place and hard-linked (see RecordingWriter.save_as()), so saving takes
+        the same time no matter how long the recording is. The saved files keep growing with the recording.
+
+        """
+        with self.writer_lock:
+            self.queue_pending_blocks()
+            writer = self.writer
+        if writer is not None:
+            writer.save_as(SAVE_DIRECTORY + filename)
@@ -0,0 +1,106 @@
+from typing import Optional, Tuple
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+
+def sliding_windows(eeg, window_length: int):
+    """Returns a read-only view of shape (num_samples - window_length + 1, window_length, num_chan) of eeg
+
+    Window i starts at sample i. No data is copied (same as numpy.lib.stride_tricks.sliding_window_view, which is only
+    available from numpy 1.20 on).
+
+    """
+    num_windows = max(len(eeg) - window_length + 1, 0)
+    return as_strided(
+        eeg,
+        shape=(num_windows, window_length) + eeg.shape[1:],
+        strides=(eeg.strides[0],) + eeg.strides,
+        writeable=False,
+    )
+
+
+class LazyEpochs(object):
+    """Epochs that are views into the EEG instead of copies, returned by extract_epochs(lazy=True)
+
+    Indexing with an integer returns a (read-only) view of a single epoch, numpy.asarray() copies all epochs into an
+    array of shape (num_trials, window_length, num_chan), so a conversion with copy=False is rejected.
+
+    """
+
+    def __init__(self, windows, onsets):
+        self.windows = windows
+        self.onsets = onsets
+
+    def __len__(self):
+        return len(self.onsets)
+
+    @property
+    def shape(self):
+        return (len(self.onsets),) + self.windows.shape[1:]
+
+    def __getitem__(self, item):
+        if isinstance(item, (int, np.integer)):
+            return self.windows[self.onsets[item]]
+        return LazyEpochs(self.windows, self.onsets[item])
+
+    def __iter__(self):
+        for start in self.onsets:
+            yield self.windows[start]
+
+    def __array__(self, dtype=None, copy=None):
+        if copy is False:
+            raise ValueError("LazyEpochs cannot be converted to an array without copying")
+        # Indexing with the onsets already returns a new array
+        epochs = self.windows[self.onsets]
+        if dtype is None:
+            return epochs
+        return epochs.astype(dtype, copy=False)
+
+
+def extract_epochs(
+    eeg,
+    onsets,
+    num_post: int,
+    num_pre: int = 0,
+    baseline: Optional[Tuple[int, int]] = None,
+    lazy: bool = False,
+):
+    """Cuts epochs of num_pre samples before to num_post samples after every onset out of eeg in one call
+
+    Epochs that are not completely contained in eeg (e.g. trailing trials which are not fully recorded yet) are
+    dropped.
+
+    Args:
+        eeg: Array of shape (num_samples, num_chan)
+        onsets: Sample indices of the stimuli
+        num_post: Number of samples from the onset on (including the onset)
+        num_pre: Number of samples before the onset. Optional, defaults to 0
+        baseline: (start, stop) sample indices relative to the onset (e.g. (-num_pre, 0)), the mean over this interval
+            is subtracted from every epoch and channel. Optional, defaults to no baseline correction
+        lazy: If True (and no baseline correction is done), epochs are returned as LazyEpochs that reference eeg
+            instead of being copied. Optional, defaults to False
+
+    Returns:
+        Tuple (epochs, kept) of the epochs with shape (num_trials, num_pre + num_post, num_chan) and a boolean mask of
+        the onsets that were kept.
+
+    """
+    onsets = np.asarray(onsets, dtype=int)
+    window_length = num_pre + num_post
+    starts = onsets - num_pre
+    kept = (starts >= 0) & (starts + window_length <= len(eeg))
+
+    windows = sliding_windows(eeg, window_length)
+    if lazy and baseline is None:
+        return LazyEpochs(windows, starts[kept]), kept
+
+    epochs = windows[starts[kept]]
+    if baseline is not None:
+        epochs = epochs - np.mean(epochs[:, baseline[0] + num_pre : baseline[1] + num_pre], axis=1, keepdims=True)
+    return epochs, kept
+
+
+def get_epoch_samples(samplerate: float, epoch_start: float, epoch_end: float):
+    """Returns (num_pre, num_post) samples for an epoch from epoch_start (<= 0) to epoch_end seconds around onsets"""
+    return int(round(-epoch_start * samplerate)), int(round(epoch_end * samplerate))
@@ -0,0 +1,96 @@
+from typing import Optional
+
+import numpy as np
+
+
+class EvidenceAccumulator(object):
+    """Posterior probability of every class being the target, updated with every trial (dynamic stopping)
+
+    Every hypothesis "class c is the target" models the features of the trials of class c and of all other classes as
+    two Gaussians with a shared variance per feature (features are assumed to be independent). The likelihood of each
+    hypothesis is maximized over the means and variances, which only needs per-class counts, sums and sums of squares,
+    so adding a trial costs O(num_features) and computing the posteriors O(num_classes * num_features). With a uniform
+    prior, the posterior of a class is its likelihood normalized over all classes.
+
+    As the features of a trial are not really independent, posteriors are overconfident, the threshold should be
+    chosen accordingly (e.g. with analyzer.replay on recorded sessions).
+
+    Args:
+        num_classes: Number of classes (e.g. rows times columns). Decisions are only made when all classes were seen
+        threshold: Posterior probability at which a class is selected. Optional, defaults to 0.99
+        min_trials: Minimum number of trials per class before a decision is made. Optional, defaults to 2
+        max_trials: If given, the most probable class is selected when every class has max_trials trials, no matter
+            its posterior. Optional, defaults to None
+
+    """
+
+    def __init__(
+        self, num_classes: int, threshold: float = 0.99, min_trials: int = 2, max_trials: Optional[int] = None
+    ):
+        self.num_classes = num_classes
+        self.threshold = threshold
+        self.min_trials = min_trials
+        self.max_trials = max_trials
+
+        self.counts = {}
+        self.sums = {}
+        self.squares = {}
+
+    def reset(self):
+        """Forgets all trials, e.g. after a decision"""
+        self.counts = {}
+        self.sums = {}
+        self.squares = {}
+
+    def add_trial(self, marker: int, features):
+        """Adds the features (any shape, the same for all trials) of a trial recorded after marker"""
+        features = np.ravel(features).astype(float)
+        if marker not in self.counts:
+            self.counts[marker] = 0
+            self.sums[marker] = np.zeros_like(features)
+            self.squares[marker] = np.zeros_like(features)
+        self.counts[marker] += 1
+        self.sums[marker] += features
+        self.squares[marker] += features ** 2
+
+    def get_markers(self):
+        """Returns a sorted list of all markers (classes) a trial was added for since the last reset"""
+        return sorted(self.counts)
+
+    def get_posteriors(self):
+        """Returns the posterior probabilities of the classes in self.get_markers() being the target"""
+        markers = self.get_markers()
+        counts = np.array([self.counts[marker] for marker in markers], dtype=float)
+        sums = np.array([self.sums[marker] for marker in markers])
+        squares = np.array([self.squares[marker] for marker in markers])
+        if len(markers) < 2:
+            return np.ones(len(markers))
+
+        num_trials = np.sum(counts)
+        mean = np.sum(sums, axis=0) / num_trials
+        total_scatter = np.sum(squares, axis=0) - num_trials * mean ** 2
+        # Scatter explained by splitting the trials into one class and all others
+        split_scatter = (counts * num_trials / (num_trials - counts))[:, np.newaxis] * (
+            sums / counts[:, np.newaxis] - mean
+        ) ** 2
+        residual = np.maximum(1 - split_scatter / np.maximum(total_scatter, np.finfo(float).tiny), np.finfo(float).tiny)
+
+        log_likelihoods = -num_trials / 2 * np.sum(np.log(residual), axis=1)
+        posteriors = np.exp(log_likelihoods - np.max(log_likelihoods))
+        return posteriors / np.sum(posteriors)
+
+    def decide(self):
+        """Returns the selected marker and resets if the evidence suffices (see class docstring), otherwise None"""
+        if len(self.counts) < self.num_classes or min(self.counts.values()) < self.min_trials:
+            return None
+
+        posteriors = self.get_posteriors()
+        best = int(np.argmax(posteriors))
+        if posteriors[best] < self.threshold and (
+            self.max_trials is None or min(self.counts.values()) < self.max_trials
+        ):
+            return None
+
+        selection = self.get_markers()[best]
+        self.reset()
+        return selection
@@ -0,0 +1,104 @@
+import json
+from typing import Sequence
+
+import numpy as np
+from pylsl import local_clock
+
+
+class LatencyHistogram(object):
+    """Histogram of latencies with logarithmically spaced bins
+
+    Args:
+        min_latency: Upper edge of the first bin in seconds. Optional, defaults to 0.1 ms
+        max_latency: Lower edge of the overflow bin in seconds. Optional, defaults to 10 s
+        num_bins: Number of bins between min_latency and max_latency. Optional, defaults to 100
+
+    """
+
+    def __init__(self, min_latency: float = 1e-4, max_latency: float = 10.0, num_bins: int = 100):
+        self.edges = np.logspace(np.log10(min_latency), np.log10(max_latency), num_bins + 1)
+        # One bin below the first and one above the last edge
+        self.counts = np.zeros(num_bins + 2, dtype=np.int64)
+        self.num_latencies = 0
+        self.max_latency = 0.0
+
+    def add(self, latency: float):
+        self.counts[np.searchsorted(self.edges, latency)] += 1
+        self.num_latencies += 1
+        self.max_latency = max(self.max_latency, latency)
+
+    def merge(self, other: "LatencyHistogram"):
+        """Adds the latencies of other, which must have the same bin edges"""
+        self.counts += other.counts
+        self.num_latencies += other.num_latencies
+        self.max_latency = max(self.max_latency, other.max_latency)
+
+    def percentile(self, percent: float):
+        """Returns the upper bin edge (in seconds) below which percent of the latencies are, None if empty"""
+        if self.num_latencies == 0:
+            return None
+        index = int(np.searchsorted(np.cumsum(self.counts), percent / 100 * self.num_latencies))
+        if index >= len(self.edges):
+            return self.max_latency
+        return float(self.edges[index])
+
+    def to_dict(self):
+        return {
+            "bin edges": self.edges.tolist(),
+            "counts": self.counts.tolist(),
+            "count": self.num_latencies,
+            "max": self.max_latency,
+            "p50": self.percentile(50),
+            "p99": self.percentile(99),
+        }
+
+
+class LatencyProbes(object):
+    """Latencies from the LSL timestamp of the newest sample to the time each stage of the pipeline handled it
+
+    Every stage calls self.add(stage, timestamp) with the LSL timestamp (mapped to the local clock) of the newest
+    sample it processed, the age of this sample is added to the histogram of the stage. Each stage must only be
+    probed from a single thread, stages probed by several threads (e.g. several sessions) get their own probes per
+    thread, which are merged for reporting (self.merge()).
+
+    Args:
+        stages: Names of the stages in pipeline order. Optional, defaults to self.default_stages
+
+    """
+
+    # LSL receive, RecordedData append, analysis, transfer to the plotter, plotted
+    default_stages = ("receive", "append", "analysis", "queue", "plot")
+
+    def __init__(self, stages: Sequence[str] = default_stages):
+        self.histograms = {stage: LatencyHistogram() for stage in stages}
+
+    def add(self, stage: str, timestamp: float):
+        self.histograms[stage].add(local_clock() - timestamp)
+
+    @staticmethod
+    def merge(probes: Sequence["LatencyProbes"]):
+        """Returns new probes holding the latencies of all probes"""
+        stages = []
+        for single_probes in probes:
+            stages.extend(stage for stage in single_probes.histograms if stage not in stages)
+
+        merged = LatencyProbes(stages)
+        for single_probes in probes:
+            for stage, histogram in single_probes.histograms.items():
+                merged.histograms[stage].merge(histogram)
+        return merged
+
+    def get_summary(self):
+        """Returns a message with the median and 99th percentile latency of every stage"""
+        summaries = []
+        for stage, histogram in self.histograms.items():
+            if histogram.num_latencies > 0:
+                summaries.append(
+                    "{} {:.1f}/{:.1f}".format(stage, histogram.percentile(50) * 1000, histogram.percentile(99) * 1000)
+                )
+        return "Latency p50/p99 in ms: " + ", ".join(summaries)
+
+    def export(self, filename: str):
+        """Writes the histograms of all stages as JSON to filename"""
+        with open(filename, "w") as export_file:
+            json.dump({stage: histogram.to_dict() for stage, histogram in self.histograms.items()}, export_file)
@@ -1,20 +1,48 @@
+import time
 from threading import Thread
-from typing import Callable, Dict, Optional
+from typing import Callable, Optional
 
+import numpy as np
 from pylsl import pylsl
 
+from bstadlbauer.p300analyzer.latency import LatencyProbes
+from bstadlbauer.p300analyzer.shared_buffers import SharedState
+
+# NumPy dtypes of the LSL channel formats that can be pulled into preallocated buffers
+LSL_FORMAT_DTYPES = {
+    pylsl.cf_float32: np.float32,
+    pylsl.cf_double64: np.float64,
+    pylsl.cf_int8: np.int8,
+    pylsl.cf_int16: np.int16,
+    pylsl.cf_int32: np.int32,
+    pylsl.cf_int64: np.int64,
+}
+
 
 class LSLReceiverThread(Thread):
     """Worker that reveives samples from an LSL stream
 
+    If block_func is given, samples are pulled in chunks of up to max_chunk_size samples into a preallocated NumPy
+    buffer and handed on as whole blocks, otherwise every sample is pulled and handed on on its own.
+
     Args:
         lsl_inlet: LSL stream inlet
         sample_func: Function that will be called every time a new sample arrives. Should take one argument which is
             the sample
         sample_ts_func: Function that will be called every time a new sample arrives. Should take one argument which
             is the current timestamp of a sample.
-        connect_dict: Connection dict created with multiprocessing.Manager().dict() that holds information shared
-            between all processes and threads. Optional, defaults to None.
+        shared_state: Shared state (analyzer.shared_buffers.SharedState) in which the number of received samples is
+            published as "sample count". Optional, defaults to None.
+        block_func: Function that will be called with every chunk of new samples. Should take two arguments, a numpy
+            array of shape (num_samples, num_channels) and a numpy array of the num_samples timestamps. The sample
+            array is reused for the next chunk, so it has to be copied if it is kept. Optional, defaults to None.
+        max_chunk_size: Maximum number of samples pulled at once in chunked mode. Optional, defaults to 1024
+        chunk_timeout: Seconds to wait for max_chunk_size samples before handing on the samples received so far in
+            chunked mode. Optional, defaults to 0.05
+        count_interval: Minimal time in seconds between two updates of "sample count" in shared_state in chunked
+            mode. Optional, defaults to 0.5
+        latency_probes: If given, the age of the newest sample is probed after receiving ("receive") and after
+            handing on ("append") every sample or chunk. Optional, defaults to None
 
     """
 
@@ -23,17 +51,31 @@ class LSLReceiverThread(Thread):
         lsl_inlet: pylsl.StreamInlet,
         sample_func: Callable,
         sample_ts_func: Callable,
-        connect_dict: Optional[Dict] = None,
+        shared_state: Optional[SharedState] = None,
+        block_func: Optional[Callable] = None,
+        max_chunk_size: int = 1024,
+        chunk_timeout: float = 0.05,
+        count_interval: float = 0.5,
+        latency_probes: Optional[LatencyProbes] = None,
     ):
         Thread.__init__(self)
         self.lsl_stream_inlet = lsl_inlet
         self.sample_func = sample_func
         self.sample_ts_func = sample_ts_func
 
-        self.connect_dict = connect_dict
+        self.shared_state = shared_state
+
+        self.block_func = block_func
+        self.max_chunk_size = max_chunk_size
+        self.chunk_timeout = chunk_timeout
+        self.count_interval = count_interval
+        self.latency_probes = latency_probes
 
     def run(self):
-        self.receive_data()
+        if self.block_func is not None and self.lsl_stream_inlet.info().channel_format() in LSL_FORMAT_DTYPES:
+            self.receive_chunks()
+        else:
+            self.receive_data()
 
     def receive_data(self):
         # First call of inlet correction is slower. Called once before "real"
@@ -43,10 +85,48 @@ class LSLReceiverThread(Thread):
         num_samples = 0
         while True:
             (sample, timestamp) = self.lsl_stream_inlet.pull_sample()
-            timestamp -= self.lsl_stream_inlet.time_correction()
+            # Map the timestamp from the clock of the sender to the local clock
+            timestamp += self.lsl_stream_inlet.time_correction()
+            if self.latency_probes is not None:
+                self.latency_probes.add("receive", timestamp)
             self.sample_func(sample)
             self.sample_ts_func(timestamp)
+            if self.latency_probes is not None:
+                self.latency_probes.add("append", timestamp)
             num_samples += 1
 
-            if self.connect_dict is not None:
-                self.connect_dict["sample count"] = num_samples
+            if self.shared_state is not None:
+                self.shared_state["sample count"] = num_samples
+
+    def receive_chunks(self):
+        self.lsl_stream_inlet.time_correction()
+
+        info = self.lsl_stream_inlet.info()
+        chunk_buffer = np.empty(
+            [self.max_chunk_size, info.channel_count()], dtype=LSL_FORMAT_DTYPES[info.channel_format()]
+        )
+
+        num_samples = 0
+        published_num_samples = 0
+        last_published = time.monotonic()
+        while True:
+            _, timestamps = self.lsl_stream_inlet.pull_chunk(self.chunk_timeout, self.max_chunk_size, chunk_buffer)
+            num_new_samples = len(timestamps)
+            if num_new_samples > 0:
+                timestamps = np.array(timestamps) + self.lsl_stream_inlet.time_correction()
+                if self.latency_probes is not None:
+                    self.latency_probes.add("receive", timestamps[-1])
+                self.block_func(chunk_buffer[:num_new_samples], timestamps)
+                if self.latency_probes is not None:
+                    self.latency_probes.add("append", timestamps[-1])
+                num_samples += num_new_samples
+
+            now = time.monotonic()
+            if (
+                self.shared_state is not None
+                and num_samples != published_num_samples
+                and now - last_published >= self.count_interval
+            ):
+                self.shared_state["sample count"] = num_samples
+                published_num_samples = num_samples
+                last_published = now
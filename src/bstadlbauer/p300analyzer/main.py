@@ -1,6 +1,48 @@
+import argparse
+import json
+
 from bstadlbauer.p300analyzer.connect import ConnectorProc
 
 
+def parse_config():
+    """Returns (headless, config) from the command line, entries of --config are overridden by explicit arguments"""
+    parser = argparse.ArgumentParser(description="Live visualization of the P300 paradigm")
+    parser.add_argument("--headless", action="store_true", help="Run without GUI and plots")
+    parser.add_argument("--config", help="JSON file with entries of the connector dict and settings")
+    parser.add_argument("--eeg-stream", help="Name of the EEG stream")
+    parser.add_argument("--marker-stream", help="Name of the marker stream")
+    parser.add_argument("--output", help="File or tcp://host:port the results of every update are written to")
+    parser.add_argument("--savefile", help="Name the recording is saved as when stopped (headless)")
+    parser.add_argument(
+        "--session",
+        nargs=2,
+        action="append",
+        metavar=("EEG_STREAM", "MARKER_STREAM"),
+        help="EEG and marker stream of one participant, repeat to analyze several participants at once",
+    )
+    args = parser.parse_args()
+
+    config = {}
+    if args.config is not None:
+        with open(args.config) as config_file:
+            config.update(json.load(config_file))
+
+    arguments = {
+        "eeg streamname": args.eeg_stream,
+        "marker streamname": args.marker_stream,
+        "output": args.output,
+        "savefile": args.savefile,
+    }
+    config.update({key: value for key, value in arguments.items() if value is not None})
+    if args.session is not None:
+        config["sessions"] = [
+            {"eeg streamname": eeg_stream, "marker streamname": marker_stream}
+            for eeg_stream, marker_stream in args.session
+        ]
+    headless = config.pop("headless", False) or args.headless
+    return headless, config
+
+
 def main():
     import multiprocessing
     import platform
@@ -8,5 +50,6 @@ def main():
     if platform.system() == "Darwin":
         multiprocessing.set_start_method("spawn")
 
-    main_process = ConnectorProc()
+    headless, config = parse_config()
+    main_process = ConnectorProc(headless, config)
     main_process.run()
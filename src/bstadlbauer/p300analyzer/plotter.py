@@ -0,0 +1,377 @@
+import multiprocessing as mp
+import time
+from typing import List, Optional, Tuple
+
+import matplotlib
+
+matplotlib.use("Qt5Agg")  # MUST BE CALLED BEFORE IMPORTING matplotlib.pyplot
+
+import matplotlib.pyplot as plt  # noqa: E402
+import numpy as np  # noqa: E402
+from matplotlib.collections import LineCollection  # noqa: E402
+
+from bstadlbauer.p300analyzer.epoching import get_epoch_samples  # noqa: E402
+from bstadlbauer.p300analyzer.latency import LatencyProbes  # noqa: E402
+from bstadlbauer.p300analyzer.sessions import Session  # noqa: E402
+from bstadlbauer.p300analyzer.shared_buffers import LatestValueBuffer  # noqa: E402
+
+
+def get_x_axis(samplerate: int, epoch_start: float, epoch_end: float):
+    """Returns the times of the samples of an epoch in milliseconds relative to the marker"""
+    num_pre, num_post = get_epoch_samples(samplerate, epoch_start, epoch_end)
+    return (np.arange(num_pre + num_post) - num_pre) / samplerate * 1000
+
+
+def set_stacked_segments(line_collection: LineCollection, x_axis, avg_trials, ylim, num_classes: int):
+    """Sets the lines of line_collection to the first num_classes rows of avg_trials, class i offset by i times the
+    y-axis range, so all classes are stacked in one axes"""
+    avg_trials = avg_trials[:num_classes, : len(x_axis)]
+    y = avg_trials + np.arange(len(avg_trials))[:, np.newaxis] * (ylim[1] - ylim[0])
+    line_collection.set_segments(np.stack([np.broadcast_to(x_axis, y.shape), y], axis=-1))
+
+
+def set_stacked_ylim(axes, ylim, num_classes: int):
+    """Sets the y-axis of axes with num_classes stacked classes (see set_stacked_segments()), each class is labeled
+    at the lower limit of its range"""
+    span = ylim[1] - ylim[0]
+    axes.set_ylim(ylim[0], ylim[0] + num_classes * span)
+    axes.set_yticks(ylim[0] + np.arange(num_classes) * span)
+    axes.set_yticklabels([str(i + 1) for i in range(num_classes)])
+
+
+class BlitPlotter(object):
+    """Base class of the plotters, redraws only the lines and limits the time spent redrawing
+
+    Only the lines (self.get_artists()) are redrawn on every frame: the static parts of the figure (axes, ticks,
+    labels) are drawn once and cached, on every frame the cached background is restored and the lines are blitted on
+    top of it. If the canvas does not support blitting, the whole figure is drawn instead.
+
+    The time needed per frame is measured and redraws are rate limited, so plotting takes at most max_duty_cycle of the
+    time (self.redraw_due()).
+
+    Args:
+        max_duty_cycle: Maximum fraction of time spent redrawing
+
+    """
+
+    # Weight of the newest frame time in the moving average
+    frame_time_smoothing = 0.1
+
+    def __init__(self, max_duty_cycle: float):
+        self.max_duty_cycle = max_duty_cycle
+
+        self.figure = None
+        self.background = None
+
+        self.frame_time = 0.0
+        self.num_frames = 0
+        self.last_redraw = 0.0
+
+    @property
+    def redraw_interval(self):
+        """Minimal time in seconds between two redraws, adapted to the measured frame time"""
+        return self.frame_time / self.max_duty_cycle
+
+    def redraw_due(self):
+        return time.perf_counter() - self.last_redraw >= self.redraw_interval
+
+    def get_artists(self):
+        """Returns the artists that are redrawn on every frame"""
+        raise NotImplementedError()
+
+    def show_figure(self):
+        """Sets up blitting (if supported by the canvas) and shows self.figure maximized"""
+        if getattr(self.figure.canvas, "supports_blit", False):
+            # Animated artists are left out in full draws and blitted on top of the cached background
+            for artist in self.get_artists():
+                artist.set_animated(True)
+            self.figure.canvas.mpl_connect("draw_event", self.cache_background)
+
+        fig_manager = plt.get_current_fig_manager()
+        fig_manager.window.showMaximized()
+        self.figure.canvas.draw()
+        self.figure.canvas.flush_events()
+
+    def cache_background(self, event=None):
+        """Caches everything but the lines after each full draw (e.g. after resizing or changing the y-axis limits)"""
+        self.background = self.figure.canvas.copy_from_bbox(self.figure.bbox)
+        for artist in self.get_artists():
+            artist.axes.draw_artist(artist)
+
+    def redraw_static(self):
+        """Redraws the whole figure after static parts changed"""
+        if self.background is not None:
+            # This triggers self.cache_background()
+            self.figure.canvas.draw()
+
+    def draw(self):
+        """Draws a frame with the current data of the lines and updates the measured frame time"""
+        start = time.perf_counter()
+
+        canvas = self.figure.canvas
+        if self.background is not None:
+            canvas.restore_region(self.background)
+            for artist in self.get_artists():
+                artist.axes.draw_artist(artist)
+            canvas.blit(self.figure.bbox)
+        else:
+            canvas.draw()
+        canvas.flush_events()
+
+        now = time.perf_counter()
+        frame_time = now - start
+        if self.num_frames == 0:
+            self.frame_time = frame_time
+        else:
+            self.frame_time += self.frame_time_smoothing * (frame_time - self.frame_time)
+        self.num_frames += 1
+        self.last_redraw = now
+
+
+class Plotter(BlitPlotter):
+    """Main class for potting the averaged result
+
+    Only the lines are redrawn on every update and redraws are rate limited (see BlitPlotter). Frames that arrive in
+    between are skipped (and show up in plot_buffer.dropped_frames).
+
+    Args:
+        samplerate: Samplerate of the data
+        start_ylim: Limits of the y-axis to create the plot with
+        num_rows: Number of rows in the speller
+        num_cols: Number of columns in the speller
+        plot_buffer: Buffer that will be periodically polled for new y-axis data. Frames overwritten before they
+            were plotted are counted in plot_buffer.dropped_frames
+        axis_queue: Queue that will be periodically polled for new y-axis limits
+        single_axes: If True, all classes are drawn into one axes as a single LineCollection, each class offset by
+            the y-axis range, instead of one axes per class. Optional, defaults to False
+        max_duty_cycle: Maximum fraction of time spent redrawing. Optional, defaults to 0.5
+        epoch_start: Start of the plotted epochs in seconds relative to the marker. Optional, defaults to 0
+        epoch_end: End of the plotted epochs in seconds relative to the marker. Optional, defaults to 1
+        latency_probes: If given, the age of the newest sample of the averages is probed when they are read from
+            plot_buffer ("queue") and when they were plotted ("plot"). Optional, defaults to None
+
+    """
+
+    def __init__(
+        self,
+        samplerate: int,
+        start_ylim: Tuple[int, int],
+        num_rows: int,
+        num_cols: int,
+        plot_buffer: LatestValueBuffer,
+        axis_queue: mp.Queue,
+        single_axes: bool = False,
+        max_duty_cycle: float = 0.5,
+        epoch_start: float = 0.0,
+        epoch_end: float = 1.0,
+        latency_probes: Optional[LatencyProbes] = None,
+    ):
+        super().__init__(max_duty_cycle)
+        self.samplerate = samplerate
+        self.num_rows = num_rows
+        self.num_cols = num_cols
+        self.single_axes = single_axes
+        self.epoch_start = epoch_start
+        self.epoch_end = epoch_end
+        self.latency_probes = latency_probes
+
+        self.plot_buffer = plot_buffer
+        self.axis_queue = axis_queue
+
+        self.axes = None
+        self.lines = None
+        self.line_collection = None
+        self.x_axis = None
+        self.ylim = start_ylim
+
+        self.create_figure(start_ylim)
+
+    def update_plot(self, avg_trials):
+        if self.single_axes:
+            set_stacked_segments(
+                self.line_collection, self.x_axis, avg_trials, self.ylim, self.num_rows * self.num_cols
+            )
+        else:
+            for i, line in enumerate(self.lines[: len(avg_trials)]):
+                line.set_ydata(avg_trials[i, :])
+        self.draw()
+
+    def create_figure(self, ylim):
+        # Turn on interactive plotting
+        plt.ion()
+        self.x_axis = get_x_axis(self.samplerate, self.epoch_start, self.epoch_end)
+
+        if self.single_axes:
+            self.create_single_axes(ylim)
+        else:
+            self.create_grid_axes(ylim)
+        self.show_figure()
+
+    def create_grid_axes(self, ylim):
+        self.figure, self.axes = plt.subplots(self.num_rows, self.num_cols, sharex="col", sharey="row")
+
+        y = np.zeros(len(self.x_axis))
+
+        self.lines = []
+        for row in self.axes:
+            for col in row:
+                (line,) = col.plot(self.x_axis, y)
+                self.lines.append(line)
+                col.set_ylim(ylim)
+
+    def create_single_axes(self, ylim):
+        self.figure, self.axes = plt.subplots()
+
+        self.line_collection = LineCollection([], colors=plt.rcParams["axes.prop_cycle"].by_key()["color"])
+        self.axes.add_collection(self.line_collection)
+        self.axes.set_xlim(self.x_axis[0], self.x_axis[-1])
+        self.update_axes(ylim)
+
+    def get_artists(self):
+        if self.single_axes:
+            return [self.line_collection]
+        return self.lines
+
+    def update_axes(self, ylim):
+        self.ylim = ylim
+        if self.single_axes:
+            set_stacked_ylim(self.axes, ylim, self.num_rows * self.num_cols)
+        else:
+            for row in self.axes:
+                for col in row:
+                    col.set_ylim(ylim)
+        self.redraw_static()
+
+    def get_frame_stats(self):
+        """Returns a message with the measured frame time, current redraw interval and number of dropped frames"""
+        return "Plotting: {:.1f} ms per frame, redrawing at most every {:.1f} ms, {} frames dropped".format(
+            self.frame_time * 1000, self.redraw_interval * 1000, self.plot_buffer.dropped_frames
+        )
+
+    def update_data_if_possible(self):
+        if not self.redraw_due():
+            return
+
+        avg_trials = self.plot_buffer.read()
+        if avg_trials is None:
+            return
+
+        timestamp = self.plot_buffer.last_timestamp
+        if self.latency_probes is not None and timestamp is not None:
+            self.latency_probes.add("queue", timestamp)
+        self.update_plot(avg_trials)
+        if self.latency_probes is not None and timestamp is not None:
+            self.latency_probes.add("plot", timestamp)
+
+    def udpate_axis_if_possible(self):
+        if not self.axis_queue.empty():
+            self.update_axes(self.axis_queue.get())
+
+
+class SessionPlotter(BlitPlotter):
+    """Plots the averages of several sessions into one figure
+
+    Every session gets one axes titled with its name, in which all its classes are drawn as a single LineCollection,
+    each class offset by the y-axis range of the session (as Plotter with single_axes). As in Plotter, only the lines
+    are redrawn and redraws are rate limited (see BlitPlotter). All sessions with new averages are redrawn together in
+    one frame, so the cost of plotting grows with the number of lines, not of figures.
+
+    Args:
+        sessions: Connected analyzer.sessions.Session instances, their averages are read from session.plot_buffer and
+            their y-axis limits from session.axis_queue
+        max_duty_cycle: Maximum fraction of time spent redrawing. Optional, defaults to 0.5
+        latency_probes: If given, the age of the newest sample of the averages is probed when they are read ("queue")
+            and when they were plotted ("plot"). Optional, defaults to None
+
+    """
+
+    def __init__(
+        self, sessions: List[Session], max_duty_cycle: float = 0.5, latency_probes: Optional[LatencyProbes] = None
+    ):
+        super().__init__(max_duty_cycle)
+        self.sessions = sessions
+        self.latency_probes = latency_probes
+
+        self.axes = []
+        self.line_collections = []
+        self.x_axes = []
+        self.ylims = [session.shared_state["y lim"] for session in sessions]
+
+        self.create_figure()
+
+    def get_num_classes(self, index):
+        connect_dict = self.sessions[index].connect_dict
+        return connect_dict["num rows"] * connect_dict["num cols"]
+
+    def create_figure(self):
+        plt.ion()
+        num_cols = int(np.ceil(np.sqrt(len(self.sessions))))
+        num_rows = int(np.ceil(len(self.sessions) / num_cols))
+        self.figure, axes = plt.subplots(num_rows, num_cols, squeeze=False)
+        for unused_axes in axes.flat[len(self.sessions) :]:
+            unused_axes.set_visible(False)
+
+        colors = plt.rcParams["axes.prop_cycle"].by_key()["color"]
+        for index, (session, session_axes) in enumerate(zip(self.sessions, axes.flat)):
+            connect_dict = session.connect_dict
+            x_axis = get_x_axis(connect_dict["samplerate"], connect_dict["epoch start"], connect_dict["epoch end"])
+
+            line_collection = LineCollection([], colors=colors)
+            session_axes.add_collection(line_collection)
+            session_axes.set_xlim(x_axis[0], x_axis[-1])
+            session_axes.set_title(session.name)
+
+            self.axes.append(session_axes)
+            self.line_collections.append(line_collection)
+            self.x_axes.append(x_axis)
+            self.update_axes(index, self.ylims[index])
+        self.show_figure()
+
+    def get_artists(self):
+        return self.line_collections
+
+    def update_axes(self, index, ylim):
+        self.ylims[index] = ylim
+        set_stacked_ylim(self.axes[index], ylim, self.get_num_classes(index))
+        self.redraw_static()
+
+    def set_averages(self, index, avg_trials):
+        set_stacked_segments(
+            self.line_collections[index], self.x_axes[index], avg_trials, self.ylims[index], self.get_num_classes(index)
+        )
+
+    def get_frame_stats(self):
+        """Returns a message with the measured frame time, current redraw interval and number of dropped frames"""
+        return "Plotting {} sessions: {:.1f} ms per frame, redrawing at most every {:.1f} ms, {} frames dropped".format(
+            len(self.sessions),
+            self.frame_time * 1000,
+            self.redraw_interval * 1000,
+            sum(session.plot_buffer.dropped_frames for session in self.sessions),
+        )
+
+    def update_if_possible(self):
+        """Applies new y-axis limits and redraws the sessions with new averages if the redraw interval passed"""
+        for index, session in enumerate(self.sessions):
+            if not session.axis_queue.empty():
+                self.update_axes(index, session.axis_queue.get())
+
+        if not self.redraw_due():
+            return
+
+        timestamps = []
+        for index, session in enumerate(self.sessions):
+            avg_trials = session.plot_buffer.read()
+            if avg_trials is not None:
+                self.set_averages(index, avg_trials)
+                timestamps.append(session.plot_buffer.last_timestamp)
+        if not timestamps:
+            return
+
+        timestamps = [timestamp for timestamp in timestamps if timestamp is not None]
+        if self.latency_probes is not None:
+            for timestamp in timestamps:
+                self.latency_probes.add("queue", timestamp)
+        self.draw()
+        if self.latency_probes is not None:
+            for timestamp in timestamps:
+                self.latency_probes.add("plot", timestamp)
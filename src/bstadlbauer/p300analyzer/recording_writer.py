@@ -0,0 +1,252 @@
+"""Streams recorded data to disk while recording runs
+
+Every stream (EEG, EEG timestamps, markers, marker timestamps and optionally the raw EEG) is appended to its own .npy
+file. The header of each file reserves space for the shape, which is rewritten on every periodic sync and when the
+recording is finalized. Files can therefore be loaded (also memory-mapped, numpy.load(path, mmap_mode="r")) at any
+time and contain at least all data up to the last sync, even after a crash. repair_recording() restores the full
+length of files that were not finalized. The recording can be saved under another name at any time without
+interrupting it (RecordingWriter.save_as()): the headers are finalized in place and the files are hard-linked, which
+takes constant time no matter how long the recording is.
+
+"""
+import ast
+import os
+import queue
+import time
+from threading import Event, Thread
+from typing import Dict, Optional
+
+import numpy as np
+
+# Suffixes of the files written per stream, same as in analyzer.data.RecordedData.save(), plus the optional archive of
+# the received EEG before preprocessing and decimation
+STREAM_SUFFIXES = {
+    "eeg": "_eeg.npy",
+    "eeg_ts": "_eeg_ts.npy",
+    "marker": "_marker.npy",
+    "marker_ts": "marker_ts.npy",
+    "raw_eeg": "_raw_eeg.npy",
+    "raw_eeg_ts": "_raw_eeg_ts.npy",
+}
+
+NPY_MAGIC = b"\x93NUMPY\x01\x00"
+NPY_HEADER_LENGTH = 128
+
+
+def npy_header(dtype, shape):
+    """Returns a .npy (version 1.0) header of fixed length NPY_HEADER_LENGTH"""
+    header = "{{'descr': {!r}, 'fortran_order': False, 'shape': {!r}, }}".format(np.dtype(dtype).str, tuple(shape))
+    header_length = NPY_HEADER_LENGTH - len(NPY_MAGIC) - 2
+    header = header.ljust(header_length - 1) + "\n"
+    return NPY_MAGIC + header_length.to_bytes(2, "little") + header.encode("latin1")
+
+
+class StreamFile(object):
+    """.npy file of one stream that rows are appended to"""
+
+    def __init__(self, path: str, dtype, row_shape):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.row_shape = tuple(row_shape)
+        self.num_rows = 0
+        self.num_rows_in_header = 0
+
+        self.file = open(path, "w+b")
+        self.file.write(npy_header(self.dtype, (0,) + self.row_shape))
+
+    def append(self, rows):
+        self.file.write(np.ascontiguousarray(rows, dtype=self.dtype).tobytes())
+        self.num_rows += len(rows)
+
+    def sync(self):
+        """Writes the current number of rows into the header and flushes everything to disk"""
+        if self.num_rows != self.num_rows_in_header:
+            self.file.seek(0)
+            self.file.write(npy_header(self.dtype, (self.num_rows,) + self.row_shape))
+            self.file.seek(0, os.SEEK_END)
+            self.num_rows_in_header = self.num_rows
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.sync()
+        self.file.close()
+
+
+def copy_rows(source_path: str, path: str, dtype, row_shape, num_rows: int):
+    """Writes the first num_rows rows (which have to be flushed already) of the stream file source_path with a
+    finalized header to path, rows can be appended to the source meanwhile"""
+    with open(source_path, "rb") as source, open(path, "wb") as target:
+        target.write(npy_header(dtype, (num_rows,) + row_shape))
+        source.seek(NPY_HEADER_LENGTH)
+        copy_bytes(source, target, num_rows * dtype.itemsize * int(np.prod(row_shape)))
+
+
+def copy_all_rows(copies):
+    """Calls copy_rows() with the arguments of every entry of copies"""
+    for copy in copies:
+        copy_rows(*copy)
+
+
+def copy_bytes(source, target, num_bytes: int, buffer_size: int = 1 << 20):
+    """Copies num_bytes from the current position of the file source to target"""
+    while num_bytes > 0:
+        chunk = source.read(min(buffer_size, num_bytes))
+        if not chunk:
+            break
+        target.write(chunk)
+        num_bytes -= len(chunk)
+
+
+class SaveRequest(object):
+    """Request to save a recording under another name, queued like a block so it covers exactly the blocks queued
+    before it
+
+    The writer thread only syncs the files (which finalizes their headers in place) and notes their paths, dtypes, row
+    shapes and number of rows (self.streams), linking or copying is done by the requesting thread.
+
+    """
+
+    def __init__(self):
+        self.streams = {}
+        self.done = Event()
+
+
+class RecordingWriter(Thread):
+    """Background thread that appends blocks of recorded data to disk
+
+    Blocks are passed in with self.write() or, for several streams at once, self.write_blocks() through a bounded
+    queue (the caller blocks if the writer falls behind by more than max_queued_blocks blocks). Blocks queued together
+    are always written together. Files are synced to disk every sync_interval seconds. self.finalize() writes the
+    remaining queued blocks (at most max_queued_blocks) and closes the files, so it does not depend on the length of
+    the recording. self.save_as() makes everything queued so far available under another name while writing goes on.
+
+    Args:
+        path_prefix: Path and filename prefix of the files, the suffixes in STREAM_SUFFIXES are appended
+        max_queued_blocks: Maximum number of blocks waiting to be written. Optional, defaults to 1024
+        sync_interval: Seconds between two syncs of the files to disk. Optional, defaults to 5
+
+    """
+
+    def __init__(self, path_prefix: str, max_queued_blocks: int = 1024, sync_interval: float = 5.0):
+        Thread.__init__(self, daemon=True)
+        self.path_prefix = path_prefix
+        self.sync_interval = sync_interval
+
+        self.block_queue = queue.Queue(max_queued_blocks)
+        self.files = {}
+        self.finalized = False
+
+    def get_path(self, stream: str):
+        return self.path_prefix + STREAM_SUFFIXES[stream]
+
+    def write(self, stream: str, rows):
+        """Queues rows (first axis) for stream, which is one of the keys of STREAM_SUFFIXES. rows is copied."""
+        self.block_queue.put([(stream, np.array(rows))])
+
+    def write_blocks(self, blocks: Dict):
+        """Queues the rows of several streams (dict of stream to rows) as one item, so they end up in the same files
+        and saved files. The rows are not copied and must not be changed afterwards."""
+        self.block_queue.put([(stream, np.asarray(rows)) for stream, rows in blocks.items()])
+
+    def run(self):
+        last_sync = time.monotonic()
+        while True:
+            try:
+                block = self.block_queue.get(timeout=self.sync_interval)
+            except queue.Empty:
+                block = None
+
+            if block is None:
+                pass
+            elif isinstance(block, SaveRequest):
+                self.sync_for_save(block)
+            elif block[0] is None:
+                break
+            else:
+                for stream, rows in block:
+                    self.append_block(stream, rows)
+
+            if time.monotonic() - last_sync >= self.sync_interval:
+                for stream_file in self.files.values():
+                    stream_file.sync()
+                last_sync = time.monotonic()
+
+        for stream_file in self.files.values():
+            stream_file.close()
+
+    def append_block(self, stream, rows):
+        if stream not in self.files:
+            self.files[stream] = StreamFile(self.get_path(stream), rows.dtype, rows.shape[1:])
+        self.files[stream].append(rows)
+
+    def sync_for_save(self, request: SaveRequest):
+        for stream, stream_file in self.files.items():
+            stream_file.sync()
+            request.streams[stream] = (stream_file.path, stream_file.dtype, stream_file.row_shape, stream_file.num_rows)
+        request.done.set()
+
+    def save_as(self, path_prefix: str):
+        """Makes all streams with everything queued so far available as files starting with path_prefix (same
+        suffixes as the recording) in constant time, the recording itself goes on meanwhile
+
+        The headers of the files are finalized in place and the files are hard-linked to the new names, so nothing is
+        copied. The linked files are the recording itself: they grow while it goes on and their headers are updated
+        by every sync and by self.finalize(), so they always load with at least everything queued before this call.
+        Existing files are replaced. Where hard links are not supported, the rows queued so far are copied into
+        finalized files by a background thread instead, which is returned (None otherwise).
+
+        """
+        request = SaveRequest()
+        self.block_queue.put(request)
+        request.done.wait()
+
+        copies = []
+        for stream, (path, dtype, row_shape, num_rows) in request.streams.items():
+            target = path_prefix + STREAM_SUFFIXES[stream]
+            if os.path.abspath(target) == os.path.abspath(path):
+                continue
+            try:
+                link_path = target + ".link"
+                if os.path.lexists(link_path):
+                    os.remove(link_path)
+                os.link(path, link_path)
+                os.replace(link_path, target)
+            except OSError:
+                copies.append((path, target, dtype, row_shape, num_rows))
+
+        if not copies:
+            return None
+        copy_thread = Thread(target=copy_all_rows, args=(copies,), name="recording copy", daemon=True)
+        copy_thread.start()
+        return copy_thread
+
+    def finalize(self, timeout: Optional[float] = None):
+        """Writes all queued blocks, updates the headers and closes the files"""
+        if self.finalized:
+            return
+        self.finalized = True
+        self.block_queue.put((None, None))
+        self.join(timeout)
+
+
+def repair_recording(path_prefix: str):
+    """Sets the shape in the headers of a recording that was not finalized (e.g. after a crash) to all complete rows
+    found in the files"""
+    for suffix in STREAM_SUFFIXES.values():
+        path = path_prefix + suffix
+        if not os.path.isfile(path):
+            continue
+
+        with open(path, "r+b") as npy_file:
+            header = npy_file.read(NPY_HEADER_LENGTH)
+            header_dict = ast.literal_eval(header[len(NPY_MAGIC) + 2 :].decode("latin1"))
+            dtype = np.dtype(header_dict["descr"])
+            row_shape = tuple(header_dict["shape"][1:])
+
+            data_length = os.path.getsize(path) - NPY_HEADER_LENGTH
+            num_rows = data_length // (dtype.itemsize * int(np.prod(row_shape)))
+
+            npy_file.seek(0)
+            npy_file.write(npy_header(dtype, (num_rows,) + row_shape))
+            npy_file.truncate(NPY_HEADER_LENGTH + num_rows * dtype.itemsize * int(np.prod(row_shape)))
@@ -0,0 +1,179 @@
+"""Replays saved sessions offline through the averaging and classification of analyzer.analysis_thread.AnalysisThread
+
+Saved files (analyzer.data.RecordedData.save() or a streamed analyzer.recording_writer.RecordingWriter recording) are
+memory-mapped and fed block by block into a RecordedData that only retains a window of the session, so recordings of
+any length can be replayed without loading them into memory. Replaying runs as fast as possible or at a multiple of
+the recording speed.
+
+Usage: replay-analyzer saved_data/session1 saved_data/session2 --speed 4
+
+"""
+import argparse
+import time
+from typing import Dict, Optional
+
+import numpy as np
+
+from bstadlbauer.p300analyzer.analysis_thread import AnalysisThread
+from bstadlbauer.p300analyzer.data import RecordedData
+from bstadlbauer.p300analyzer.recording_writer import STREAM_SUFFIXES
+from bstadlbauer.p300analyzer.shared_buffers import SharedState
+
+
+class Replayer(object):
+    """Feeds one saved session into an AnalysisThread (without starting the thread) and collects its results
+
+    Args:
+        path_prefix: Path and filename prefix of the saved files (e.g. "saved_data/session1")
+        samplerate: Samplerate of the EEG. If None, it is estimated from the EEG timestamps. Optional, defaults to None
+        speed: Multiple of the recording speed to replay at, None replays as fast as possible. Optional, defaults to
+            None
+        block_seconds: Seconds of EEG appended at once. Optional, defaults to 0.1
+        update_seconds: Seconds of EEG between two analysis updates. Optional, defaults to 1
+        retention_seconds: Seconds of EEG kept in memory, has to be longer than an epoch. Optional, defaults to 60
+        settings: Entries overriding the analysis configuration (same keys as the connector dict of
+            analyzer.connect.ConnectorProc, e.g. "epoch start" or "drift correction"). Optional, defaults to none
+
+    """
+
+    # Defaults of the connector dict entries used by the AnalysisThread
+    default_settings = {
+        "epoch start": 0.0,
+        "epoch end": 1.0,
+        "baseline": None,
+        "drift correction": False,
+        "drift window": 60,
+        "classifier": "channel",
+        "spatial filters": 1,
+        "feature window": (0.2, 0.5),
+        "feature decimation": 4,
+        "dynamic stopping": None,
+        "max trials": None,
+        "channel select": 0,
+        "squared": 0,
+    }
+
+    def __init__(
+        self,
+        path_prefix: str,
+        samplerate: Optional[float] = None,
+        speed: Optional[float] = None,
+        block_seconds: float = 0.1,
+        update_seconds: float = 1.0,
+        retention_seconds: float = 60,
+        settings: Optional[Dict] = None,
+    ):
+        self.path_prefix = path_prefix
+        self.speed = speed
+
+        self.eeg = self.load("eeg")
+        self.eeg_ts = self.load("eeg_ts")
+        self.markers = self.load("marker")
+        self.marker_ts = self.load("marker_ts")
+        if len(self.markers) != len(self.marker_ts):
+            # RecordedData.save() stores a placeholder marker if no markers were received
+            self.markers = self.markers[: len(self.marker_ts)]
+
+        if samplerate is None:
+            samplerate = estimate_samplerate(self.eeg_ts)
+        self.samplerate = samplerate
+        self.block_size = max(int(block_seconds * samplerate), 1)
+        self.update_size = max(int(update_seconds * samplerate), 1)
+
+        self.settings = dict(self.default_settings)
+        if settings is not None:
+            self.settings.update(settings)
+        self.settings["samplerate"] = samplerate
+        if "num rows" not in self.settings:
+            # Every class is assumed to have been flashed in the session
+            self.settings["num rows"] = len(np.unique(self.markers[:, 0]))
+            self.settings["num cols"] = 1
+
+        self.data = RecordedData(0, retention_seconds)
+        self.data.set_samplerate(samplerate)
+        self.data.set_num_channel(self.eeg.shape[1])
+
+        shared_state = SharedState()
+        shared_state.update({"channel select": self.settings["channel select"], "squared": self.settings["squared"]})
+        self.analysis = AnalysisThread(self.data, self.settings, None, None, None, shared_state)
+
+        # (recording time in seconds, classification) after every update
+        self.classifications = []
+
+    def load(self, stream: str):
+        return np.load(self.path_prefix + STREAM_SUFFIXES[stream], mmap_mode="r")
+
+    def run(self):
+        """Replays the whole session, returns the final (avg_trials, classification) as AnalysisThread.analyze()"""
+        num_samples = min(len(self.eeg), len(self.eeg_ts))
+        start_time = time.monotonic()
+        num_markers = 0
+        next_update = self.update_size
+        avg_trials, classification = None, None
+
+        for start in range(0, num_samples, self.block_size):
+            stop = min(start + self.block_size, num_samples)
+            eeg_ts = self.eeg_ts[start:stop]
+            if self.speed is not None:
+                delay = start_time + (eeg_ts[-1] - self.eeg_ts[0]) / self.speed - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+
+            self.data.append_eeg_block(self.eeg[start:stop], eeg_ts, preprocessed=True)
+            new_num_markers = int(np.searchsorted(self.marker_ts, eeg_ts[-1], "right"))
+            if new_num_markers > num_markers:
+                self.data.append_marker_block(
+                    self.markers[num_markers:new_num_markers], self.marker_ts[num_markers:new_num_markers]
+                )
+                num_markers = new_num_markers
+
+            if stop >= next_update or stop == num_samples:
+                avg_trials, classification = self.analysis.analyze()
+                self.classifications.append((stop / self.samplerate, classification))
+                next_update += self.update_size
+
+        return avg_trials, classification
+
+
+def estimate_samplerate(timestamps):
+    """Returns the samplerate estimated from the timestamps of consecutive samples"""
+    return float(np.round((len(timestamps) - 1) / (timestamps[-1] - timestamps[0])))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replays saved sessions through the averaging and classification")
+    parser.add_argument("sessions", nargs="+", help="Path and filename prefix of the saved files of each session")
+    parser.add_argument("--samplerate", type=float, help="Samplerate of the EEG, estimated from timestamps if unset")
+    parser.add_argument("--speed", type=float, help="Multiple of the recording speed, as fast as possible if unset")
+    parser.add_argument("--update-seconds", type=float, default=1.0, help="Seconds of EEG between two updates")
+    parser.add_argument("--epoch-start", type=float, default=0.0, help="Start of the epochs in seconds")
+    parser.add_argument("--epoch-end", type=float, default=1.0, help="End of the epochs in seconds")
+    parser.add_argument("--channel", type=int, default=0, help="Channel used for the classification")
+    parser.add_argument("--drift-correction", action="store_true", help="Map markers with a smoothed EEG clock")
+    parser.add_argument("--classifier", choices=["channel", "spatial"], default="channel", help="Classifier to use")
+    parser.add_argument("--dynamic-stopping", type=float, help="Select a class as soon as it reaches this posterior")
+    parser.add_argument("--verbose", action="store_true", help="Print the classification after every update")
+    args = parser.parse_args()
+
+    settings = {
+        "epoch start": args.epoch_start,
+        "epoch end": args.epoch_end,
+        "drift correction": args.drift_correction,
+        "channel select": args.channel,
+        "classifier": args.classifier,
+        "dynamic stopping": args.dynamic_stopping,
+    }
+    for session in args.sessions:
+        replayer = Replayer(session, args.samplerate, args.speed, update_seconds=args.update_seconds, settings=settings)
+        start = time.perf_counter()
+        _, classification = replayer.run()
+        duration = time.perf_counter() - start
+
+        if args.verbose:
+            for recording_time, update_classification in replayer.classifications:
+                print("{}: {:.1f}s classification {}".format(session, recording_time, update_classification))
+        print(
+            "{}: final classification {} ({:.1f}s of EEG replayed in {:.2f}s)".format(
+                session, classification, len(replayer.eeg) / replayer.samplerate, duration
+            )
+        )
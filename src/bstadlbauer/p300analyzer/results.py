@@ -0,0 +1,48 @@
+import json
+import socket
+import time
+from typing import Optional
+
+
+class ResultWriter(object):
+    """Writes the results of every analysis update as one JSON object per line to a file or a local socket
+
+    Every line holds "time" (seconds since the epoch), "classification" (class counting from one or null),
+    "averages" (averaged trials of the selected channel, one list per class) and "channel ranking" (channel indices
+    from the best to the worst separation of the classes, null until enough trials were classified). If a session is
+    given, lines also hold "session", so results of several sessions can be told apart.
+
+    Args:
+        target: Path of the file the results are appended to or "tcp://host:port" of a listening socket the results
+            are sent to
+        session: Name of the session the results belong to. Optional, defaults to None
+
+    """
+
+    def __init__(self, target: str, session: Optional[str] = None):
+        self.target = target
+        self.session = session
+        self.socket = None
+        self.file = None
+
+        if target.startswith("tcp://"):
+            host, port = target[len("tcp://") :].rsplit(":", 1)
+            self.socket = socket.create_connection((host, int(port)))
+        else:
+            self.file = open(target, "a")
+
+    def write(self, avg_trials, classification, channel_ranking=None):
+        result = {
+            "time": time.time(),
+            "classification": classification,
+            "averages": avg_trials.tolist(),
+            "channel ranking": None if channel_ranking is None else [int(channel) for channel in channel_ranking],
+        }
+        if self.session is not None:
+            result["session"] = self.session
+        line = json.dumps(result)
+        if self.socket is not None:
+            self.socket.sendall((line + "\n").encode())
+        else:
+            self.file.write(line + "\n")
+            self.file.flush()
@@ -0,0 +1,144 @@
+from threading import Lock
+from typing import Optional
+
+import numpy as np
+
+
+class RingBuffer(object):
+    """Preallocated, growable NumPy buffer with an optional retention window
+
+    Samples are addressed by their absolute index, i.e. the number of samples appended before them. Storage starts
+    small and doubles when full (O(1) amortized append). If max_length is given, only the newest max_length samples
+    are retained: once the storage is full, the retained samples are copied into a fresh array, so memory stays
+    bounded while views handed out earlier stay valid and unchanged.
+
+    All views returned are read-only and never copy, as retained samples are always stored contiguously.
+
+    Args:
+        num_columns: Number of values per sample (e.g. number of channels). If None, each sample is a scalar and the
+            buffer is one-dimensional. Optional, defaults to None.
+        dtype: NumPy dtype of the stored samples. Optional, defaults to numpy.float64
+        initial_capacity: Number of samples preallocated on creation. Optional, defaults to 1024
+        max_length: Maximum number of samples retained. If None, all samples are retained. Optional, defaults to None
+
+    """
+
+    def __init__(
+        self,
+        num_columns: Optional[int] = None,
+        dtype=np.float64,
+        initial_capacity: int = 1024,
+        max_length: Optional[int] = None,
+    ):
+        self.num_columns = num_columns
+        self.dtype = np.dtype(dtype)
+        self.max_length = max_length
+
+        if max_length is not None:
+            initial_capacity = min(initial_capacity, 2 * max_length)
+        self.storage = self._allocate(max(initial_capacity, 1))
+
+        # Absolute index of the first sample in self.storage and total number of samples appended
+        self.offset = 0
+        self.total = 0
+        self.lock = Lock()
+
+    def _allocate(self, capacity):
+        if self.num_columns is None:
+            return np.empty(capacity, dtype=self.dtype)
+        return np.empty([capacity, self.num_columns], dtype=self.dtype)
+
+    def __len__(self):
+        return self.total - self.first_index
+
+    @property
+    def first_index(self):
+        """Absolute index of the oldest retained sample"""
+        if self.max_length is None:
+            return self.offset
+        return max(self.offset, self.total - self.max_length)
+
+    def _reserve(self, num_samples):
+        """Makes sure num_samples more samples fit into self.storage, moving to a new array if needed"""
+        used = self.total - self.offset
+        capacity = len(self.storage)
+        if used + num_samples <= capacity:
+            return
+
+        first = self.first_index
+        keep = self.total - first
+        if self.max_length is None:
+            new_capacity = max(2 * capacity, keep + num_samples)
+        else:
+            # Grow up to twice the retention window, so copying happens at most once every max_length samples
+            new_capacity = max(min(2 * capacity, 2 * self.max_length), keep + num_samples)
+
+        new_storage = self._allocate(new_capacity)
+        new_storage[:keep] = self.storage[first - self.offset : used]
+        self.storage = new_storage
+        self.offset = first
+
+    def append(self, sample):
+        """Appends a single sample"""
+        with self.lock:
+            self._reserve(1)
+            self.storage[self.total - self.offset] = sample
+            self.total += 1
+
+    def extend(self, samples):
+        """Appends a block of samples, the first axis of samples has to be the sample axis"""
+        samples = np.asarray(samples, dtype=self.dtype)
+        num_samples = len(samples)
+        if num_samples == 0:
+            return
+
+        with self.lock:
+            if self.max_length is not None and num_samples > self.max_length:
+                # Older samples in this block would be discarded right away, so they are never stored
+                self.offset = self.total = self.total + num_samples - self.max_length
+                samples = samples[-self.max_length :]
+                num_samples = self.max_length
+                self.storage = self._allocate(2 * self.max_length)
+            self._reserve(num_samples)
+            start = self.total - self.offset
+            self.storage[start : start + num_samples] = samples
+            self.total += num_samples
+
+    def view(self, start: Optional[int] = None, stop: Optional[int] = None):
+        """Returns a read-only view of the samples with absolute indices in [start, stop)
+
+        Indices before the retention window or after the newest sample are clipped.
+
+        Args:
+            start: Absolute index of the first sample. Optional, defaults to the oldest retained sample
+            stop: Absolute index after the last sample. Optional, defaults to the number of samples appended
+
+        """
+        with self.lock:
+            first = self.first_index
+            total = self.total
+            storage = self.storage
+            offset = self.offset
+
+        start = first if start is None else min(max(start, first), total)
+        stop = total if stop is None else min(max(stop, start), total)
+
+        result = storage[start - offset : stop - offset]
+        result.flags.writeable = False
+        return result
+
+    def searchsorted(self, values, side: str = "left"):
+        """Like numpy.searchsorted over the retained samples of a sorted one-dimensional buffer
+
+        Returns absolute indices which can directly be passed to self.view() of this or a parallel buffer.
+
+        """
+        with self.lock:
+            first = self.first_index
+            retained = self.storage[first - self.offset : self.total - self.offset]
+        return np.searchsorted(retained, values, side) + first
+
+    def last(self, num_samples: int):
+        """Returns a read-only view of the newest num_samples samples"""
+        total = self.total
+        return self.view(total - num_samples, total)
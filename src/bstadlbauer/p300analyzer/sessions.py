@@ -0,0 +1,285 @@
+import multiprocessing as mp
+import os
+from collections import OrderedDict
+from functools import partial
+from threading import Condition, Thread
+from typing import Dict, List, Optional
+
+from pylsl import StreamInlet, resolve_stream
+
+from bstadlbauer.p300analyzer.analysis_process import AnalysisProcess
+from bstadlbauer.p300analyzer.analysis_thread import (
+    SETTINGS_POLL_INTERVAL,
+    AnalysisThread,
+)
+from bstadlbauer.p300analyzer.data import RecordedData
+from bstadlbauer.p300analyzer.epoching import get_epoch_samples
+from bstadlbauer.p300analyzer.latency import LatencyProbes
+from bstadlbauer.p300analyzer.lsl_receiver_thread import LSLReceiverThread
+from bstadlbauer.p300analyzer.results import ResultWriter
+from bstadlbauer.p300analyzer.shared_buffers import (
+    LatestValueBuffer,
+    SharedRingBuffer,
+    SharedState,
+)
+
+
+class Session(object):
+    """EEG and marker stream of one participant together with the recorded data and its analysis
+
+    self.connect() resolves the streams named connect_dict["eeg streamname"] and connect_dict["marker streamname"],
+    writes their metadata into connect_dict and creates the analyzer.data.RecordedData, the receiver threads and the
+    analysis (an analyzer.analysis_thread.AnalysisThread or, with connect_dict["analysis backend"] set to "process",
+    an analyzer.analysis_process.AnalysisProcess). All state of the session belongs to it alone, so several sessions
+    can run side by side in one process (see "sessions" in analyzer.connect.ConnectorProc).
+
+    Args:
+        connect_dict: Configuration of the session with the entries of the connector dict of
+            analyzer.connect.ConnectorProc
+        shared_state: Settings and counters of the session read in hot loops
+        message_q: Messages of the session are put into this queue
+        output: If given, results are written to this target (see analyzer.results.ResultWriter). Optional, defaults
+            to None
+        latency_probes: If given, latencies of receiving and analyzing are probed. Optional, defaults to None
+        name: If given, messages are prefixed with the name, results are tagged with it and recordings streamed to
+            disk are named after it. Optional, defaults to ""
+
+    """
+
+    def __init__(
+        self,
+        connect_dict: Dict,
+        shared_state: SharedState,
+        message_q: mp.Queue,
+        output: Optional[str] = None,
+        latency_probes: Optional[LatencyProbes] = None,
+        name: str = "",
+    ):
+        self.connect_dict = connect_dict
+        self.shared_state = shared_state
+        self.message_q = message_q
+        self.output = output
+        self.latency_probes = latency_probes
+        self.name = name
+
+        self.eeg_inlet = None
+        self.marker_inlet = None
+        self.recorded_data = None
+        self.lsl_rec_threads = []
+        self.analysis = None
+        self.plot_buffer = None
+        self.axis_queue = None
+
+    def print_to_console(self, message):
+        self.message_q.put(self.get_message_prefix() + message)
+
+    def get_message_prefix(self):
+        return "[{}] ".format(self.name) if self.name else ""
+
+    def create_inlet(self, name):
+        streams = resolve_stream("name", str(name))
+        inlet = StreamInlet(streams[0])
+
+        if len(streams) != 1:
+            self.print_to_console("ATTENTION: More streams with name: '" + name + "' found, using the first one")
+
+        return inlet
+
+    def update_lsl_metadata(self):
+        info_eeg = self.eeg_inlet.info()
+        self.connect_dict["number of channels"] = info_eeg.channel_count()
+        self.connect_dict["stream samplerate"] = info_eeg.nominal_srate()
+        self.connect_dict["samplerate"] = info_eeg.nominal_srate() / self.connect_dict["decimation"]
+
+        info_marker = self.marker_inlet.info()
+        self.connect_dict["num rows"] = int(info_marker.desc().child_value("num_rows"))
+        self.connect_dict["num cols"] = int(info_marker.desc().child_value("num_cols"))
+        self.connect_dict["flash mode"] = info_marker.desc().child_value("flash_mode")
+
+    def connect(self):
+        """Resolves the streams and creates the recorded data, the receiver threads and the analysis"""
+        self.eeg_inlet = self.create_inlet(self.connect_dict["eeg streamname"])
+        self.marker_inlet = self.create_inlet(self.connect_dict["marker streamname"])
+        self.update_lsl_metadata()
+
+        samplerate = self.connect_dict["stream samplerate"]
+        number_of_channels = self.connect_dict["number of channels"]
+        self.print_to_console(
+            "Connected! There are {} channels with a samplerate of {}Hz".format(number_of_channels, samplerate)
+        )
+
+        self.recorded_data = RecordedData(
+            self.connect_dict["filter"],
+            self.connect_dict["retention seconds"],
+            self.connect_dict["notch freqs"],
+            self.connect_dict["reference"],
+            self.connect_dict["decimation"],
+            self.connect_dict["archive raw"],
+        )
+        self.recorded_data.set_samplerate(samplerate)
+        self.recorded_data.set_num_channel(number_of_channels)
+
+        eeg_thread = LSLReceiverThread(
+            self.eeg_inlet,
+            self.recorded_data.append_eeg_sample,
+            self.recorded_data.append_eeg_ts,
+            self.shared_state,
+            block_func=self.recorded_data.append_eeg_block,
+            max_chunk_size=self.connect_dict["max chunk size"],
+            chunk_timeout=self.connect_dict["chunk timeout"],
+            latency_probes=self.latency_probes,
+        )
+        marker_thread = LSLReceiverThread(
+            self.marker_inlet,
+            self.recorded_data.append_marker_sample,
+            self.recorded_data.append_marker_ts,
+            block_func=self.recorded_data.append_marker_block,
+            max_chunk_size=self.connect_dict["max chunk size"],
+            chunk_timeout=self.connect_dict["chunk timeout"],
+        )
+
+        self.lsl_rec_threads.append(eeg_thread)
+        self.lsl_rec_threads.append(marker_thread)
+
+        num_pre, num_post = get_epoch_samples(
+            self.connect_dict["samplerate"], self.connect_dict["epoch start"], self.connect_dict["epoch end"]
+        )
+        self.plot_buffer = LatestValueBuffer(
+            (self.connect_dict["num rows"] * self.connect_dict["num cols"], num_pre + num_post)
+        )
+        self.axis_queue = mp.Queue()
+        if self.connect_dict["analysis backend"] == "process":
+            self.analysis = self.create_analysis_process()
+        else:
+            self.analysis = AnalysisThread(
+                self.recorded_data,
+                self.connect_dict,
+                self.message_q,
+                self.plot_buffer,
+                self.axis_queue,
+                self.shared_state,
+                None if self.output is None else ResultWriter(self.output, self.name or None),
+                self.latency_probes,
+                self.get_message_prefix(),
+            )
+
+    def create_analysis_process(self):
+        """Shares the recorded data with a new analyzer.analysis_process.AnalysisProcess"""
+        retention_seconds = self.connect_dict["retention seconds"] or AnalysisProcess.default_retention_seconds
+        # Twice the retention, so the analysis process can lag behind without losing rows
+        capacity = int(2 * retention_seconds * self.connect_dict["samplerate"])
+        shared_eeg = SharedRingBuffer(self.connect_dict["number of channels"] + 1, capacity)
+        shared_markers = SharedRingBuffer(2, capacity)
+        self.recorded_data.share(shared_eeg, shared_markers)
+
+        return AnalysisProcess(
+            shared_eeg,
+            shared_markers,
+            self.connect_dict,
+            self.message_q,
+            self.plot_buffer,
+            self.axis_queue,
+            self.shared_state,
+            self.output,
+            retention_seconds,
+        )
+
+    def start_recording(self, daemon: bool = False):
+        """Starts streaming to disk (if enabled) and receiving, daemon receivers do not keep the process alive"""
+        if self.connect_dict["stream to disk"]:
+            self.recorded_data.start_writer(sync_interval=self.connect_dict["sync interval"], name=self.name or None)
+        for thread in self.lsl_rec_threads:
+            thread.daemon = daemon
+            thread.start()
+
+    def save(self):
+        self.recorded_data.save(self.connect_dict["savefile"])
+
+    def stop(self):
+        """Saves the recording as connect_dict["savefile"] (if given) and finalizes the files streamed to disk"""
+        if isinstance(self.connect_dict["savefile"], str):
+            self.save()
+        self.recorded_data.stop_writer()
+
+
+class AnalysisPool(object):
+    """Worker threads sharing the analyses of several sessions
+
+    The workers update the analyses (analyzer.analysis_thread.AnalysisThread instances, which are not started as
+    threads themselves) without blocking (AnalysisThread.poll()). Updates are event driven: an analysis is scheduled
+    whenever its data store signals new samples or markers (analyzer.data.RecordedData.add_listener()), and idle
+    workers wait on one shared condition. As changed settings and the end of the "update interval" are not signaled,
+    all analyses are also scheduled after SETTINGS_POLL_INTERVAL seconds without new data, as in
+    AnalysisThread.wait_for_trial().
+
+    Each analysis is polled by one worker at a time, so the state of a session is never accessed concurrently, while
+    the number of threads does not grow with the number of sessions. The heavy NumPy operations release the GIL, so
+    updates of different sessions run in parallel. An analysis that raises an exception is dropped without affecting
+    the others.
+
+    Args:
+        analyses: Analyses of the sessions
+        num_workers: Number of worker threads. Optional, defaults to the number of analyses, but at most the number
+            of CPUs
+
+    """
+
+    def __init__(self, analyses: List[AnalysisThread], num_workers: Optional[int] = None):
+        self.num_workers = num_workers or min(len(analyses), os.cpu_count() or 1)
+        self.analyses = analyses
+
+        self.condition = Condition()
+        # Analyses waiting for a worker (keys, in order) and analyses being polled, with True if new data arrived
+        # meanwhile
+        self.scheduled = OrderedDict()
+        self.polling = {}
+        self.dropped = set()
+        for analysis in analyses:
+            analysis.data.add_listener(partial(self.schedule, analysis))
+        self.workers = []
+
+    def start(self):
+        with self.condition:
+            self.schedule_all()
+        for _ in range(self.num_workers):
+            worker = Thread(target=self.work, daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def schedule(self, analysis: AnalysisThread):
+        with self.condition:
+            if analysis in self.polling:
+                self.polling[analysis] = True
+            elif analysis not in self.scheduled and analysis not in self.dropped:
+                self.scheduled[analysis] = None
+                self.condition.notify()
+
+    def schedule_all(self):
+        """Schedules all analyses that are neither scheduled nor polled, self.condition has to be held"""
+        for analysis in self.analyses:
+            if analysis not in self.polling and analysis not in self.scheduled and analysis not in self.dropped:
+                self.scheduled[analysis] = None
+        self.condition.notify_all()
+
+    def work(self):
+        while True:
+            with self.condition:
+                while not self.scheduled:
+                    if not self.condition.wait(SETTINGS_POLL_INTERVAL):
+                        self.schedule_all()
+                analysis, _ = self.scheduled.popitem(last=False)
+                self.polling[analysis] = False
+
+            try:
+                analysis.poll()
+            except Exception as error:
+                analysis.print_to_console("Analysis stopped: {!r}".format(error))
+                with self.condition:
+                    self.dropped.add(analysis)
+                    del self.polling[analysis]
+                continue
+
+            with self.condition:
+                if self.polling.pop(analysis):
+                    self.scheduled[analysis] = None
+                    self.condition.notify()
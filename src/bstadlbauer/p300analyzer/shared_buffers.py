@@ -0,0 +1,289 @@
+"""Lock-free shared memory structures to exchange data between threads and processes without pickling
+
+Everything is backed by multiprocessing.RawArray (shared memory that works with python>=3.6 and all start methods),
+instances can be passed to multiprocessing.Process on creation. NumPy views into the shared memory are created lazily
+in every process.
+
+"""
+import ctypes
+import multiprocessing as mp
+from typing import Optional, Tuple
+
+import numpy as np
+
+
+class LatestValueBuffer(object):
+    """Shared memory slot that always holds the most recently written array (single writer, single reader)
+
+    Writes are protected by a sequence counter (seqlock): the writer increments it before and after writing, so it is
+    odd while a write is in progress. The reader retries if the counter was odd or changed while copying. Unread values
+    are overwritten, so the reader never falls behind; the number of values overwritten before they were read is
+    counted in self.dropped_frames.
+
+    Every value can carry a timestamp (e.g. the LSL timestamp of the newest sample it was computed from), the
+    timestamp of the value returned last by self.read() is available in self.last_timestamp.
+
+    Args:
+        shape: Maximum shape of the arrays written. Arrays with fewer rows may be written as well.
+
+    """
+
+    def __init__(self, shape: Tuple[int, ...]):
+        self.shape = tuple(int(size) for size in shape)
+        # [sequence counter, number of valid rows]
+        self.raw_header = mp.RawArray(ctypes.c_int64, 2)
+        self.raw_data = mp.RawArray(ctypes.c_double, int(np.prod(self.shape)))
+        self.raw_timestamp = mp.RawArray(ctypes.c_double, 1)
+
+        self._header = None
+        self._data = None
+
+        # Reader side, local to the reading process
+        self.last_sequence = 0
+        self.dropped_frames = 0
+        self.last_timestamp = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_header"] = None
+        state["_data"] = None
+        return state
+
+    @property
+    def header(self):
+        if self._header is None:
+            self._header = np.frombuffer(self.raw_header, dtype=np.int64)
+        return self._header
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = np.frombuffer(self.raw_data, dtype=np.float64).reshape(self.shape)
+        return self._data
+
+    @property
+    def frames_written(self):
+        return int(self.header[0]) // 2
+
+    def write(self, array, timestamp: Optional[float] = None):
+        """Makes array the latest value, rows exceeding self.shape[0] are discarded"""
+        array = np.asarray(array, dtype=np.float64)
+        num_rows = min(len(array), self.shape[0])
+
+        header = self.header
+        header[0] += 1
+        self.data[:num_rows] = array[:num_rows]
+        header[1] = num_rows
+        self.raw_timestamp[0] = np.nan if timestamp is None else timestamp
+        header[0] += 1
+
+    def read(self):
+        """Returns a copy of the latest value or None if there is nothing new since the last call"""
+        header = self.header
+        while True:
+            sequence = int(header[0])
+            if sequence == self.last_sequence:
+                return None
+            if sequence % 2 == 1:
+                continue
+
+            num_rows = int(header[1])
+            value = self.data[:num_rows].copy()
+            timestamp = self.raw_timestamp[0]
+            if int(header[0]) == sequence:
+                break
+
+        self.dropped_frames += (sequence - self.last_sequence) // 2 - 1
+        self.last_sequence = sequence
+        self.last_timestamp = None if np.isnan(timestamp) else timestamp
+        return value
+
+
+class SharedRingBuffer(object):
+    """Shared memory ring buffer of float64 rows with a single writer and any number of readers in other processes
+
+    Before overwriting any slots, the writer publishes the number of rows it is writing up to, after writing it
+    publishes the new total number of rows written. Readers keep track of the rows they have read and copy only the
+    new ones. Rows whose slots may have been overwritten while they were copied (the reader lagged about capacity rows
+    behind) are dropped and counted in self.dropped_rows.
+
+    Args:
+        num_columns: Number of values per row
+        capacity: Number of rows kept
+
+    """
+
+    def __init__(self, num_columns: int, capacity: int):
+        self.num_columns = int(num_columns)
+        self.capacity = int(capacity)
+        # [total number of rows written, total number of rows once the write in progress is done]
+        self.raw_header = mp.RawArray(ctypes.c_int64, 2)
+        self.raw_data = mp.RawArray(ctypes.c_double, self.capacity * self.num_columns)
+
+        self._header = None
+        self._data = None
+
+        # Reader side, local to the reading process
+        self.dropped_rows = 0
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_header"] = None
+        state["_data"] = None
+        return state
+
+    @property
+    def header(self):
+        if self._header is None:
+            self._header = np.frombuffer(self.raw_header, dtype=np.int64)
+        return self._header
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = np.frombuffer(self.raw_data, dtype=np.float64).reshape(self.capacity, self.num_columns)
+        return self._data
+
+    @property
+    def total(self):
+        """Number of rows written so far"""
+        return int(self.header[0])
+
+    def extend(self, rows):
+        """Appends rows of shape (num_rows, num_columns), only the last capacity rows are kept if there are more"""
+        rows = np.asarray(rows, dtype=np.float64)
+        total = self.total
+        if len(rows) > self.capacity:
+            total += len(rows) - self.capacity
+            rows = rows[-self.capacity :]
+        header = self.header
+        header[1] = total + len(rows)
+        self.data[(total + np.arange(len(rows))) % self.capacity] = rows
+        header[0] = total + len(rows)
+
+    def read(self, start: int):
+        """Returns (rows, stop) with a copy of the rows from absolute index start on and the index after the last row"""
+        stop = self.total
+        first = max(start, stop - self.capacity)
+        rows = self.data[np.arange(first, stop) % self.capacity]
+
+        # Rows could have been overwritten while copying, rows up to writing_up_to - capacity share their slots with
+        # rows that were (or are being) written since
+        writing_up_to = int(self.header[1])
+        first_valid = min(writing_up_to - self.capacity, stop)
+        if first_valid > first:
+            rows = rows[first_valid - first :]
+            first = first_valid
+        self.dropped_rows += first - start
+        return rows, stop
+
+
+class SharedState(object):
+    """Typed shared memory block for state that is written or read in hot loops
+
+    Replaces round trips to the multiprocessing.Manager().dict() server process for the entries in self.fields.
+    Counters (like "sample count") have a single writer and are read and written directly. Settings are written as a
+    whole with self.update(), which increments a version counter twice (seqlock), so readers can cheaply check
+    self.version to detect changes and get consistent snapshots from self.get_settings().
+
+    Entries are accessed like in a dict, e.g. state["sample count"] or state["y lim"].
+
+    """
+
+    # name: (number of values, type, is setting)
+    fields = {
+        "sample count": (1, int, False),
+        "channel select": (1, int, True),
+        "y lim": (2, float, True),
+        "update interval": (1, float, True),
+        "squared": (1, int, True),
+    }
+
+    def __init__(self):
+        self.offsets = {}
+        offset = 0
+        for name, (length, _, _) in self.fields.items():
+            self.offsets[name] = offset
+            offset += length
+
+        self.raw_version = mp.RawArray(ctypes.c_int64, 1)
+        self.raw_values = mp.RawArray(ctypes.c_double, offset)
+
+        self._version = None
+        self._values = None
+
+        # Reader side, local to the reading process
+        self.cached_version = -1
+        self.cached_settings = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_version"] = None
+        state["_values"] = None
+        return state
+
+    @property
+    def version_array(self):
+        if self._version is None:
+            self._version = np.frombuffer(self.raw_version, dtype=np.int64)
+        return self._version
+
+    @property
+    def values(self):
+        if self._values is None:
+            self._values = np.frombuffer(self.raw_values, dtype=np.float64)
+        return self._values
+
+    @property
+    def version(self):
+        """Number of completed settings updates"""
+        return int(self.version_array[0]) // 2
+
+    def _get(self, name):
+        length, value_type, _ = self.fields[name]
+        offset = self.offsets[name]
+        if length == 1:
+            return value_type(self.values[offset])
+        return [value_type(value) for value in self.values[offset : offset + length]]
+
+    def _set(self, name, value):
+        length = self.fields[name][0]
+        offset = self.offsets[name]
+        self.values[offset : offset + length] = value
+
+    def __getitem__(self, name):
+        if self.fields[name][2]:
+            return self.get_settings()[name]
+        return self._get(name)
+
+    def __setitem__(self, name, value):
+        if self.fields[name][2]:
+            self.update({name: value})
+        else:
+            self._set(name, value)
+
+    def update(self, settings):
+        """Writes all entries of the dict settings as one versioned update"""
+        version_array = self.version_array
+        version_array[0] += 1
+        for name, value in settings.items():
+            self._set(name, value)
+        version_array[0] += 1
+
+    def get_settings(self):
+        """Returns a consistent snapshot of all settings as dict, only re-read if the version changed"""
+        version_array = self.version_array
+        while True:
+            version = int(version_array[0])
+            if version == self.cached_version:
+                return self.cached_settings
+            if version % 2 == 1:
+                continue
+
+            settings = {name: self._get(name) for name, (_, _, is_setting) in self.fields.items() if is_setting}
+            if int(version_array[0]) == version:
+                break
+
+        self.cached_version = version
+        self.cached_settings = settings
+        return settings
@@ -0,0 +1,58 @@
+import numpy as np
+from scipy import linalg
+
+
+def decimate(trials, factor: int):
+    """Averages blocks of factor consecutive samples of trials with shape (..., num_samples, num_channels)"""
+    trials = np.asarray(trials)
+    num_blocks = trials.shape[-2] // factor
+    blocks = trials[..., : num_blocks * factor, :].reshape(trials.shape[:-2] + (num_blocks, factor, trials.shape[-1]))
+    return np.mean(blocks, axis=-2)
+
+
+class SpatialFilter(object):
+    """Spatial filters that maximize the differences between the class averages relative to the noise (xDAWN-like)
+
+    The noise covariance between channels is estimated from single trials (features of shape (num_samples,
+    num_channels), e.g. decimated with decimate()). Every trial updates it with a rank-num_samples update with
+    exponential forgetting, so adding a trial costs O(num_samples * num_channels^2) and the estimate follows slow
+    changes. self.fit() solves the generalized eigenvalue problem of the scatter between the class averages and the
+    shrunk noise covariance, which costs O(num_channels^3) and is cheap enough to be done in every update.
+
+    Args:
+        num_channels: Number of EEG channels
+        num_filters: Number of filters (virtual channels) returned by self.fit(). Optional, defaults to 1
+        shrinkage: Weight of the scaled identity the noise covariance is shrunk towards, between 0 and 1. Optional,
+            defaults to 0.1
+        memory: Number of trials after which the weight of a trial in the noise covariance dropped to 1/e. Optional,
+            defaults to 1000
+
+    """
+
+    def __init__(self, num_channels: int, num_filters: int = 1, shrinkage: float = 0.1, memory: float = 1000):
+        self.num_filters = num_filters
+        self.shrinkage = shrinkage
+        self.decay = np.exp(-1.0 / memory)
+
+        self.scatter = np.zeros([num_channels, num_channels])
+        self.num_samples = 0.0
+
+    def add_trial(self, features):
+        """Updates the noise covariance with the features of one trial, shape (num_samples, num_channels)"""
+        self.scatter = self.decay * self.scatter + features.T @ features
+        self.num_samples = self.decay * self.num_samples + len(features)
+
+    def get_noise_covariance(self):
+        covariance = self.scatter / self.num_samples
+        identity_scale = np.trace(covariance) / len(covariance)
+        return (1 - self.shrinkage) * covariance + self.shrinkage * identity_scale * np.eye(len(covariance))
+
+    def fit(self, class_averages):
+        """Returns the filters of shape (num_channels, num_filters) for class averages of shape (num_classes,
+        num_samples, num_channels), best filter first"""
+        deviations = class_averages - np.mean(class_averages, axis=0)
+        deviations = deviations.reshape(-1, deviations.shape[-1])
+        between_scatter = deviations.T @ deviations
+
+        _, eigenvectors = linalg.eigh(between_scatter, self.get_noise_covariance())
+        return eigenvectors[:, ::-1][:, : self.num_filters]
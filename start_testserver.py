@@ -1,8 +1,39 @@
+import argparse
 from multiprocessing import freeze_support
 
 from testserver.bcni_data_server import BCNIDataServer
+from testserver.fleet import ServerFleet
+from testserver.synthetic import SyntheticData
 
 if __name__ == "__main__":
     freeze_support()
-    server = BCNIDataServer(1)
-    server.start()
+    parser = argparse.ArgumentParser(description="Streams a BNCI Horizon recording as LSL EEG and marker streams")
+    parser.add_argument("--subject", type=int, nargs="+", default=[1], help="BNCI Horizon subjects to stream")
+    parser.add_argument("--samplerate", type=float, help="Samplerate of the stream, defaults to the recording's")
+    parser.add_argument("--channels", type=int, help="Number of channels, defaults to the recording's")
+    parser.add_argument("--chunk-size", type=int, default=1, help="Samples pushed at once")
+    parser.add_argument("--synthetic", action="store_true", help="Stream synthetic data instead of a recording")
+    parser.add_argument("--snr", type=float, default=0.5, help="P300 amplitude relative to the noise in synthetic data")
+    parser.add_argument("--servers", type=int, default=1, help="Number of servers, each with its own streams")
+    parser.add_argument("--max-lag", type=float, help="Drop samples that are more than this many seconds overdue")
+    args = parser.parse_args()
+
+    if args.servers > 1:
+        fleet = ServerFleet(
+            args.servers,
+            args.subject,
+            args.samplerate,
+            args.channels,
+            args.chunk_size,
+            args.max_lag,
+            args.snr if args.synthetic else None,
+        )
+        fleet.run()
+    else:
+        data = None
+        if args.synthetic:
+            data = SyntheticData(args.channels or 8, args.samplerate or 256, snr=args.snr)
+        server = BCNIDataServer(
+            args.subject[0], args.samplerate, args.channels, args.chunk_size, data=data, max_lag=args.max_lag
+        )
+        server.start()
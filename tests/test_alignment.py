@@ -0,0 +1,88 @@
+import unittest
+
+import numpy as np
+
+from bstadlbauer.p300analyzer.alignment import AlignmentIndex, nearest_indices
+from bstadlbauer.p300analyzer.data import RecordedData
+
+SAMPLERATE = 100
+
+
+class AlignmentIndexTest(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.eeg_ts = 5.0 + np.arange(3000) / SAMPLERATE + rng.uniform(-0.002, 0.002, 3000)
+        # Markers between samples (never exactly halfway), some of them sent before their sample is received
+        self.marker_ind = np.sort(rng.choice(np.arange(1, 2990), 200, replace=False))
+        self.marker_ts = self.eeg_ts[self.marker_ind] + rng.uniform(-0.003, 0.003, 200)
+        self.markers = rng.randint(1, 13, 200)
+
+    def create_data(self, retention_seconds=None):
+        data = RecordedData(False, retention_seconds)
+        data.set_samplerate(SAMPLERATE)
+        data.set_num_channel(2)
+        return data
+
+    def expected_indices(self, marker_ts):
+        return np.array([np.argmin(np.abs(self.eeg_ts - timestamp)) for timestamp in marker_ts])
+
+    def stream(self, alignment, data, block_size=10, marker_lead=0.05):
+        """Appends EEG in blocks and every marker marker_lead seconds before the EEG sample it belongs to, updating
+        the alignment after every block"""
+        num_markers = 0
+        for start in range(0, len(self.eeg_ts), block_size):
+            eeg_ts = self.eeg_ts[start : start + block_size]
+            data.append_eeg_block(np.zeros((len(eeg_ts), 2)), eeg_ts, preprocessed=True)
+            new_num_markers = int(np.searchsorted(self.marker_ts, eeg_ts[-1] + marker_lead))
+            if new_num_markers > num_markers:
+                data.append_marker_block(
+                    self.markers[num_markers:new_num_markers, np.newaxis], self.marker_ts[num_markers:new_num_markers]
+                )
+                num_markers = new_num_markers
+            alignment.update()
+        return alignment.mapped.view(0)
+
+    def test_nearest_samples(self):
+        data = self.create_data()
+        mapped = self.stream(AlignmentIndex(data), data)
+        np.testing.assert_array_equal(mapped[:, 0], self.markers)
+        np.testing.assert_array_equal(mapped[:, 1], self.expected_indices(self.marker_ts))
+
+    def test_nearest_samples_with_retention(self):
+        # Only 2 s of EEG are kept, mapping must still yield absolute sample indices
+        data = self.create_data(retention_seconds=2)
+        mapped = self.stream(AlignmentIndex(data), data)
+        self.assertLess(len(data.get_eeg_ts_range(0, data.get_num_eeg_samples())), len(self.eeg_ts))
+        np.testing.assert_array_equal(mapped[:, 0], self.markers)
+        np.testing.assert_array_equal(mapped[:, 1], self.expected_indices(self.marker_ts))
+
+    def test_markers_before_retention_are_dropped(self):
+        data = self.create_data(retention_seconds=2)
+        alignment = AlignmentIndex(data)
+        data.append_eeg_block(np.zeros((500, 2)), self.eeg_ts[:500], preprocessed=True)
+        # The first marker belongs to a sample that is not retained anymore
+        marker_ts = self.eeg_ts[[10, 450]]
+        data.append_marker_block(np.array([[1], [2]]), marker_ts)
+
+        self.assertEqual(alignment.update(), 1)
+        np.testing.assert_array_equal(alignment.mapped.view(0), [[2, 450]])
+
+    def test_drift_correction_with_retention(self):
+        # Without jitter, the smoothed clock maps to the same samples as the nearest timestamps
+        self.eeg_ts = 5.0 + np.arange(3000) / SAMPLERATE
+        self.marker_ts = self.eeg_ts[self.marker_ind] + 0.002
+        data = self.create_data(retention_seconds=2)
+        mapped = self.stream(AlignmentIndex(data, drift_correction=True, drift_window=5), data)
+        np.testing.assert_array_equal(mapped[:, 1], self.marker_ind)
+
+
+class NearestIndicesTest(unittest.TestCase):
+    def test_nearest_indices(self):
+        timestamps = np.array([0.0, 1.0, 2.0, 4.0])
+        values = np.array([-1.0, 0.4, 0.6, 2.9, 3.1, 10.0])
+        np.testing.assert_array_equal(nearest_indices(timestamps, values), [0, 0, 1, 2, 3, 3])
+        np.testing.assert_array_equal(nearest_indices(timestamps[:1], values), np.zeros(6))
+
+
+if __name__ == "__main__":
+    unittest.main()
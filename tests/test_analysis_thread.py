@@ -0,0 +1,69 @@
+import json
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from bstadlbauer.p300analyzer.analysis_thread import (
+    fisher_criterion,
+    fisher_scores,
+    rank_channels,
+)
+from bstadlbauer.p300analyzer.results import ResultWriter
+
+
+class FisherScoresTest(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        # Trials of shape (num_samples, num_channels) per class, with different numbers of trials per class
+        self.trials = [rng.normal(mean, 1 + mean, (num_trials, 30, 4)) for mean, num_trials in [(0, 6), (2, 8), (1, 7)]]
+
+    def baseline_scores(self, channel):
+        """Scores as computed by classify_trials before the scores were vectorized"""
+        fields = [trials[:, :, channel].T for trials in self.trials]
+        scores = []
+        for field_nr, field in enumerate(fields):
+            non_target_data = np.hstack([other for other_nr, other in enumerate(fields) if other_nr != field_nr])
+            scores.append(fisher_criterion(field, non_target_data))
+        return scores
+
+    def test_matches_fisher_criterion(self):
+        counts = [len(trials) for trials in self.trials]
+        sums = np.array([np.sum(trials, axis=0) for trials in self.trials])
+        squares = np.array([np.sum(trials ** 2, axis=0) for trials in self.trials])
+        scores = fisher_scores(counts, sums, squares)
+
+        self.assertEqual(scores.shape, (3, 4))
+        for channel in range(4):
+            np.testing.assert_allclose(scores[:, channel], self.baseline_scores(channel))
+
+
+class RankChannelsTest(unittest.TestCase):
+    def test_rank_channels(self):
+        # Ratios of best to second best score: 1.25, 10, 1, 3
+        scores = np.array([[1.0, 10.0, 2.0, 1.0], [5.0, 1.0, 2.0, 3.0], [4.0, 0.0, 1.0, 0.0]])
+        np.testing.assert_array_equal(rank_channels(scores), [1, 3, 0, 2])
+        np.testing.assert_array_equal(rank_channels(scores[:1]), [0, 1, 2, 3])
+
+
+class ResultWriterTest(unittest.TestCase):
+    def test_channel_ranking(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "results.jsonl")
+            writer = ResultWriter(path, "first")
+            writer.write(np.zeros((2, 3)), None)
+            writer.write(np.ones((2, 3)), 2, np.array([3, 0, 1, 2]))
+            writer.file.close()
+            with open(path) as results_file:
+                results = [json.loads(line) for line in results_file]
+
+        self.assertIsNone(results[0]["channel ranking"])
+        self.assertEqual(results[1]["channel ranking"], [3, 0, 1, 2])
+        self.assertEqual(results[1]["classification"], 2)
+        self.assertEqual(results[1]["averages"], [[1.0] * 3] * 2)
+        self.assertEqual(results[1]["session"], "first")
+
+
+if __name__ == "__main__":
+    unittest.main()
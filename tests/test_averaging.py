@@ -0,0 +1,59 @@
+import unittest
+
+import numpy as np
+
+from bstadlbauer.p300analyzer.averaging import RunningAverager
+
+
+class RunningAveragerTest(unittest.TestCase):
+    window_size = 5
+    stats_window_size = 3
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        # Enough trials per class for the sums to be recomputed from the windows several times
+        self.markers = rng.randint(1, 5, 200)
+        self.trials = rng.normal(0, 10, (200, 20, 3)) + 1e6
+
+    def assert_matches_batch(self, averager, num_added):
+        markers = self.markers[:num_added]
+        trials = self.trials[:num_added]
+        classes = sorted(set(markers))
+        self.assertEqual(averager.get_markers(), classes)
+
+        windows = [trials[markers == marker][-self.window_size :] for marker in classes]
+        np.testing.assert_allclose(averager.get_averages(), [np.mean(window, axis=0) for window in windows])
+        np.testing.assert_allclose(
+            averager.get_averages(squared=True), [np.mean(window, axis=0) ** 2 for window in windows]
+        )
+
+        stats_windows = [trials[markers == marker][-self.stats_window_size :] for marker in classes]
+        counts, sums, squares = averager.get_statistics()
+        np.testing.assert_array_equal(counts, [len(window) for window in stats_windows])
+        np.testing.assert_allclose(sums, [np.sum(window, axis=0) for window in stats_windows])
+        np.testing.assert_allclose(squares, [np.sum(window ** 2, axis=0) for window in stats_windows])
+
+        window_markers, window_trials = averager.get_window_trials()
+        np.testing.assert_array_equal(window_markers, np.repeat(classes, [len(window) for window in windows]))
+        np.testing.assert_array_equal(window_trials, np.concatenate(windows))
+
+    def test_matches_batch_averages(self):
+        averager = RunningAverager(self.window_size, self.stats_window_size)
+        for num_added, (marker, trial) in enumerate(zip(self.markers, self.trials), 1):
+            averager.add_trial(int(marker), trial)
+            self.assert_matches_batch(averager, num_added)
+
+    def test_last_window_trials(self):
+        averager = RunningAverager(self.window_size, self.stats_window_size)
+        for marker, trial in zip(self.markers, self.trials):
+            averager.add_trial(int(marker), trial)
+
+        window_markers, window_trials = averager.get_window_trials(2)
+        for marker in averager.get_markers():
+            np.testing.assert_array_equal(
+                window_trials[window_markers == marker], self.trials[self.markers == marker][-2:]
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+import unittest
+
+import numpy as np
+
+from bstadlbauer.p300analyzer.custom_filter import CustomBPFilter, PolyphaseDecimator
+
+
+def split(x, block_sizes):
+    """Splits x along the first axis into consecutive blocks of the given sizes (repeated) until x is used up"""
+    blocks = []
+    start = 0
+    while start < len(x):
+        for block_size in block_sizes:
+            blocks.append(x[start : start + block_size])
+            start += block_size
+    return [block for block in blocks if len(block) > 0]
+
+
+class CustomBPFilterTest(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.samples = rng.normal(0, 1, (1000, 4)) + np.array([100.0, -50.0, 0.0, 20.0])
+
+    def filter_in_blocks(self, block_sizes, **kwargs):
+        bp_filter = CustomBPFilter(256, 4, 4, 1, 40, **kwargs)
+        return np.concatenate([bp_filter.filter(block) for block in split(self.samples, block_sizes)])
+
+    def test_sample_by_sample_equals_blocks(self):
+        for kwargs in [{}, {"notch_freqs": (50, 60), "reference": "average"}, {"init_from_first_sample": True}]:
+            with self.subTest(**kwargs):
+                whole = self.filter_in_blocks([len(self.samples)], **kwargs)
+                np.testing.assert_allclose(self.filter_in_blocks([1], **kwargs), whole)
+                np.testing.assert_allclose(self.filter_in_blocks([1, 7, 32, 3, 100], **kwargs), whole)
+
+    def test_empty_blocks(self):
+        bp_filter = CustomBPFilter(256, 4, 4, 1, 40, init_from_first_sample=True)
+        filtered = [bp_filter.filter(np.zeros((0, 4)))]
+        filtered += [bp_filter.filter(block) for block in split(self.samples, [10, 0])]
+        np.testing.assert_allclose(np.concatenate(filtered), self.filter_in_blocks([10], init_from_first_sample=True))
+
+
+class PolyphaseDecimatorTest(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.samples = rng.normal(0, 1, (1001, 3))
+        self.timestamps = 10.0 + np.arange(1001) / 256.0
+
+    def decimate_in_blocks(self, factor, block_sizes):
+        decimator = PolyphaseDecimator(3, factor)
+        outputs = [
+            decimator.decimate(samples, timestamps)
+            for samples, timestamps in zip(split(self.samples, block_sizes), split(self.timestamps, block_sizes))
+        ]
+        return np.concatenate([y for y, _ in outputs]), np.concatenate([y_ts for _, y_ts in outputs])
+
+    def test_independent_of_block_size(self):
+        for factor in [2, 3, 4]:
+            whole, whole_ts = self.decimate_in_blocks(factor, [len(self.samples)])
+            for block_sizes in [[1], [2, 5], [factor], [7, 100, 1, 33]]:
+                with self.subTest(factor=factor, block_sizes=block_sizes):
+                    y, y_ts = self.decimate_in_blocks(factor, block_sizes)
+                    np.testing.assert_allclose(y, whole)
+                    np.testing.assert_array_equal(y_ts, whole_ts)
+
+    def test_matches_filtering_and_downsampling(self):
+        factor = 4
+        decimator = PolyphaseDecimator(3, factor)
+        y, y_ts = decimator.decimate(self.samples, self.timestamps)
+
+        # Samples before the first one are taken to equal it
+        delay = decimator.delay
+        padded = np.concatenate([np.repeat(self.samples[:1], delay, axis=0), self.samples])
+        centers = np.arange(0, len(self.samples) - delay, factor)
+        expected = [decimator.taps @ padded[center : center + len(decimator.taps)] for center in centers]
+        np.testing.assert_allclose(y, expected)
+        np.testing.assert_array_equal(y_ts, self.timestamps[centers])
+
+
+if __name__ == "__main__":
+    unittest.main()
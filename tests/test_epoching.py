@@ -0,0 +1,91 @@
+import unittest
+
+import numpy as np
+
+from bstadlbauer.p300analyzer.epoching import (
+    LazyEpochs,
+    extract_epochs,
+    sliding_windows,
+)
+
+
+class ExtractEpochsTest(unittest.TestCase):
+    num_pre = 5
+    num_post = 20
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.eeg = rng.normal(0, 1, (500, 3))
+        # Including onsets whose epoch starts before or ends after the EEG
+        self.onsets = np.array([0, 4, 5, 100, 101, 250, 479, 480, 481, 499])
+
+    def expected_epochs(self):
+        """Epochs cut one by one as a reference"""
+        epochs = []
+        kept = []
+        for onset in self.onsets:
+            start = onset - self.num_pre
+            stop = onset + self.num_post
+            kept.append(start >= 0 and stop <= len(self.eeg))
+            if kept[-1]:
+                epochs.append(self.eeg[start:stop])
+        return np.array(epochs), np.array(kept)
+
+    def test_matches_loop(self):
+        expected, expected_kept = self.expected_epochs()
+        epochs, kept = extract_epochs(self.eeg, self.onsets, self.num_post, self.num_pre)
+        np.testing.assert_array_equal(kept, expected_kept)
+        np.testing.assert_array_equal(epochs, expected)
+
+    def test_baseline(self):
+        expected, _ = self.expected_epochs()
+        expected = expected - np.mean(expected[:, : self.num_pre], axis=1, keepdims=True)
+        epochs, _ = extract_epochs(self.eeg, self.onsets, self.num_post, self.num_pre, (-self.num_pre, 0), lazy=True)
+        np.testing.assert_allclose(epochs, expected)
+
+    def test_lazy(self):
+        expected, expected_kept = self.expected_epochs()
+        epochs, kept = extract_epochs(self.eeg, self.onsets, self.num_post, self.num_pre, lazy=True)
+        self.assertIsInstance(epochs, LazyEpochs)
+        np.testing.assert_array_equal(kept, expected_kept)
+        self.assertEqual(len(epochs), len(expected))
+        self.assertEqual(epochs.shape, expected.shape)
+
+        # Single epochs and iteration give read-only views into the EEG
+        self.assertTrue(np.shares_memory(epochs[1], self.eeg))
+        self.assertFalse(epochs[1].flags.writeable)
+        np.testing.assert_array_equal(epochs[1], expected[1])
+        np.testing.assert_array_equal(list(epochs), expected)
+        np.testing.assert_array_equal(np.asarray(epochs[1:3]), expected[1:3])
+
+    def test_lazy_array_conversion(self):
+        expected, _ = self.expected_epochs()
+        epochs, _ = extract_epochs(self.eeg, self.onsets, self.num_post, self.num_pre, lazy=True)
+
+        array = np.asarray(epochs)
+        np.testing.assert_array_equal(array, expected)
+        self.assertFalse(np.shares_memory(array, self.eeg))
+        self.assertEqual(np.asarray(epochs, dtype=np.float32).dtype, np.float32)
+        np.testing.assert_array_equal(epochs.__array__(copy=True), expected)
+        with self.assertRaises(ValueError):
+            epochs.__array__(copy=False)
+
+    def test_no_complete_epochs(self):
+        epochs, kept = extract_epochs(self.eeg[:10], self.onsets, self.num_post, self.num_pre)
+        self.assertEqual(epochs.shape, (0, self.num_pre + self.num_post, 3))
+        self.assertFalse(np.any(kept))
+
+
+class SlidingWindowsTest(unittest.TestCase):
+    def test_windows(self):
+        eeg = np.arange(30.0).reshape(10, 3)
+        windows = sliding_windows(eeg, 4)
+        self.assertEqual(windows.shape, (7, 4, 3))
+        for start in range(7):
+            np.testing.assert_array_equal(windows[start], eeg[start : start + 4])
+        self.assertTrue(np.shares_memory(windows, eeg))
+        self.assertEqual(sliding_windows(eeg, 11).shape, (0, 11, 3))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+import unittest
+
+import numpy as np
+
+from bstadlbauer.p300analyzer.evidence import EvidenceAccumulator
+
+
+class EvidenceAccumulatorTest(unittest.TestCase):
+    num_classes = 4
+    target = 2
+
+    def setUp(self):
+        self.rng = np.random.RandomState(0)
+
+    def trial(self, marker, signal=1.0):
+        """Features of shape (num_samples, num_channels), the target class has a higher mean"""
+        return self.rng.normal(signal if marker == self.target else 0, 1, (5, 2))
+
+    def baseline_posteriors(self, trials):
+        """Posteriors computed from the single trials (list of (marker, features)) by maximizing the likelihood of
+        every hypothesis directly"""
+        markers = sorted(set(marker for marker, _ in trials))
+        features = np.array([np.ravel(trial) for _, trial in trials])
+        log_likelihoods = []
+        for marker in markers:
+            is_class = np.array([trial_marker == marker for trial_marker, _ in trials])
+            residuals = np.concatenate(
+                [
+                    features[is_class] - features[is_class].mean(axis=0),
+                    features[~is_class] - features[~is_class].mean(axis=0),
+                ]
+            )
+            variances = np.mean(residuals ** 2, axis=0)
+            log_likelihoods.append(-len(features) / 2 * np.sum(np.log(variances)))
+        posteriors = np.exp(np.array(log_likelihoods) - np.max(log_likelihoods))
+        return posteriors / np.sum(posteriors)
+
+    def test_posteriors(self):
+        accumulator = EvidenceAccumulator(self.num_classes)
+        trials = []
+        for repetition in range(3):
+            for marker in self.rng.permutation(self.num_classes):
+                trials.append((marker, self.trial(marker, 0.3)))
+                accumulator.add_trial(*trials[-1])
+                # With fewer trials, the variance of the two groups can be zero
+                if len(trials) >= self.num_classes:
+                    np.testing.assert_allclose(accumulator.get_posteriors(), self.baseline_posteriors(trials))
+
+        self.assertEqual(accumulator.get_markers(), list(range(self.num_classes)))
+        self.assertAlmostEqual(np.sum(accumulator.get_posteriors()), 1.0)
+
+    def test_single_class(self):
+        accumulator = EvidenceAccumulator(self.num_classes)
+        self.assertEqual(len(accumulator.get_posteriors()), 0)
+        accumulator.add_trial(1, self.trial(1))
+        np.testing.assert_array_equal(accumulator.get_posteriors(), [1.0])
+
+    def test_decide(self):
+        accumulator = EvidenceAccumulator(self.num_classes, threshold=0.99, min_trials=2)
+        for marker in range(self.num_classes):
+            accumulator.add_trial(marker, self.trial(marker, 3.0))
+        # Every class needs min_trials trials
+        self.assertIsNone(accumulator.decide())
+
+        selection = None
+        while selection is None:
+            for marker in range(self.num_classes):
+                accumulator.add_trial(marker, self.trial(marker, 3.0))
+            selection = accumulator.decide()
+        self.assertEqual(selection, self.target)
+        # The trials are forgotten after a decision
+        self.assertEqual(accumulator.get_markers(), [])
+
+    def test_max_trials(self):
+        accumulator = EvidenceAccumulator(self.num_classes, threshold=1.0, max_trials=3)
+        for repetition in range(3):
+            self.assertIsNone(accumulator.decide())
+            for marker in range(self.num_classes):
+                accumulator.add_trial(marker, self.trial(marker))
+        expected = int(np.argmax(accumulator.get_posteriors()))
+        self.assertEqual(accumulator.decide(), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
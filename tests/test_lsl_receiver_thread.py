@@ -0,0 +1,126 @@
+import unittest
+
+import numpy as np
+from pylsl import pylsl
+
+from bstadlbauer.p300analyzer.lsl_receiver_thread import LSLReceiverThread
+from bstadlbauer.p300analyzer.shared_buffers import SharedState
+
+TIME_CORRECTION = 0.25
+
+
+class StreamEnd(Exception):
+    pass
+
+
+class FakeInfo(object):
+    def __init__(self, channel_count, channel_format):
+        self._channel_count = channel_count
+        self._channel_format = channel_format
+
+    def channel_count(self):
+        return self._channel_count
+
+    def channel_format(self):
+        return self._channel_format
+
+
+class FakeInlet(object):
+    """Inlet that returns the given pulls (arrays of samples, empty ones for timeouts) and raises StreamEnd after the
+    last one"""
+
+    def __init__(self, pulls, timestamps, channel_format=pylsl.cf_float32):
+        self.pulls = list(pulls)
+        self.timestamps = list(timestamps)
+        self.info_ = FakeInfo(pulls[0].shape[1], channel_format)
+        self.max_samples = []
+
+    def info(self):
+        return self.info_
+
+    def time_correction(self):
+        return TIME_CORRECTION
+
+    def next_pull(self, max_samples):
+        if not self.pulls:
+            raise StreamEnd()
+        samples = self.pulls[0][:max_samples]
+        self.pulls[0] = self.pulls[0][max_samples:]
+        if len(self.pulls[0]) == 0:
+            self.pulls.pop(0)
+        timestamps, self.timestamps = self.timestamps[: len(samples)], self.timestamps[len(samples) :]
+        return samples, timestamps
+
+    def pull_chunk(self, timeout, max_samples, dest_obj):
+        self.max_samples.append(max_samples)
+        samples, timestamps = self.next_pull(max_samples)
+        dest_obj[: len(samples)] = samples
+        return dest_obj, timestamps
+
+    def pull_sample(self):
+        samples, timestamps = self.next_pull(1)
+        while len(samples) == 0:
+            samples, timestamps = self.next_pull(1)
+        return list(samples[0]), timestamps[0]
+
+
+class LSLReceiverThreadTest(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        sizes = rng.randint(0, 100, 50)
+        self.samples = rng.normal(0, 1, (int(np.sum(sizes)), 4)).astype(np.float32)
+        self.timestamps = 100.0 + np.arange(len(self.samples)) / 256.0
+        self.pulls = np.split(self.samples, np.cumsum(sizes)[:-1])
+
+    def receive(self, inlet, chunked=True, shared_state=None):
+        blocks = []
+        samples = []
+        timestamps = []
+
+        def append_block(block, block_ts):
+            # The block is reused for the next chunk
+            blocks.append((block.copy(), block_ts))
+
+        receiver = LSLReceiverThread(
+            inlet,
+            samples.append,
+            timestamps.append,
+            shared_state,
+            block_func=append_block if chunked else None,
+            max_chunk_size=64,
+            count_interval=0,
+        )
+        with self.assertRaises(StreamEnd):
+            receiver.run()
+        return blocks, samples, timestamps
+
+    def test_chunks(self):
+        shared_state = SharedState()
+        inlet = FakeInlet(self.pulls, self.timestamps)
+        blocks, samples, _ = self.receive(inlet, shared_state=shared_state)
+
+        self.assertEqual(samples, [])
+        self.assertTrue(all(0 < len(block) <= 64 for block, _ in blocks))
+        self.assertEqual(set(inlet.max_samples), {64})
+        np.testing.assert_array_equal(np.concatenate([block for block, _ in blocks]), self.samples)
+        np.testing.assert_allclose(
+            np.concatenate([block_ts for _, block_ts in blocks]), self.timestamps + TIME_CORRECTION
+        )
+        self.assertEqual(shared_state["sample count"], len(self.samples))
+
+    def test_chunks_equal_samples(self):
+        blocks, _, _ = self.receive(FakeInlet(self.pulls, self.timestamps))
+        _, samples, timestamps = self.receive(FakeInlet(self.pulls, self.timestamps), chunked=False)
+        np.testing.assert_array_equal(np.concatenate([block for block, _ in blocks]), samples)
+        np.testing.assert_allclose(np.concatenate([block_ts for _, block_ts in blocks]), timestamps)
+
+    def test_unsupported_format_falls_back_to_samples(self):
+        inlet = FakeInlet(self.pulls, self.timestamps, channel_format=pylsl.cf_string)
+        blocks, samples, timestamps = self.receive(inlet)
+        self.assertEqual(blocks, [])
+        np.testing.assert_array_equal(samples, self.samples)
+        np.testing.assert_allclose(timestamps, self.timestamps + TIME_CORRECTION)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,123 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from bstadlbauer.p300analyzer.recording_writer import (
+    NPY_HEADER_LENGTH,
+    STREAM_SUFFIXES,
+    RecordingWriter,
+    npy_header,
+    repair_recording,
+)
+
+
+class RecordingWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path_prefix = os.path.join(self.directory.name, "recording")
+
+        rng = np.random.RandomState(0)
+        self.eeg = rng.normal(0, 1, (1000, 4))
+        self.eeg_ts = np.arange(1000) / 256.0
+        self.markers = rng.randint(1, 13, (40, 1))
+        self.marker_ts = np.sort(rng.uniform(0, 4, 40))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def load(self, stream, path_prefix=None):
+        return np.load((path_prefix or self.path_prefix) + STREAM_SUFFIXES[stream])
+
+    def write(self, writer, start, stop):
+        for block_start in range(start, stop, 64):
+            block_stop = min(block_start + 64, stop)
+            writer.write_blocks(
+                {"eeg": self.eeg[block_start:block_stop], "eeg_ts": self.eeg_ts[block_start:block_stop]}
+            )
+        for marker_start in range(start // 25, stop // 25, 3):
+            marker_stop = min(marker_start + 3, stop // 25)
+            writer.write("marker", self.markers[marker_start:marker_stop])
+            writer.write("marker_ts", self.marker_ts[marker_start:marker_stop])
+
+    def test_round_trip(self):
+        writer = RecordingWriter(self.path_prefix, max_queued_blocks=4, sync_interval=0.01)
+        writer.start()
+        self.write(writer, 0, 1000)
+        writer.finalize()
+
+        np.testing.assert_array_equal(self.load("eeg"), self.eeg)
+        np.testing.assert_array_equal(self.load("eeg_ts"), self.eeg_ts)
+        np.testing.assert_array_equal(self.load("marker"), self.markers)
+        np.testing.assert_array_equal(self.load("marker_ts"), self.marker_ts)
+        self.assertEqual(self.load("marker").dtype, self.markers.dtype)
+        self.assertFalse(os.path.exists(self.path_prefix + STREAM_SUFFIXES["raw_eeg"]))
+
+    def test_save_as(self):
+        writer = RecordingWriter(self.path_prefix)
+        writer.start()
+        self.write(writer, 0, 500)
+        save_prefix = os.path.join(self.directory.name, "saved")
+        self.assertIsNone(writer.save_as(save_prefix))
+
+        # The saved files are the recording itself, finalized up to the save
+        self.assertTrue(
+            os.path.samefile(save_prefix + STREAM_SUFFIXES["eeg"], self.path_prefix + STREAM_SUFFIXES["eeg"])
+        )
+        np.testing.assert_array_equal(self.load("eeg", save_prefix), self.eeg[:500])
+        np.testing.assert_array_equal(self.load("eeg_ts", save_prefix), self.eeg_ts[:500])
+        np.testing.assert_array_equal(self.load("marker", save_prefix), self.markers[:20])
+
+        # Saving again replaces the files, the saved files grow with the recording
+        self.write(writer, 500, 800)
+        writer.save_as(save_prefix)
+        np.testing.assert_array_equal(self.load("eeg", save_prefix), self.eeg[:800])
+        self.write(writer, 800, 1000)
+        writer.finalize()
+        np.testing.assert_array_equal(self.load("eeg", save_prefix), self.eeg)
+        np.testing.assert_array_equal(self.load("marker_ts", save_prefix), self.marker_ts)
+        np.testing.assert_array_equal(self.load("eeg"), self.eeg)
+
+    def test_save_as_without_hard_links(self):
+        writer = RecordingWriter(self.path_prefix)
+        writer.start()
+        self.write(writer, 0, 500)
+        save_prefix = os.path.join(self.directory.name, "saved")
+        with mock.patch("os.link", side_effect=OSError("hard links not supported")):
+            copy_thread = writer.save_as(save_prefix)
+        self.write(writer, 500, 1000)
+        copy_thread.join()
+        writer.finalize()
+
+        # The rows queued before saving were copied
+        np.testing.assert_array_equal(self.load("eeg", save_prefix), self.eeg[:500])
+        np.testing.assert_array_equal(self.load("marker", save_prefix), self.markers[:20])
+        np.testing.assert_array_equal(self.load("eeg"), self.eeg)
+
+    def test_repair_recording(self):
+        writer = RecordingWriter(self.path_prefix)
+        writer.start()
+        self.write(writer, 0, 1000)
+        writer.finalize()
+
+        # State after a crash: the headers were last synced after 100 rows, the last row was written partially
+        for stream, rows in [("eeg", self.eeg), ("marker", self.markers)]:
+            with open(self.path_prefix + STREAM_SUFFIXES[stream], "r+b") as npy_file:
+                npy_file.write(npy_header(rows.dtype, (min(100, len(rows)),) + rows.shape[1:]))
+                npy_file.seek(0, os.SEEK_END)
+                npy_file.write(b"\x00" * (rows.dtype.itemsize * rows.shape[1] // 2))
+        self.assertEqual(len(np.load(self.path_prefix + STREAM_SUFFIXES["eeg"], mmap_mode="r")), 100)
+
+        repair_recording(self.path_prefix)
+        np.testing.assert_array_equal(self.load("eeg"), self.eeg)
+        np.testing.assert_array_equal(self.load("marker"), self.markers)
+        np.testing.assert_array_equal(self.load("eeg_ts"), self.eeg_ts)
+        self.assertEqual(
+            os.path.getsize(self.path_prefix + STREAM_SUFFIXES["eeg"]), NPY_HEADER_LENGTH + self.eeg.nbytes
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
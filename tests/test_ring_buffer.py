@@ -0,0 +1,81 @@
+import unittest
+
+import numpy as np
+
+from bstadlbauer.p300analyzer.ring_buffer import RingBuffer
+
+
+class RingBufferTest(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.block_sizes = rng.randint(0, 40, 200)
+        self.samples = rng.normal(0, 1, (int(np.sum(self.block_sizes)), 3))
+
+    def fill(self, ring_buffer, check):
+        """Extends ring_buffer block by block and calls check(total) after every block"""
+        start = 0
+        for block_size in self.block_sizes:
+            ring_buffer.extend(self.samples[start : start + block_size])
+            start += block_size
+            check(start)
+
+    def test_keeps_all_samples(self):
+        ring_buffer = RingBuffer(3, initial_capacity=4)
+
+        def check(total):
+            self.assertEqual(ring_buffer.total, total)
+            self.assertEqual(len(ring_buffer), total)
+            np.testing.assert_array_equal(ring_buffer.view(), self.samples[:total])
+            stop = max(total - 1, 0)
+            np.testing.assert_array_equal(ring_buffer.view(total // 2, stop), self.samples[total // 2 : stop])
+
+        self.fill(ring_buffer, check)
+
+    def test_retention(self):
+        ring_buffer = RingBuffer(3, initial_capacity=4, max_length=50)
+
+        def check(total):
+            first = max(total - 50, 0)
+            self.assertEqual(ring_buffer.first_index, first)
+            np.testing.assert_array_equal(ring_buffer.view(), self.samples[first:total])
+            # Indices before the retention window are clipped
+            np.testing.assert_array_equal(ring_buffer.view(0, total), self.samples[first:total])
+            np.testing.assert_array_equal(ring_buffer.last(10), self.samples[max(total - 10, first) : total])
+            self.assertLessEqual(len(ring_buffer.storage), 100)
+
+        self.fill(ring_buffer, check)
+
+    def test_block_longer_than_retention(self):
+        ring_buffer = RingBuffer(3, max_length=50)
+        ring_buffer.extend(self.samples[:10])
+        ring_buffer.extend(self.samples[10:130])
+        self.assertEqual(ring_buffer.total, 130)
+        np.testing.assert_array_equal(ring_buffer.view(), self.samples[80:130])
+
+    def test_views_stay_valid(self):
+        ring_buffer = RingBuffer(3, initial_capacity=4, max_length=20)
+        ring_buffer.extend(self.samples[:10])
+        view = ring_buffer.view()
+        # Growing and moving the retained samples must not change views handed out before
+        ring_buffer.extend(self.samples[10:100])
+        np.testing.assert_array_equal(view, self.samples[:10])
+        self.assertFalse(view.flags.writeable)
+
+    def test_append_scalars(self):
+        ring_buffer = RingBuffer(initial_capacity=2, max_length=5)
+        for value in range(12):
+            ring_buffer.append(value)
+        np.testing.assert_array_equal(ring_buffer.view(), np.arange(7, 12))
+        self.assertEqual(ring_buffer.view().ndim, 1)
+
+    def test_searchsorted(self):
+        ring_buffer = RingBuffer(initial_capacity=4, max_length=10)
+        ring_buffer.extend(np.arange(30) / 10.0)
+        indices = ring_buffer.searchsorted([0.0, 2.05, 2.5, 10.0])
+        # Absolute indices, values before the retained samples map to the first retained one
+        np.testing.assert_array_equal(indices, [20, 21, 25, 30])
+        np.testing.assert_array_equal(ring_buffer.view(21, 25), np.arange(21, 25) / 10.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,129 @@
+import threading
+import time
+import unittest
+from unittest import mock
+
+from bstadlbauer.p300analyzer.sessions import AnalysisPool
+
+TIMEOUT = 10.0
+
+
+class FakeData(object):
+    def __init__(self):
+        self.listeners = []
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def notify(self):
+        for listener in self.listeners:
+            listener()
+
+
+class FakeAnalysis(object):
+    """Counts its polls and concurrent polls, poll_func is called on every poll"""
+
+    def __init__(self, poll_func=None):
+        self.data = FakeData()
+        self.poll_func = poll_func
+        self.messages = []
+
+        self.lock = threading.Lock()
+        self.num_polls = 0
+        self.num_active = 0
+        self.max_active = 0
+        self.polled = threading.Condition(self.lock)
+
+    def poll(self):
+        with self.lock:
+            self.num_active += 1
+            self.max_active = max(self.max_active, self.num_active)
+        try:
+            if self.poll_func is not None:
+                self.poll_func(self)
+        finally:
+            with self.lock:
+                self.num_active -= 1
+                self.num_polls += 1
+                self.polled.notify_all()
+
+    def wait_for_polls(self, num_polls):
+        with self.lock:
+            return self.polled.wait_for(lambda: self.num_polls >= num_polls, TIMEOUT)
+
+    def print_to_console(self, message):
+        self.messages.append(message)
+
+
+class AnalysisPoolTest(unittest.TestCase):
+    def setUp(self):
+        # Only polls after notifications are expected, not the periodic ones
+        patcher = mock.patch("bstadlbauer.p300analyzer.sessions.SETTINGS_POLL_INTERVAL", 3600)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_polls_on_notification(self):
+        analyses = [FakeAnalysis(), FakeAnalysis()]
+        pool = AnalysisPool(analyses, num_workers=2)
+        pool.start()
+        # All analyses are polled once on start
+        self.assertTrue(all(analysis.wait_for_polls(1) for analysis in analyses))
+
+        analyses[1].data.notify()
+        self.assertTrue(analyses[1].wait_for_polls(2))
+        time.sleep(0.05)
+        self.assertEqual([analysis.num_polls for analysis in analyses], [1, 2])
+
+    def test_notification_while_polling(self):
+        def notify_on_first_poll(analysis):
+            if analysis.num_polls == 0:
+                analysis.data.notify()
+
+        analysis = FakeAnalysis(notify_on_first_poll)
+        pool = AnalysisPool([analysis], num_workers=2)
+        pool.start()
+        # New data that arrives while polling is not missed
+        self.assertTrue(analysis.wait_for_polls(2))
+        time.sleep(0.05)
+        self.assertEqual(analysis.num_polls, 2)
+
+    def test_never_polled_concurrently(self):
+        analyses = [FakeAnalysis(lambda analysis: time.sleep(0.001)) for _ in range(3)]
+        pool = AnalysisPool(analyses, num_workers=4)
+        pool.start()
+
+        notifiers = [
+            threading.Thread(target=lambda data=analysis.data: [data.notify() for _ in range(200)])
+            for analysis in analyses
+            for _ in range(2)
+        ]
+        for notifier in notifiers:
+            notifier.start()
+        for notifier in notifiers:
+            notifier.join()
+        for analysis in analyses:
+            analysis.data.notify()
+            self.assertTrue(analysis.wait_for_polls(2))
+            self.assertEqual(analysis.max_active, 1)
+
+    def test_drops_failing_analysis(self):
+        def fail(analysis):
+            raise RuntimeError("broken session")
+
+        failing = FakeAnalysis(fail)
+        working = FakeAnalysis()
+        pool = AnalysisPool([failing, working], num_workers=1)
+        pool.start()
+        self.assertTrue(failing.wait_for_polls(1))
+        self.assertTrue(working.wait_for_polls(1))
+
+        failing.data.notify()
+        working.data.notify()
+        self.assertTrue(working.wait_for_polls(2))
+        time.sleep(0.05)
+        self.assertEqual(failing.num_polls, 1)
+        self.assertEqual(failing.messages, ["Analysis stopped: RuntimeError('broken session')"])
+
+
+if __name__ == "__main__":
+    unittest.main()
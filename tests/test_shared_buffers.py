@@ -0,0 +1,145 @@
+import multiprocessing as mp
+import unittest
+
+import numpy as np
+
+from bstadlbauer.p300analyzer.shared_buffers import (
+    LatestValueBuffer,
+    SharedRingBuffer,
+    SharedState,
+)
+
+NUM_WRITES = 2000
+SHAPE = (16, 4096)
+RING_CAPACITY = 64
+
+
+def write_values(buffer):
+    """Writes value i (all entries i, 1 + i % SHAPE[0] rows, timestamp i) for every i"""
+    for value in range(NUM_WRITES):
+        buffer.write(np.full((1 + value % SHAPE[0], SHAPE[1]), value), float(value))
+
+
+def write_settings(state):
+    for value in range(1, NUM_WRITES):
+        state.update({"channel select": value, "y lim": [value, -value], "update interval": value, "squared": value})
+
+
+def extend_rows(ring_buffer):
+    """Appends row i (all entries i) for every i, in NUM_WRITES blocks of 1 to 2 * RING_CAPACITY rows"""
+    total = 0
+    for value in range(NUM_WRITES):
+        num_rows = 1 + value % (2 * RING_CAPACITY)
+        rows = np.repeat(np.arange(total, total + num_rows)[:, np.newaxis], ring_buffer.num_columns, axis=1)
+        ring_buffer.extend(rows)
+        total += num_rows
+
+
+class LatestValueBufferTest(unittest.TestCase):
+    def test_write_read(self):
+        buffer = LatestValueBuffer((3, 2))
+        self.assertIsNone(buffer.read())
+
+        buffer.write(np.ones((3, 2)))
+        buffer.write(np.arange(4).reshape(2, 2), 5.0)
+        np.testing.assert_array_equal(buffer.read(), np.arange(4).reshape(2, 2))
+        self.assertEqual(buffer.last_timestamp, 5.0)
+        self.assertEqual(buffer.dropped_frames, 1)
+        self.assertIsNone(buffer.read())
+
+    def test_no_torn_reads(self):
+        buffer = LatestValueBuffer(SHAPE)
+        writer = mp.Process(target=write_values, args=(buffer,))
+        writer.start()
+
+        last_value = -1
+        num_reads = 0
+        while last_value < NUM_WRITES - 1:
+            value = buffer.read()
+            if value is None:
+                # Fail instead of waiting forever if the writer died
+                self.assertIn(writer.exitcode, (None, 0))
+                continue
+            num_reads += 1
+            current = value[0, 0]
+            # All entries, the number of rows and the timestamp have to belong to the same write
+            self.assertTrue(np.all(value == current))
+            self.assertEqual(len(value), 1 + int(current) % SHAPE[0])
+            self.assertEqual(buffer.last_timestamp, current)
+            self.assertGreater(current, last_value)
+            last_value = current
+
+        writer.join()
+        self.assertEqual(num_reads + buffer.dropped_frames, NUM_WRITES)
+
+
+class SharedStateTest(unittest.TestCase):
+    def test_settings_and_counters(self):
+        state = SharedState()
+        state.update({"channel select": 2, "y lim": [0, 100]})
+        state["sample count"] = 7
+        self.assertEqual(state.version, 1)
+        self.assertEqual(state["channel select"], 2)
+        self.assertEqual(state["y lim"], [0.0, 100.0])
+        self.assertEqual(state["sample count"], 7)
+
+        state["squared"] = 1
+        self.assertEqual(state.version, 2)
+        self.assertEqual(state.get_settings()["squared"], 1)
+
+    def test_no_torn_reads(self):
+        state = SharedState()
+        writer = mp.Process(target=write_settings, args=(state,))
+        writer.start()
+
+        value = 0
+        while value < NUM_WRITES - 1:
+            self.assertIn(writer.exitcode, (None, 0))
+            settings = state.get_settings()
+            value = settings["channel select"]
+            expected = {"channel select": value, "y lim": [value, -value], "update interval": value, "squared": value}
+            self.assertEqual(settings, expected)
+
+        writer.join()
+        self.assertEqual(state.version, NUM_WRITES - 1)
+
+
+class SharedRingBufferTest(unittest.TestCase):
+    def test_read_new_rows(self):
+        ring_buffer = SharedRingBuffer(2, 8)
+        rows = np.arange(40.0).reshape(20, 2)
+
+        ring_buffer.extend(rows[:5])
+        read, stop = ring_buffer.read(0)
+        np.testing.assert_array_equal(read, rows[:5])
+
+        ring_buffer.extend(rows[5:20])
+        read, stop = ring_buffer.read(stop)
+        # Only the last capacity rows are kept
+        np.testing.assert_array_equal(read, rows[12:20])
+        self.assertEqual(stop, 20)
+        self.assertEqual(ring_buffer.dropped_rows, 7)
+
+    def test_no_torn_reads(self):
+        ring_buffer = SharedRingBuffer(SHAPE[1], RING_CAPACITY)
+        writer = mp.Process(target=extend_rows, args=(ring_buffer,))
+        writer.start()
+
+        expected_total = sum(1 + value % (2 * RING_CAPACITY) for value in range(NUM_WRITES))
+        start = 0
+        num_read = 0
+        while start < expected_total:
+            self.assertIn(writer.exitcode, (None, 0))
+            rows, stop = ring_buffer.read(start)
+            # The rows returned are the last ones before stop, all entries of a row have to be written together
+            expected = np.arange(stop - len(rows), stop)
+            np.testing.assert_array_equal(rows, np.repeat(expected[:, np.newaxis], SHAPE[1], axis=1))
+            num_read += len(rows)
+            start = stop
+
+        writer.join()
+        self.assertEqual(num_read + ring_buffer.dropped_rows, expected_total)
+
+
+if __name__ == "__main__":
+    unittest.main()
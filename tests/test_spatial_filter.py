@@ -0,0 +1,69 @@
+import unittest
+
+import numpy as np
+
+from bstadlbauer.p300analyzer.spatial_filter import SpatialFilter, decimate
+
+
+class DecimateTest(unittest.TestCase):
+    def test_block_means(self):
+        trials = np.random.RandomState(0).normal(0, 1, (5, 23, 3))
+        decimated = decimate(trials, 4)
+        self.assertEqual(decimated.shape, (5, 5, 3))
+        for block in range(5):
+            np.testing.assert_allclose(decimated[:, block], np.mean(trials[:, 4 * block : 4 * block + 4], axis=1))
+        # A single trial of shape (num_samples, num_channels)
+        np.testing.assert_allclose(decimate(trials[2], 4), decimated[2])
+
+
+class SpatialFilterTest(unittest.TestCase):
+    num_channels = 6
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        mixing = rng.normal(0, 1, (self.num_channels, self.num_channels))
+        # Trials of shape (num_samples, num_channels) with noise correlated between channels
+        self.trials = rng.normal(0, 1, (200, 10, self.num_channels)) @ mixing
+
+    def test_noise_covariance(self):
+        spatial_filter = SpatialFilter(self.num_channels, shrinkage=0.2, memory=np.inf)
+        for trial in self.trials:
+            spatial_filter.add_trial(trial)
+
+        samples = self.trials.reshape(-1, self.num_channels)
+        covariance = samples.T @ samples / len(samples)
+        identity_scale = np.trace(covariance) / self.num_channels
+        expected = 0.8 * covariance + 0.2 * identity_scale * np.eye(self.num_channels)
+        np.testing.assert_allclose(spatial_filter.get_noise_covariance(), expected)
+
+    def test_forgetting(self):
+        spatial_filter = SpatialFilter(self.num_channels, shrinkage=0.0, memory=20)
+        for trial in self.trials:
+            spatial_filter.add_trial(trial)
+
+        # Trial i of n is weighted with exp(-(n - 1 - i) / memory)
+        weights = np.exp(-np.arange(len(self.trials))[::-1] / 20.0)
+        scatter = np.einsum("t,tsc,tsd->cd", weights, self.trials, self.trials)
+        expected = scatter / (np.sum(weights) * self.trials.shape[1])
+        np.testing.assert_allclose(spatial_filter.get_noise_covariance(), expected)
+
+    def test_fit(self):
+        spatial_filter = SpatialFilter(self.num_channels, num_filters=2)
+        for trial in self.trials:
+            spatial_filter.add_trial(trial)
+
+        # Two classes that differ by a time course projected to the channels by one spatial pattern
+        pattern = np.arange(1.0, self.num_channels + 1)
+        time_course = np.sin(np.linspace(0, np.pi, 10))
+        class_averages = np.array([np.zeros((10, self.num_channels)), np.outer(time_course, pattern)])
+        filters = spatial_filter.fit(class_averages)
+        self.assertEqual(filters.shape, (self.num_channels, 2))
+
+        # The best filter for a single pattern is the noise-whitened pattern
+        expected = np.linalg.solve(spatial_filter.get_noise_covariance(), pattern)
+        cosine = filters[:, 0] @ expected / (np.linalg.norm(filters[:, 0]) * np.linalg.norm(expected))
+        self.assertAlmostEqual(abs(cosine), 1.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,9 +1,15 @@
 import multiprocessing as mp
 import time
+from typing import Optional
 
-from pylsl import IRREGULAR_RATE, StreamInfo, StreamOutlet
+import numpy as np
+from pylsl import IRREGULAR_RATE, StreamInfo, StreamOutlet, local_clock
 
 from testserver.bcnidata import BCNIData
+from testserver.recording import Recording
+
+# Entries of the statistics array of a server
+STATISTICS = ("samples sent", "samples dropped", "lag seconds")
 
 
 class BCNIDataServer(mp.Process):
@@ -11,35 +17,81 @@ class BCNIDataServer(mp.Process):
 
     Inherits form multiprocessing.Process so instantiate and call self.start()
 
+    Samples are paced against the monotonic LSL clock (pylsl.local_clock()): the number of samples due is computed from
+    the start of streaming, so the server catches up after sleeping too long instead of drifting. Samples are pushed in
+    chunks of chunk_size with push_chunk and get timestamps at exactly the nominal samplerate. To emulate other
+    amplifiers, the recording can be played at any samplerate and with any number of channels (see
+    testserver.recording.Recording.get_chunk()). The achieved samplerate is printed every report_interval seconds.
+
+    Instead of a BNCI Horizon recording, any testserver.recording.Recording can be streamed, e.g. synthetic data with
+    known targets (testserver.synthetic.SyntheticData).
+
+    Several servers can run side by side (see testserver.fleet.ServerFleet): stream names and source IDs get
+    name_suffix, a common start_time aligns their samples, and the number of sent and dropped samples as well as the
+    lag are published in statistics.
+
     Args:
-        filename: This will be passed on as the filname argument to a testserver.BNCIData instance
+        subject_number: This will be passed on as the subject_number argument to a testserver.BNCIData instance
+        samplerate: Samplerate of the stream. Optional, defaults to the samplerate of the recording
+        num_channels: Number of channels of the stream. Optional, defaults to the channels of the recording
+        chunk_size: Number of samples pushed at once. Optional, defaults to 1
+        report_interval: Seconds between two reports of the achieved samplerate, None disables the reports. Optional,
+            defaults to 10
+        data: Recording that is streamed instead of the one of subject_number (which is then not loaded). Optional,
+            defaults to None
+        name_suffix: Appended to the stream names and source IDs. Optional, defaults to ""
+        start_time: LSL time (pylsl.local_clock()) of the first sample, streaming starts then. Optional, defaults to
+            the time the server is started
+        max_lag: If given, samples that are more than max_lag seconds overdue are dropped instead of being sent late,
+            as by an amplifier with a full buffer. Optional, defaults to None
+        statistics: Shared array (multiprocessing.Array("d", len(STATISTICS))) the STATISTICS are written to.
+            Optional, defaults to None
 
     """
 
-    def __init__(self, subject_number: int):
+    def __init__(
+        self,
+        subject_number: int,
+        samplerate: Optional[float] = None,
+        num_channels: Optional[int] = None,
+        chunk_size: int = 1,
+        report_interval: Optional[float] = 10.0,
+        data: Optional[Recording] = None,
+        name_suffix: str = "",
+        start_time: Optional[float] = None,
+        max_lag: Optional[float] = None,
+        statistics: Optional[mp.Array] = None,
+    ):
         mp.Process.__init__(self)
-        self.data = BCNIData(subject_number)
+        self.data = BCNIData(subject_number) if data is None else data
+        self.samplerate = self.data.samplerate if samplerate is None else samplerate
+        self.num_channels = self.data.num_channels if num_channels is None else num_channels
+        self.chunk_size = chunk_size
+        self.report_interval = report_interval
+        self.name_suffix = name_suffix
+        self.start_time = start_time
+        self.max_lag = max_lag
+        self.statistics = statistics
 
     # noinspection PyAttributeOutsideInit
     def second_init(self):
         """Used because otherwise multiprocessing cannot pickle LSL instances"""
 
         # LSL Settings
-        self.eeg_streamname = "testeeg_stream"
-        self.marker_streamname = "marker_stream"
-        self.period_time = 1.0 / self.data.samplerate  # seconds
+        self.eeg_streamname = "testeeg_stream" + self.name_suffix
+        self.marker_streamname = "marker_stream" + self.name_suffix
 
         # EEG stream
         self.eeg_info = StreamInfo(
             name=self.eeg_streamname,
-            nominal_srate=self.data.samplerate,
+            nominal_srate=self.samplerate,
             type="EEG",
-            channel_count=self.data.num_channels,
+            channel_count=self.num_channels,
             channel_format="float32",
-            source_id="eeg_stream_test",
+            source_id="eeg_stream_test" + self.name_suffix,
             handle=None,
         )
-        self.lsl_eeg = StreamOutlet(self.eeg_info)
+        self.lsl_eeg = StreamOutlet(self.eeg_info, self.chunk_size)
 
         # Marker Stream
         self.marker_info = StreamInfo(
@@ -48,12 +100,12 @@ class BCNIDataServer(mp.Process):
             nominal_srate=IRREGULAR_RATE,
             channel_count=1,
             channel_format="int8",
-            source_id="marker_stream",
+            source_id="marker_stream" + self.name_suffix,
             handle=None,
         )
         self.marker_info.desc().append_child_value("flash_mode", self.data.flash_mode)
-        self.marker_info.desc().append_child_value("num_rows", "6")
-        self.marker_info.desc().append_child_value("num_cols", "6")
+        self.marker_info.desc().append_child_value("num_rows", str(self.data.num_rows))
+        self.marker_info.desc().append_child_value("num_cols", str(self.data.num_cols))
         self.lsl_marker = StreamOutlet(self.marker_info)
 
     def run(self):
@@ -63,20 +115,54 @@ class BCNIDataServer(mp.Process):
         print("Server started...")
         print("EEG samples stream: '" + self.eeg_streamname + "'")
         print("P300 Markers stream: '" + self.marker_streamname + "'")
+        print(f"{self.num_channels} channels at {self.samplerate} Hz in chunks of {self.chunk_size} samples")
 
         # Hack to start later in the dataset
-        self.data.set_counter(3000)
-
+        self.data.set_counter(int(3000 * self.samplerate / self.data.samplerate))
+
+        start_time = local_clock() if self.start_time is None else self.start_time
+        time.sleep(max(start_time - local_clock(), 0))
+        # Samples sent or dropped (the position in the recording) and dropped
+        num_sent = 0
+        num_dropped = 0
+        last_report_time = start_time
+        last_report_num_pushed = 0
         while True:
-            timestamp = self.data.get_timestamp()
-            eeg_data = self.data.get_eeg_data()
-            marker = self.data.get_marker()
-            self.data.increase_counter()
-
-            self.lsl_eeg.push_sample(eeg_data, timestamp)
-
-            # Push only non zero markers
-            if marker[0] != 0:
-                self.lsl_marker.push_sample(marker, timestamp)
-
-            time.sleep(self.period_time)
+            now = local_clock()
+            num_due = int((now - start_time) * self.samplerate)
+            if self.max_lag is not None and num_due - num_sent > self.max_lag * self.samplerate:
+                # Skip all overdue chunks
+                num_skipped = (num_due - num_sent) // self.chunk_size * self.chunk_size
+                self.data.set_counter(self.data.counter + num_skipped)
+                num_sent += num_skipped
+                num_dropped += num_skipped
+            while num_due - num_sent >= self.chunk_size:
+                self.push_chunk(start_time, num_sent)
+                num_sent += self.chunk_size
+
+            lag = local_clock() - start_time - num_sent / self.samplerate
+            if self.statistics is not None:
+                self.statistics[:] = [num_sent - num_dropped, num_dropped, lag]
+
+            if self.report_interval is not None and now - last_report_time >= self.report_interval:
+                num_pushed = num_sent - num_dropped
+                print(
+                    f"Streaming at {(num_pushed - last_report_num_pushed) / (now - last_report_time):.1f} Hz (nominal "
+                    f"{self.samplerate} Hz), {lag * 1000:.1f} ms behind, {num_dropped} samples dropped"
+                )
+                last_report_time = now
+                last_report_num_pushed = num_pushed
+
+            next_chunk_time = start_time + (num_sent + self.chunk_size) / self.samplerate
+            time.sleep(max(next_chunk_time - local_clock(), 0))
+
+    def push_chunk(self, start_time: float, num_sent: int):
+        """Pushes the next chunk, whose first sample is the sample num_sent after start_time"""
+        eeg_data, markers = self.data.get_chunk(self.chunk_size, self.samplerate, self.num_channels)
+        timestamps = start_time + (num_sent + np.arange(self.chunk_size)) / self.samplerate
+
+        self.lsl_eeg.push_chunk(np.ascontiguousarray(eeg_data, dtype=np.float32), timestamps[-1])
+
+        # Push only non zero markers
+        for marker, timestamp in zip(markers[markers != 0], timestamps[markers != 0]):
+            self.lsl_marker.push_sample([int(marker)], timestamp)
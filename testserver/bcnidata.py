@@ -3,38 +3,41 @@ import ssl
 import urllib.request
 
 import certifi
+import numpy as np
 from scipy import io
 
 from testserver.constants import BNCI_CACHE_DIR, BNCI_HORIZON_DATA_URL
+from testserver.recording import Recording
 
+# Arrays of a subject that are cached as .npy files
+CACHED_ARRAYS = ("timestamps", "eeg_data", "markers", "target")
 
-class BCNIData(object):
+
+class BCNIData(Recording):
     """Wrapper for a recordings from the BNCI Horizon Project
 
+    The .mat file of a subject is only parsed once, the preprocessed arrays (CACHED_ARRAYS) are then cached as .npy
+    files in BNCI_CACHE_DIR/s{subject_number}/ and memory-mapped on later starts. The .mat file is only downloaded if
+    the cache is missing.
+
     Args:
-        filename: Filename to load, e.g. 's1.mat'
+        subject_number: Number of the subject to load, e.g. 1 for 's1.mat'
 
     """
 
     def __init__(self, subject_number: int):
+        Recording.__init__(self, 256)
         self.subject_number = subject_number
         self.filename = os.path.join(BNCI_CACHE_DIR, f"s{subject_number}.mat")
-        print(self.filename)
-        self._download_data_if_not_present(subject_number)
-        self.counter = 0
-
-        self.timestamps = []
-        self.eeg_data = []
-        self.markers = []
-        self.target = []
-        self.length = None
-        self.flash_mode = "Single Value"
-        self.samplerate = 256  # Hz
-        self.num_channels = None
+        self.cache_directory = os.path.join(BNCI_CACHE_DIR, f"s{subject_number}")
 
         self.matrix = None
 
-        self.load_file()
+        if not self.load_cache():
+            print(self.filename)
+            self._download_data_if_not_present(subject_number)
+            self.load_file()
+            self.write_cache()
 
     def _download_data_if_not_present(self, subject_number: int):
         if not os.path.isfile(self.filename):
@@ -51,20 +54,27 @@ class BCNIData(object):
                 out_file.write(subject_data)
             print("Done.")
 
-    def get_timestamp(self):
-        return self.timestamps[self.counter % self.length]
-
-    def get_eeg_data(self):
-        return self.eeg_data[:, self.counter % self.length]
+    def get_cache_path(self, name: str):
+        return os.path.join(self.cache_directory, name + ".npy")
 
-    def get_marker(self):
-        return [int(self.markers[self.counter % self.length])]
-
-    def set_counter(self, value):
-        self.counter = value
+    def load_cache(self):
+        """Memory-maps the cached arrays, returns False if they are not cached"""
+        if not all(os.path.isfile(self.get_cache_path(name)) for name in CACHED_ARRAYS):
+            return False
+        for name in CACHED_ARRAYS:
+            setattr(self, name, np.load(self.get_cache_path(name), mmap_mode="r"))
+        self.length = len(self.timestamps)
+        self.num_channels = len(self.eeg_data)
+        return True
 
-    def increase_counter(self):
-        self.counter += 1
+    def write_cache(self):
+        """Writes the arrays to the cache, every file is replaced atomically so that servers starting in parallel never
+        read partial files"""
+        os.makedirs(self.cache_directory, exist_ok=True)
+        for name in CACHED_ARRAYS:
+            temporary_path = self.get_cache_path(f"{name}.{os.getpid()}.tmp")
+            np.save(temporary_path, np.ascontiguousarray(getattr(self, name)))
+            os.replace(temporary_path, self.get_cache_path(name))
 
     def load_file(self):
         # axis: [filename][0][0][train/test]
@@ -81,15 +91,11 @@ class BCNIData(object):
 
 
 def normalize_markers(markers):
-    """Removes additional markers if there is more than one"""
+    """Removes additional markers if there is more than one, only the first sample of every flash keeps its marker"""
     init = 2
-    new_flash_ids = markers[0:init].tolist()
-    number_of_ids = len(markers)
-
-    for i in range(init, number_of_ids):
-        if markers[i] != 0 and markers[i - 1] == 0:
-            new_flash_ids.append(markers[i])
-        else:
-            new_flash_ids.append(0)
+    markers = np.asarray(markers)
+    new_flash_ids = markers.copy()
+    rising_edges = (markers[init:] != 0) & (markers[init - 1 : -1] == 0)
+    new_flash_ids[init:] = np.where(rising_edges, markers[init:], 0)
 
     return new_flash_ids
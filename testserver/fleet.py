@@ -0,0 +1,101 @@
+import multiprocessing as mp
+import time
+from typing import Optional, Sequence
+
+import numpy as np
+from pylsl import local_clock
+
+from testserver.bcni_data_server import STATISTICS, BCNIDataServer
+from testserver.synthetic import SyntheticData
+
+
+class ServerFleet(object):
+    """Several BCNIDataServer processes streaming side by side, e.g. to load test analyzers with many amplifiers
+
+    Server i streams "testeeg_stream_i" and "marker_stream_i" (with unique source IDs) of the subjects in turn, or
+    synthetic data (testserver.synthetic.SyntheticData, seeded with i) if snr is given. All servers start at the same
+    LSL time, so sample k of every server has the same timestamp. Sent and dropped samples and the lag of every server
+    are collected in shared arrays and summarized by self.get_summary().
+
+    Args:
+        num_servers: Number of servers
+        subjects: BNCI Horizon subjects streamed by the servers in turn. Optional, defaults to subject 1
+        samplerate: Samplerate of every stream. Optional, defaults to the samplerate of the recordings
+        num_channels: Number of channels of every stream. Optional, defaults to the channels of the recordings
+        chunk_size: Number of samples pushed at once. Optional, defaults to 1
+        max_lag: If given, servers drop samples that are more than max_lag seconds overdue. Optional, defaults to None
+        snr: If given, synthetic data with this SNR is streamed instead of the recordings. Optional, defaults to None
+        start_delay: Seconds from self.start() to the common start of streaming, which has to be long enough to start
+            all processes. Optional, defaults to 2
+
+    """
+
+    def __init__(
+        self,
+        num_servers: int,
+        subjects: Sequence[int] = (1,),
+        samplerate: Optional[float] = None,
+        num_channels: Optional[int] = None,
+        chunk_size: int = 1,
+        max_lag: Optional[float] = None,
+        snr: Optional[float] = None,
+        start_delay: float = 2.0,
+    ):
+        self.num_servers = num_servers
+        self.subjects = subjects
+        self.samplerate = samplerate
+        self.num_channels = num_channels
+        self.chunk_size = chunk_size
+        self.max_lag = max_lag
+        self.snr = snr
+        self.start_delay = start_delay
+
+        self.servers = []
+        self.statistics = [mp.Array("d", len(STATISTICS)) for _ in range(num_servers)]
+
+    def start(self):
+        start_time = local_clock() + self.start_delay
+        for index in range(self.num_servers):
+            data = None
+            if self.snr is not None:
+                data = SyntheticData(self.num_channels or 8, self.samplerate or 256, snr=self.snr, seed=index)
+            server = BCNIDataServer(
+                self.subjects[index % len(self.subjects)],
+                self.samplerate,
+                self.num_channels,
+                self.chunk_size,
+                report_interval=None,
+                data=data,
+                name_suffix=f"_{index}",
+                start_time=start_time,
+                max_lag=self.max_lag,
+                statistics=self.statistics[index],
+            )
+            server.daemon = True
+            server.start()
+            self.servers.append(server)
+
+    def get_statistics(self):
+        """Returns the STATISTICS of all servers as array of shape (num_servers, len(STATISTICS))"""
+        return np.array([statistics[:] for statistics in self.statistics])
+
+    def get_summary(self, previous_statistics, seconds: float):
+        """Returns a message with the throughput since previous_statistics (self.get_statistics() seconds ago), the
+        dropped samples and the lag of all servers"""
+        statistics = self.get_statistics()
+        rates = (statistics[:, 0] - previous_statistics[:, 0]) / seconds
+        return (
+            f"{self.num_servers} servers: {np.sum(rates):.0f} samples/s in total ({np.min(rates):.1f} to "
+            f"{np.max(rates):.1f} Hz per server, nominal {self.servers[0].samplerate} Hz), "
+            f"{int(np.sum(statistics[:, 1]))} samples dropped, max lag {np.max(statistics[:, 2]) * 1000:.1f} ms"
+        )
+
+    def run(self, report_interval: float = 10.0):
+        """Starts the servers and prints a summary every report_interval seconds"""
+        self.start()
+        time.sleep(self.start_delay)
+        statistics = self.get_statistics()
+        while True:
+            time.sleep(report_interval)
+            print(self.get_summary(statistics, report_interval))
+            statistics = self.get_statistics()
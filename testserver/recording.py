@@ -0,0 +1,73 @@
+from typing import Optional
+
+import numpy as np
+
+
+class Recording(object):
+    """P300 speller recording held in memory that is played in a loop, sample by sample or in chunks
+
+    Subclasses fill eeg_data (shape (num_channels, length)), markers (shape (length,), non zero only at the first
+    sample of a flash), target (1 at the first sample of flashes of the target) and the metadata.
+
+    Args:
+        samplerate: Samplerate of the recording in Hz
+        flash_mode: Flash mode sent with the marker stream. Optional, defaults to "Single Value"
+        num_rows: Number of rows of the speller matrix. Optional, defaults to 6
+        num_cols: Number of columns of the speller matrix. Optional, defaults to 6
+
+    """
+
+    def __init__(self, samplerate: float, flash_mode: str = "Single Value", num_rows: int = 6, num_cols: int = 6):
+        self.counter = 0
+
+        self.timestamps = []
+        self.eeg_data = []
+        self.markers = []
+        self.target = []
+        self.length = None
+        self.flash_mode = flash_mode
+        self.samplerate = samplerate  # Hz
+        self.num_channels = None
+        self.num_rows = num_rows
+        self.num_cols = num_cols
+
+    def get_timestamp(self):
+        return self.timestamps[self.counter % self.length]
+
+    def get_eeg_data(self):
+        return self.eeg_data[:, self.counter % self.length]
+
+    def get_marker(self):
+        return [int(self.markers[self.counter % self.length])]
+
+    def get_chunk(self, num_samples: int, samplerate: Optional[float] = None, num_channels: Optional[int] = None):
+        """Returns (eeg, markers) of the next num_samples samples and increases the counter by num_samples
+
+        eeg has shape (num_samples, num_channels) and markers shape (num_samples,). With another samplerate, the
+        recording is played at this samplerate by repeating (or skipping) samples, markers are only sent with the first
+        repetition. With more (or less) channels, the channels of the recording are tiled (or cut). The counter is in
+        samples at the given samplerate then.
+
+        """
+        if samplerate is None:
+            samplerate = self.samplerate
+        if num_channels is None:
+            num_channels = self.num_channels
+
+        # Samples of the recording played at the counter values counter - 1, ..., counter + num_samples - 1
+        counters = np.arange(self.counter - 1, self.counter + num_samples)
+        recording_indices = np.floor(counters * (self.samplerate / samplerate)).astype(int)
+        new_sample = recording_indices[1:] != recording_indices[:-1]
+        recording_indices = recording_indices[1:] % self.length
+        self.counter += num_samples
+
+        # Only the samples of the chunk are copied, not the whole recording
+        eeg = self.eeg_data[np.ix_(np.arange(num_channels) % self.num_channels, recording_indices)].T
+        markers = np.where(new_sample, self.markers[recording_indices], 0)
+        return eeg, markers
+
+    def set_counter(self, value):
+        self.counter = value
+
+    def increase_counter(self):
+        self.counter += 1
@@ -0,0 +1,133 @@
+import numpy as np
+
+from testserver.recording import Recording
+
+# Only modes the analyzer can consume: it expects num_rows * num_cols classes, so row and column flashes would never
+# complete its classes
+FLASH_MODES = ("Single Value",)
+
+
+class SyntheticData(Recording):
+    """Synthetic P300 speller recording, generated without any download for any channel count and samplerate
+
+    Noise is generated per channel in the frequency domain: white noise shaped to a 1 / f^noise_exponent spectrum, plus
+    an alpha rhythm and power line noise, scaled to noise_amplitude (standard deviation in volts). As it is generated
+    over the whole (circular) recording, it continues seamlessly when the recording is played in a loop.
+
+    Every flash_interval seconds one class is flashed, every sequence flashes all classes once in random order. Every
+    symbol of the num_rows x num_cols matrix is a class (markers 1 to num_rows * num_cols, "Single Value" mode). A
+    random target symbol is spelled for sequences_per_symbol sequences, then the next one. After every flash of the
+    target, a P300 (positive peak p300_latency seconds after the flash) is added with its peak amplitude at snr times
+    noise_amplitude on the middle channels, falling to half of it on the first and last channel.
+
+    The ground truth is in self.target (1 at the first sample of every target flash, as in
+    testserver.bcnidata.BCNIData) and self.targets, which holds the target marker for every sample (shape (length,
+    1)).
+
+    Args:
+        num_channels: Number of channels
+        samplerate: Samplerate in Hz
+        seconds: Length of the recording that is played in a loop. Optional, defaults to 60
+        snr: Peak amplitude of the P300 relative to the noise standard deviation. Optional, defaults to 0.5
+        flash_mode: One of FLASH_MODES. Optional, defaults to "Single Value"
+        num_rows: Number of rows of the speller matrix. Optional, defaults to 6
+        num_cols: Number of columns of the speller matrix. Optional, defaults to 6
+        flash_interval: Seconds between two flashes. Optional, defaults to 0.125
+        sequences_per_symbol: Number of sequences per spelled symbol. Optional, defaults to 10
+        noise_amplitude: Standard deviation of the noise in volts. Optional, defaults to 10e-6
+        noise_exponent: Exponent of the 1 / f^noise_exponent noise spectrum (0 is white, 1 pink noise). Optional,
+            defaults to 1
+        alpha_amplitude: Amplitude of the alpha rhythm (10 Hz) relative to noise_amplitude. Optional, defaults to 0.5
+        line_amplitude: Amplitude of the line noise relative to noise_amplitude. Optional, defaults to 0.2
+        line_freq: Frequency of the line noise in Hz. Optional, defaults to 50
+        p300_latency: Seconds from the flash to the peak of the P300. Optional, defaults to 0.3
+        seed: Seed of the random generator. Optional, defaults to 0
+
+    """
+
+    def __init__(
+        self,
+        num_channels: int,
+        samplerate: float,
+        seconds: float = 60,
+        snr: float = 0.5,
+        flash_mode: str = "Single Value",
+        num_rows: int = 6,
+        num_cols: int = 6,
+        flash_interval: float = 0.125,
+        sequences_per_symbol: int = 10,
+        noise_amplitude: float = 10e-6,
+        noise_exponent: float = 1.0,
+        alpha_amplitude: float = 0.5,
+        line_amplitude: float = 0.2,
+        line_freq: float = 50.0,
+        p300_latency: float = 0.3,
+        seed: int = 0,
+    ):
+        Recording.__init__(self, samplerate, flash_mode, num_rows, num_cols)
+        if flash_mode not in FLASH_MODES:
+            raise ValueError(f"flash_mode has to be one of {FLASH_MODES}, not '{flash_mode}'")
+        self.num_channels = num_channels
+        self.length = int(seconds * samplerate)
+        self.timestamps = np.arange(self.length) / samplerate
+        self.snr = snr
+        self.noise_amplitude = noise_amplitude
+        self.p300_latency = p300_latency
+        random_state = np.random.RandomState(seed)
+
+        self.eeg_data = self.create_noise(random_state, noise_exponent, alpha_amplitude, line_amplitude, line_freq)
+        self.markers, self.targets = self.create_flashes(random_state, flash_interval, sequences_per_symbol)
+        self.target = np.any(self.markers[:, np.newaxis] == self.targets, axis=1).astype(int)
+        self.add_p300()
+
+    def create_noise(self, random_state, noise_exponent, alpha_amplitude, line_amplitude, line_freq):
+        """Returns noise of shape (num_channels, length) with the spectrum described in the class docstring"""
+        freqs = np.fft.rfftfreq(self.length, 1.0 / self.samplerate)
+        # 1 / f^exponent power spectrum, flat below 1 Hz
+        amplitudes = np.maximum(freqs, 1.0) ** (-noise_exponent / 2)
+        spectrum = random_state.normal(size=(self.num_channels, len(freqs))) + 1j * random_state.normal(
+            size=(self.num_channels, len(freqs))
+        )
+        noise = np.fft.irfft(spectrum * amplitudes, self.length, axis=1)
+        noise *= self.noise_amplitude / np.std(noise, axis=1, keepdims=True)
+
+        times = self.timestamps[np.newaxis, :]
+        phases = random_state.uniform(0, 2 * np.pi, (self.num_channels, 2))
+        noise += alpha_amplitude * self.noise_amplitude * np.sin(2 * np.pi * 10 * times + phases[:, :1])
+        if line_freq < self.samplerate / 2:
+            noise += line_amplitude * self.noise_amplitude * np.sin(2 * np.pi * line_freq * times + phases[:, 1:])
+        return noise.astype(np.float32)
+
+    def create_flashes(self, random_state, flash_interval, sequences_per_symbol):
+        """Returns markers of shape (length,) and the target marker of the spelled symbol of shape (length, 1)"""
+        num_classes = self.num_rows * self.num_cols
+        onsets = np.arange(0, self.length, int(round(flash_interval * self.samplerate)))
+
+        # Every sequence is a random permutation of all classes
+        num_sequences = -(-len(onsets) // num_classes)
+        sequences = np.argsort(random_state.uniform(size=(num_sequences, num_classes)), axis=1) + 1
+        markers = np.zeros(self.length, dtype=int)
+        markers[onsets] = sequences.ravel()[: len(onsets)]
+
+        # Spelled symbols (counting from zero) of every flash
+        flashes_per_symbol = sequences_per_symbol * num_classes
+        symbols = random_state.randint(0, num_classes, -(-len(onsets) // flashes_per_symbol))
+        flash_targets = np.repeat(symbols, flashes_per_symbol)[: len(onsets), np.newaxis] + 1
+
+        # Every sample belongs to the symbol of the last flash before it
+        flash_indices = np.maximum(np.searchsorted(onsets, np.arange(self.length), "right") - 1, 0)
+        return markers, flash_targets[flash_indices]
+
+    def add_p300(self):
+        """Adds a P300 after every target flash, wrapping around the end of the recording"""
+        times = np.arange(int(self.samplerate)) / self.samplerate
+        waveform = self.snr * self.noise_amplitude * np.exp(-((times - self.p300_latency) ** 2) / (2 * 0.05 ** 2))
+        channels = np.arange(self.num_channels)
+        center = (self.num_channels - 1) / 2
+        pattern = 1 - 0.5 * ((channels - center) / max(center, 1)) ** 2
+
+        target_onsets = np.flatnonzero(self.target)
+        indices = (target_onsets[:, np.newaxis] + np.arange(len(waveform))) % self.length
+        p300 = np.zeros(self.length)
+        np.add.at(p300, indices.ravel(), np.tile(waveform, len(target_onsets)))
+        self.eeg_data += (pattern[:, np.newaxis] * p300).astype(np.float32)